@@ -3,15 +3,28 @@
 Flask Web应用 - Token计算工具
 """
 
+import io
+import json
 import os
 import sys
 import threading
+import time
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify
-from werkzeug.utils import secure_filename
+from flask import Flask, Request, Response, g, render_template, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 
 # 导入核心逻辑
-from calculate_tokens import TokenCalculator, MODELS
+from calculate_tokens import CHUNK_SNAP_MODES, DecodingReader, TokenCalculator, MODELS, iter_text_chunks
+from edit_session import EditError, EditSession, SessionStore, VersionConflict
+from token_store import TokenStore
+from metrics import (
+    REGISTRY, REQUEST_BYTES, REQUEST_SECONDS, TOKENIZER_BYTES, TOKENIZER_LOAD_SECONDS, TOKENIZER_POOL_INSTANCES,
+    RequestTimings
+)
+from id_codec import (
+    FORMAT_BINARY, FORMAT_JSON, FORMAT_MSGPACK, IDS_ENCODING, IDS_ENCODING_BASE64, MIMETYPES,
+    ids_base64, ids_buffer, iter_binary, negotiate, pack_msgpack
+)
 
 # 设置模板和静态文件路径
 # 在打包后的环境中，需要根据实际情况调整路径
@@ -26,51 +39,377 @@ else:
     template_dir = base_path / 'web' / 'templates'
     static_dir = base_path / 'web' / 'static'
 
-app = Flask(__name__, template_folder=str(template_dir), static_folder=str(static_dir))
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-app.config['UPLOAD_FOLDER'] = Path(__file__).parent / 'uploads'
+# 以原始请求体上传（而不是表单）的文件类型，边接收边解码计数，不经过表单解析
+RAW_UPLOAD_MIMETYPES = ('application/octet-stream', 'text/plain')
+
+
+class TokenRequest(Request):
+    """请求类：原始请求体上传使用单独的大小上限，表单中的文件只保存在内存中，不写临时文件"""
+    
+    @property
+    def max_content_length(self):
+        if self.mimetype in RAW_UPLOAD_MIMETYPES:
+            return app.config['MAX_STREAM_UPLOAD_LENGTH']
+        return app.config['MAX_CONTENT_LENGTH']
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # 表单大小受MAX_CONTENT_LENGTH限制，直接放在内存中
+        return io.BytesIO()
 
-# 确保上传目录存在
-app.config['UPLOAD_FOLDER'].mkdir(exist_ok=True)
 
-# 全局tokenizer计算器（延迟加载）
+app = Flask(__name__, template_folder=str(template_dir), static_folder=str(static_dir))
+app.request_class = TokenRequest
+# 表单/JSON请求的大小上限（MB，表单上传的文件需要完整保留以便分页查看token详情）
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 16)) * 1024 * 1024
+# 原始请求体流式上传的大小上限（MB），边接收边计数，内存占用与文件大小无关
+app.config['MAX_STREAM_UPLOAD_LENGTH'] = int(os.environ.get('MAX_STREAM_UPLOAD_MB', 1024)) * 1024 * 1024
+# 多模型并行编码的线程数（未设置时取模型数与CPU核数的较小值）
+app.config['TOKEN_WORKERS'] = int(os.environ['TOKEN_WORKERS']) if os.environ.get('TOKEN_WORKERS') else None
+# tokenizer后端：auto（有tokenizer.json时使用轻量的tokenizers库）、tokenizers、transformers
+app.config['TOKENIZER_BACKEND'] = os.environ.get('TOKENIZER_BACKEND', 'auto')
+# 是否在服务启动时于后台并行预加载所有tokenizer（否则每个模型第一次被请求时才加载）
+app.config['TOKENIZER_PRELOAD'] = os.environ.get('TOKENIZER_PRELOAD', 'True').lower() == 'true'
+# 已加载tokenizer的内存预算（MB，估计值），超出时卸载最久未使用的，0表示不限制
+app.config['TOKENIZER_MEMORY_MB'] = int(os.environ.get('TOKENIZER_MEMORY_MB', 0))
+# 每个tokenizer的实例池上限：并发请求编码同一模型时按需克隆，每次编码独占一个实例（未设置时取CPU核数）
+app.config['TOKENIZER_POOL_SIZE'] = int(os.environ['TOKENIZER_POOL_SIZE']) if os.environ.get('TOKENIZER_POOL_SIZE') else None
+# 编码结果缓存的内存预算（MB），0表示不缓存
+app.config['TOKEN_CACHE_MB'] = int(os.environ.get('TOKEN_CACHE_MB', 256))
+# 超过该耗时（毫秒）的请求打印各阶段耗时明细，0表示不记录
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+# 微批处理：并发请求中同一tokenizer的编码在窗口内（毫秒，0表示不合并）合并为一次encode_batch，每批最多TOKEN_BATCH_MAX个
+# （只有该tokenizer已有一批正在编码时才等待窗口，没有并发时立即执行）
+app.config['TOKEN_BATCH_WINDOW_MS'] = float(os.environ.get('TOKEN_BATCH_WINDOW_MS', 2))
+app.config['TOKEN_BATCH_MAX'] = int(os.environ.get('TOKEN_BATCH_MAX', 32))
+# 分页查询token详情用的编码结果暂存：过期时间（秒，按最后一次访问计算）和内存预算（MB）
+app.config['TOKEN_STORE_TTL'] = int(os.environ.get('TOKEN_STORE_TTL', 600))
+app.config['TOKEN_STORE_MB'] = int(os.environ.get('TOKEN_STORE_MB', 256))
+# 增量编码会话（/api/session）：过期时间（秒，按最后一次访问计算）和内存预算（MB）
+app.config['TOKEN_SESSION_TTL'] = int(os.environ.get('TOKEN_SESSION_TTL', 1800))
+app.config['TOKEN_SESSION_MB'] = int(os.environ.get('TOKEN_SESSION_MB', 256))
+# /api/tokens每页的默认和最大token数
+app.config['TOKEN_PAGE_SIZE'] = int(os.environ.get('TOKEN_PAGE_SIZE', 1000))
+app.config['TOKEN_PAGE_MAX'] = int(os.environ.get('TOKEN_PAGE_MAX', 10000))
+
+# 全局tokenizer计算器（服务启动时在后台线程中创建并预热）
 _calculator = None
-_calculator_lock = threading.Lock()  # 添加锁防止并发问题
+_calculator_lock = threading.Lock()  # 保证后台加载线程只启动一次
+_loader_thread = None
+# 加载状态：idle（未开始）、loading、ready、degraded（部分tokenizer加载失败）、error
+_load_state = {
+    'status': 'idle',
+    'started_at': None,
+    'load_seconds': None,
+    'error': None
+}
+# 服务加载中时，建议客户端重试的间隔（秒）
+RETRY_AFTER_SECONDS = 5
 
+# /api/calculate流式响应支持的格式
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream'
+}
 
-def get_calculator():
-    """获取或创建TokenCalculator实例（单例模式，线程安全）"""
+# 计算请求的编码结果暂存区（/api/tokens分页读取）
+token_store = TokenStore(app.config['TOKEN_STORE_TTL'], app.config['TOKEN_STORE_MB'] * 1024 * 1024)
+# 增量编码会话（/api/session创建，/api/session/<session_id>/edit修改）
+session_store = SessionStore(app.config['TOKEN_SESSION_TTL'], app.config['TOKEN_SESSION_MB'] * 1024 * 1024)
+
+
+def _create_calculator():
+    """创建TokenCalculator实例（延迟加载模式，不在此处加载tokenizer）"""
+    # 检查是否有本地tokenizer
+    # 在打包后的环境中，__file__可能指向临时目录，需要使用sys.executable的目录
+    if getattr(sys, 'frozen', False):
+        # PyInstaller打包后的环境
+        base_path = Path(sys.executable).parent
+    else:
+        # 开发环境
+        base_path = Path(__file__).parent
+    
+    tokenizers_dir = base_path / 'tokenizers'
+    local_mode = tokenizers_dir.exists() and any(tokenizers_dir.iterdir())
+    
+    options = {
+        'workers': app.config['TOKEN_WORKERS'],
+        'cache_bytes': app.config['TOKEN_CACHE_MB'] * 1024 * 1024,
+        'backend': app.config['TOKENIZER_BACKEND'],
+        'lazy': True,
+        'memory_budget': app.config['TOKENIZER_MEMORY_MB'] * 1024 * 1024,
+        'batch_window_ms': app.config['TOKEN_BATCH_WINDOW_MS'],
+        'max_batch_size': app.config['TOKEN_BATCH_MAX'],
+        'pool_size': app.config['TOKENIZER_POOL_SIZE']
+    }
+    if local_mode:
+        print("使用本地tokenizer模式")
+        return TokenCalculator(local_mode=True, tokenizers_dir=str(tokenizers_dir), **options)
+    print("使用在线tokenizer模式（需要网络连接）")
+    return TokenCalculator(local_mode=False, **options)
+
+
+def _warm_up():
+    """后台线程：创建计算器并并行预加载tokenizer"""
     global _calculator
-    with _calculator_lock:
-        if _calculator is None:
-            # 检查是否有本地tokenizer
-            # 在打包后的环境中，__file__可能指向临时目录，需要使用sys.executable的目录
-            if getattr(sys, 'frozen', False):
-                # PyInstaller打包后的环境
-                base_path = Path(sys.executable).parent
-            else:
-                # 开发环境
-                base_path = Path(__file__).parent
-            
-            tokenizers_dir = base_path / 'tokenizers'
-            local_mode = tokenizers_dir.exists() and any(tokenizers_dir.iterdir())
-            
-            if local_mode:
-                print("使用本地tokenizer模式")
-                _calculator = TokenCalculator(local_mode=True, tokenizers_dir=str(tokenizers_dir))
-            else:
-                print("使用在线tokenizer模式（需要网络连接）")
-                _calculator = TokenCalculator(local_mode=False)
+    start = time.perf_counter()
+    try:
+        calculator = _create_calculator()
+        if app.config['TOKENIZER_PRELOAD']:
+            calculator.preload()
+        _calculator = calculator
         
         # 验证tokenizers字典完整性
-        if _calculator:
-            tokenizer_count = len(_calculator.tokenizers)
-            if tokenizer_count == 0:
-                print("错误: tokenizers字典为空！")
-            elif tokenizer_count < len(MODELS):
-                print(f"警告: 只加载了 {tokenizer_count}/{len(MODELS)} 个tokenizer")
-        
-        return _calculator
+        if not calculator.usable_models():
+            print("错误: 没有可用的tokenizer！")
+            status = 'error'
+        elif calculator.load_errors:
+            print(f"警告: {len(calculator.load_errors)} 个tokenizer加载失败: {sorted(calculator.load_errors)}")
+            status = 'degraded'
+        else:
+            status = 'ready'
+    except BaseException as e:
+        # TokenCalculator在依赖缺失时会调用sys.exit，这里不能让后台线程静默退出
+        print(f"错误: 初始化TokenCalculator失败: {e}")
+        _load_state['error'] = str(e)
+        status = 'error'
+    _load_state['load_seconds'] = round(time.perf_counter() - start, 3)
+    _load_state['status'] = status
+    print(f"tokenizer加载完成（{status}），用时 {_load_state['load_seconds']:.2f} 秒")
+
+
+def start_background_loading():
+    """启动后台加载线程（只会启动一次）"""
+    global _loader_thread
+    with _calculator_lock:
+        if _loader_thread is None:
+            _load_state['status'] = 'loading'
+            _load_state['started_at'] = time.time()
+            _loader_thread = threading.Thread(target=_warm_up, name='tokenizer-loader', daemon=True)
+            _loader_thread.start()
+
+
+def get_calculator():
+    """
+    获取TokenCalculator实例（无锁读取，不会等待加载）
+    
+    Returns:
+        加载完成后返回计算器，加载中或加载失败时返回None
+    """
+    if _loader_thread is None:
+        # 未经app.py/run.py启动（例如由WSGI服务器导入），在第一次请求时开始加载
+        start_background_loading()
+    return _calculator
+
+
+def readiness_info():
+    """加载状态及每个模型的加载耗时"""
+    calculator = _calculator
+    return {
+        'status': _load_state['status'],
+        'started_at': _load_state['started_at'],
+        'load_seconds': _load_state['load_seconds'],
+        'error': _load_state['error'],
+        'model_load_seconds': {
+            model_key: round(seconds, 3)
+            for model_key, seconds in sorted(calculator.load_times.items())
+        } if calculator is not None else {}
+    }
+
+
+def not_ready_response(error_key: str = 'error'):
+    """
+    服务尚未就绪时的快速响应（503 + Retry-After），不阻塞等待加载
+    
+    Args:
+        error_key: 错误信息字段名（/api/health使用message）
+    """
+    status = _load_state['status']
+    if status == 'error':
+        message = f"TokenCalculator初始化失败: {_load_state['error'] or '没有可用的tokenizer'}"
+    else:
+        message = '服务正在加载tokenizer，请稍后重试'
+    response = jsonify({
+        'success': False,
+        'status': status,
+        error_key: message,
+        'readiness': readiness_info()
+    })
+    return response, 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
+
+
+def _loaded_calculator_values(getter):
+    """/metrics导出时从当前计算器读取按模型的值（加载完成前为空）"""
+    def collect():
+        calculator = _calculator
+        return {(model_key,): value for model_key, value in getter(calculator).items()} if calculator else {}
+    return collect
+
+
+TOKENIZER_LOAD_SECONDS.set_function(_loaded_calculator_values(lambda calculator: dict(calculator.load_times)))
+TOKENIZER_BYTES.set_function(_loaded_calculator_values(lambda calculator: calculator.tokenizer_bytes()))
+TOKENIZER_POOL_INSTANCES.set_function(_loaded_calculator_values(
+    lambda calculator: {model_key: pool.size for model_key, pool in list(calculator.pools.items())}))
+
+
+@app.before_request
+def _start_request_timer():
+    """记录请求开始时间和请求体大小"""
+    g.timings = RequestTimings()
+    if request.content_length:
+        REQUEST_BYTES.observe(request.content_length, _endpoint_label())
+
+
+@app.after_request
+def _record_request_duration(response):
+    """记录请求耗时，添加Server-Timing响应头，超过阈值时打印慢请求日志（流式响应只计到开始返回数据为止）"""
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    total = timings.total()
+    REQUEST_SECONDS.observe(total, _endpoint_label(), str(response.status_code))
+    response.headers['Server-Timing'] = timings.server_timing()
+    threshold = app.config['SLOW_REQUEST_MS']
+    if threshold > 0 and total * 1000 >= threshold:
+        breakdown = timings.as_dict()
+        print(f"[慢请求] {request.method} {request.path} {response.status_code} "
+              f"{breakdown['total_ms']:.1f}ms 请求体={request.content_length or 0}字节 "
+              f"{' '.join(f'{k}={v}' for k, v in timings.info.items())} "
+              f"阶段={breakdown['phases_ms']} 模型={breakdown['models_ms']}")
+    return response
+
+
+def _endpoint_label() -> str:
+    """请求对应的路由（未匹配的请求归为一类，避免标签数量无限增长）"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _flag(value) -> bool:
+    """解析请求中的布尔参数（true/1/yes/on）"""
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('true', '1', 'yes', 'on')
+
+
+def _request_flag(name: str) -> bool:
+    """从查询参数、表单或JSON请求体中读取布尔参数"""
+    if _flag(request.values.get(name)):
+        return True
+    data = request.get_json(silent=True)
+    return isinstance(data, dict) and _flag(data.get(name))
+
+
+def ids_response(response_data, encodings, ids_format: str):
+    """
+    构建包含token ID的响应，ID直接使用EncodeResult中的连续内存，不转换为Python int列表
+    
+    Args:
+        response_data: 响应的JSON部分
+        encodings: 模型键名到EncodeResult的映射
+        ids_format: 协商得到的格式（json/binary/msgpack）
+    """
+    id_arrays = [encodings[item['model']].ids for item in response_data['results']]
+    if ids_format == FORMAT_BINARY:
+        response = Response(iter_binary(response_data, response_data['results'], id_arrays),
+                            mimetype=MIMETYPES[FORMAT_BINARY])
+    elif ids_format == FORMAT_MSGPACK:
+        for item, ids in zip(response_data['results'], id_arrays):
+            item['ids'] = ids_buffer(ids)
+        response_data['ids_encoding'] = IDS_ENCODING
+        response = Response(pack_msgpack(response_data), mimetype=MIMETYPES[FORMAT_MSGPACK])
+    else:
+        for item, ids in zip(response_data['results'], id_arrays):
+            item['ids'] = ids_base64(ids)
+        response_data['ids_encoding'] = IDS_ENCODING_BASE64
+        response = jsonify(response_data)
+    response.vary.add('Accept')
+    return response
+
+
+def _result_item(calculator, model_key: str, encoding, text_length: int, include_tokens: bool):
+    """
+    单个模型的计算结果
+    
+    Args:
+        calculator: TokenCalculator实例
+        model_key: 模型键名
+        encoding: 该模型的编码结果
+        text_length: 文本字符数
+        include_tokens: 是否附带全部token字符串
+    """
+    token_count = encoding.count
+    ratio = text_length / token_count if token_count > 0 else 0
+    item = {
+        'model': model_key,
+        # 获取模型显示名称（优先从MODELS字典，否则使用key）
+        'model_name': MODELS.get(model_key, model_key),
+        'token_count': token_count,
+        'char_per_token': round(ratio, 2)
+    }
+    if include_tokens:
+        try:
+            tokens = calculator.decode_tokens(encoding.ids, model_key)
+        except Exception as e:
+            print(f"警告: 获取 {model_key} 的分词详情时出错: {e}")
+            tokens = []
+        item['token_preview'] = tokens
+        item['preview_count'] = len(tokens)
+    return item
+
+
+def _stream_format():
+    """请求的流式响应格式：stream参数（ndjson/sse）或Accept头，不要求流式时返回None"""
+    value = request.values.get('stream')
+    if value is None:
+        data = request.get_json(silent=True)
+        value = data.get('stream') if isinstance(data, dict) else None
+    if value:
+        value = str(value).lower()
+        return value if value in STREAM_FORMATS else None
+    best = request.accept_mimetypes.best_match(['application/json'] + list(STREAM_FORMATS.values()))
+    return next((name for name, mimetype in STREAM_FORMATS.items() if mimetype == best), None)
+
+
+def stream_calculate(calculator, text: str, models_to_use, include_tokens: bool, stream_format: str):
+    """
+    流式返回计算结果：各模型并行编码，每个模型完成后立即推送一条结果
+    
+    事件依次为start（文本信息和模型列表）、每个模型一条result，最后done（暂存ID和总耗时）。
+    NDJSON每行一个JSON对象（type字段为事件名）；SSE使用event/data格式。
+    """
+    start_time = time.perf_counter()
+    model_keys = models_to_use if models_to_use is not None else calculator.usable_models()
+    
+    def format_event(event: str, payload: dict) -> str:
+        if stream_format == 'sse':
+            return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        return json.dumps(dict(payload, type=event), ensure_ascii=False) + '\n'
+    
+    def generate():
+        yield format_event('start', {
+            'text_length': len(text),
+            'text_preview': text[:200] + ('...' if len(text) > 200 else ''),
+            'models': sorted(model_keys)
+        })
+        encodings = {}
+        for model_key, encoding in calculator.iter_encode_all(text, models_to_use):
+            if encoding is None:
+                yield format_event('error', {'model': model_key, 'error': f'计算 {model_key} 的tokens时出错'})
+                continue
+            encodings[model_key] = encoding
+            item = _result_item(calculator, model_key, encoding, len(text), include_tokens)
+            item['elapsed_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+            yield format_event('result', item)
+        yield format_event('done', {
+            'success': True,
+            'tokens_id': token_store.put(encodings),
+            'elapsed_ms': round((time.perf_counter() - start_time) * 1000, 1)
+        })
+    
+    response = Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[stream_format])
+    # 禁止反向代理缓冲，保证结果及时到达客户端
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @app.route('/')
@@ -95,27 +434,21 @@ def get_models():
     """获取可用模型列表"""
     try:
         calculator = get_calculator()
-        
         if calculator is None:
-            return jsonify({
-                'success': False,
-                'error': 'TokenCalculator未初始化'
-            }), 500
+            return not_ready_response()
         
-        # 验证tokenizers字典完整性
-        if not calculator.tokenizers:
+        # 可用模型包括尚未加载的（延迟加载时不会因为列出模型而触发加载）
+        available_models = calculator.usable_models()
+        if not available_models:
             return jsonify({
                 'success': False,
                 'error': '没有可用的tokenizer，请检查tokenizers目录或重启服务'
             }), 500
         
-        available_models = list(calculator.tokenizers.keys())
-        
         # 记录当前加载的模型数量（用于调试）
-        print(f"[API] /api/models - 当前加载的模型数量: {len(available_models)}")
-        if len(available_models) < len(MODELS):
-            print(f"[API] 警告: 期望 {len(MODELS)} 个模型，实际加载 {len(available_models)} 个")
-            print(f"[API] 已加载的模型: {sorted(available_models)}")
+        print(f"[API] /api/models - 可用模型: {len(available_models)}，已加载: {len(calculator.tokenizers)}")
+        if calculator.load_errors:
+            print(f"[API] 警告: 加载失败的模型: {sorted(calculator.load_errors)}")
         
         models_info = []
         for model_key in available_models:
@@ -124,7 +457,8 @@ def get_models():
             models_info.append({
                 'key': model_key,
                 'name': model_name,
-                'available': True
+                'available': True,
+                'loaded': model_key in calculator.tokenizers
             })
         
         # 如果使用本地模式，只显示已加载的模型
@@ -135,7 +469,8 @@ def get_models():
                     models_info.append({
                         'key': model_key,
                         'name': MODELS[model_key],
-                        'available': False
+                        'available': False,
+                        'loaded': False
                     })
         
         # 计算总模型数（本地模式使用实际加载数，在线模式使用MODELS字典）
@@ -144,7 +479,7 @@ def get_models():
         return jsonify({
             'success': True,
             'models': sorted(models_info, key=lambda x: x['key']),
-            'loaded_count': len(available_models),
+            'loaded_count': len(calculator.tokenizers),
             'total_count': total_count,
             'local_mode': calculator.local_mode
         })
@@ -164,39 +499,33 @@ def calculate_tokens():
         # 获取文本输入
         text = None
         
-        # 检查是否有文件上传
-        if 'file' in request.files:
-            file = request.files['file']
+        # 原始请求体上传：边接收边解码计数
+        if request.mimetype in RAW_UPLOAD_MIMETYPES:
+            return calculate_stream_upload()
+        
+        timings = g.timings
+        
+        # 检查是否有文件上传（表单中的文件在内存中，直接解码，不写入磁盘）
+        files = request.files
+        timings.lap('upload')
+        if 'file' in files:
+            file = files['file']
             if file.filename:
-                filename = secure_filename(file.filename)
-                filepath = app.config['UPLOAD_FOLDER'] / filename
-                file.save(str(filepath))
-                
-                # 读取文件内容
                 try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        text = f.read()
+                    # 文件已完整在内存中，按全部内容检测编码（UTF-8，其次GBK）
+                    text = DecodingReader(file.stream, sniff_bytes=app.config['MAX_CONTENT_LENGTH']).read()
                 except UnicodeDecodeError:
-                    # 尝试其他编码
-                    try:
-                        with open(filepath, 'r', encoding='gbk') as f:
-                            text = f.read()
-                    except:
-                        return jsonify({
-                            'success': False,
-                            'error': '无法读取文件，请确保文件是UTF-8或GBK编码的文本文件'
-                        }), 400
-                finally:
-                    # 删除临时文件
-                    if filepath.exists():
-                        filepath.unlink()
+                    return jsonify({
+                        'success': False,
+                        'error': '无法读取文件，请确保文件是UTF-8或GBK编码的文本文件'
+                    }), 400
         
         # 如果没有文件，从表单获取文本
         if not text:
             text = request.form.get('text', '')
             if not text:
                 # 尝试从JSON获取
-                data = request.get_json()
+                data = request.get_json(silent=True)
                 if data:
                     text = data.get('text', '')
         
@@ -205,25 +534,25 @@ def calculate_tokens():
                 'success': False,
                 'error': '请提供文本或上传文件'
             }), 400
+        timings.lap('decode')
+        timings.info['chars'] = len(text)
         
         # 获取选中的模型
         selected_models = request.form.getlist('models')
         if not selected_models:
             # 尝试从JSON获取
-            data = request.get_json()
+            data = request.get_json(silent=True)
             if data:
                 selected_models = data.get('models', [])
         
-        # 获取计算器（使用锁保护）
+        # 获取计算器（加载未完成时立即返回503，而不是阻塞等待）
         calculator = get_calculator()
         if calculator is None:
-            return jsonify({
-                'success': False,
-                'error': 'TokenCalculator未初始化'
-            }), 500
+            return not_ready_response()
         
         # 验证tokenizers字典完整性
-        if not calculator.tokenizers:
+        usable_models = calculator.usable_models()
+        if not usable_models:
             return jsonify({
                 'success': False,
                 'error': '没有可用的tokenizer，请重启服务'
@@ -232,8 +561,8 @@ def calculate_tokens():
         # 如果指定了模型，只使用选中的模型（不修改全局tokenizers字典）
         models_to_use = None
         if selected_models:
-            # 过滤出可用的模型
-            available_models = [m for m in selected_models if m in calculator.tokenizers]
+            # 过滤出可用的模型（未加载的模型会在编码时加载）
+            available_models = [m for m in selected_models if m in usable_models]
             if not available_models:
                 return jsonify({
                     'success': False,
@@ -242,68 +571,268 @@ def calculate_tokens():
             models_to_use = available_models
             print(f"[API] /api/calculate - 使用选中的模型: {models_to_use}")
         
-        # 计算tokens（如果指定了模型，只计算选中的模型，但不修改全局字典）
-        if models_to_use:
-            # 使用临时字典进行计算，不修改全局tokenizers
-            temp_tokenizers = {k: v for k, v in calculator.tokenizers.items() if k in models_to_use}
-            results = {}
-            for model_key, tokenizer in temp_tokenizers.items():
-                try:
-                    tokens = tokenizer.encode(text, add_special_tokens=False)
-                    results[model_key] = len(tokens)
-                except Exception as e:
-                    print(f"警告: 计算 {model_key} 的tokens时出错: {e}")
-                    results[model_key] = -1
-        else:
-            # 使用所有模型
-            results = calculator.calculate_tokens(text)
+        # 默认只返回token数量，token详情通过/api/tokens分页获取；
+        # 指定include_tokens时按旧方式在响应中返回所有token
+        include_tokens = _request_flag('include_tokens')
         
-        # 获取分词结果（返回所有token，前端通过滚动条查看）
-        token_details = {}
-        for model_key in results.keys():
-            if results[model_key] >= 0:
-                try:
-                    token_ids = calculator.get_token_ids(text, model_key)
-                    # 返回所有token，不再限制数量（前端通过滚动条查看）
-                    tokens = calculator.decode_tokens(token_ids, model_key)
-                    token_details[model_key] = {
-                        'total_tokens': len(token_ids),
-                        'preview_tokens': tokens,
-                        'preview_count': len(tokens)
-                    }
-                except Exception as e:
-                    print(f"警告: 获取 {model_key} 的分词详情时出错: {e}")
-                    token_details[model_key] = {
-                        'total_tokens': results[model_key],
-                        'preview_tokens': [],
-                        'preview_count': 0
-                    }
+        # stream=ndjson/sse时，每个模型编码完成后立即推送其结果
+        stream_format = _stream_format()
+        if stream_format:
+            return stream_calculate(calculator, text, models_to_use, include_tokens, stream_format)
+        
+        timings.lap('prepare')
+        
+        # 每个模型只编码一次，token数量、字符/Token比率和分词预览都复用同一个编码结果
+        # （如果指定了模型，只计算选中的模型，但不修改全局字典）
+        model_timings = {}
+        encodings = calculator.encode_all(text, models_to_use, timings=model_timings)
+        timings.add_models(model_timings)
+        timings.lap('encode')
+        
+        # 编码结果暂存ID（结果超过暂存区预算时为None）
+        tokens_id = token_store.put({k: v for k, v in encodings.items() if v is not None})
+        timings.lap('store')
         
         # 构建响应
         response_data = {
             'success': True,
             'text_length': len(text),
             'text_preview': text[:200] + ('...' if len(text) > 200 else ''),
-            'results': []
+            'tokens_id': tokens_id,
+            'results': [
+                _result_item(calculator, model_key, encodings[model_key], len(text), include_tokens)
+                for model_key in sorted(encodings.keys())
+                if encodings[model_key] is not None
+            ]
         }
+        # 不带token详情时这一步几乎不耗时，include_tokens时主要是decode_tokens
+        timings.lap('decode_tokens' if include_tokens else 'results')
+        if _request_flag('timings'):
+            # 序列化本身的耗时只出现在Server-Timing响应头中
+            response_data['timings'] = timings.as_dict()
+        
+        # 按Accept头协商响应格式；binary/msgpack格式总是包含token ID，JSON格式在指定include_ids时包含
+        ids_format = negotiate(request.accept_mimetypes)
+        if ids_format != FORMAT_JSON or _request_flag('include_ids'):
+            response = ids_response(response_data, encodings, ids_format)
+        else:
+            response = jsonify(response_data)
+        timings.lap('serialize')
+        return response
+    
+    except RequestEntityTooLarge:
+        limit = request.max_content_length
+        return jsonify({
+            'success': False,
+            'error': f'上传内容超过大小上限（{limit // 1024 // 1024} MB）'
+        }), 413
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': f'处理请求时出错: {str(e)}'
+        }), 500
+
+
+def calculate_stream_upload():
+    """
+    以原始请求体上传的文件：从请求流增量解码并分块计数，上传未结束时即开始编码
+    
+    模型通过查询参数models指定。只返回token数量（不保留文本和token IDs），
+    因此内存占用与文件大小无关，大小上限为MAX_STREAM_UPLOAD_MB。
+    """
+    calculator = get_calculator()
+    if calculator is None:
+        return not_ready_response()
+    
+    usable_models = calculator.usable_models()
+    selected_models = request.args.getlist('models')
+    models_to_use = [m for m in selected_models if m in usable_models] if selected_models else usable_models
+    if not models_to_use:
+        return jsonify({
+            'success': False,
+            'error': '所选模型都不可用' if selected_models else '没有可用的tokenizer，请重启服务'
+        }), 400 if selected_models else 500
+    
+    try:
+        reader = DecodingReader(request.stream)
+    except UnicodeDecodeError:
+        return jsonify({
+            'success': False,
+            'error': '无法读取文件，请确保文件是UTF-8或GBK编码的文本文件'
+        }), 400
+    
+    preview = ''
+    
+    def chunks():
+        # 记录开头的文本作为预览（在安全切分点处切分的块可能很短，需要拼接前几块）
+        nonlocal preview
+        for chunk in iter_text_chunks(reader):
+            if len(preview) <= 200:
+                preview += chunk[:201 - len(preview)]
+            yield chunk
+    
+    try:
+        totals, char_count = calculator.calculate_tokens_stream(chunks(), models_to_use)
+    except UnicodeDecodeError:
+        return jsonify({
+            'success': False,
+            'error': f'文件中间出现无法按{reader.encoding}解码的内容，请确保整个文件使用同一种编码'
+        }), 400
+    
+    # 接收、解码和编码交替进行，记为一个阶段
+    g.timings.lap('stream_encode')
+    g.timings.info.update({'bytes': reader.bytes_read, 'chars': char_count})
+    print(f"[API] /api/calculate - 流式上传 {reader.bytes_read} 字节（{reader.encoding}），{char_count} 字符")
+    return jsonify({
+        'success': True,
+        'text_length': char_count,
+        'text_preview': preview[:200] + ('...' if char_count > 200 else ''),
+        'bytes': reader.bytes_read,
+        'encoding': reader.encoding,
+        # 流式上传不保留编码结果，没有token详情
+        'tokens_id': None,
+        'results': [
+            {
+                'model': model_key,
+                'model_name': MODELS.get(model_key, model_key),
+                'token_count': count,
+                'char_per_token': round(char_count / count, 2) if count > 0 else 0
+            }
+            for model_key, count in sorted(totals.items())
+            if count >= 0
+        ]
+    })
+
+
+@app.route('/api/calculate_batch', methods=['POST'])
+def calculate_tokens_batch():
+    """批量计算多段文本的token数量（每个tokenizer对每组文本只调用一次批量编码）"""
+    try:
+        data = request.get_json(silent=True)
+        texts = data.get('texts') if isinstance(data, dict) else None
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return jsonify({
+                'success': False,
+                'error': '请在JSON请求体的texts字段中提供文本列表'
+            }), 400
+        if not texts:
+            return jsonify({
+                'success': False,
+                'error': 'texts不能为空'
+            }), 400
+        selected_models = data.get('models') or []
+        
+        calculator = get_calculator()
+        if calculator is None:
+            return not_ready_response()
+        
+        usable_models = calculator.usable_models()
+        models_to_use = [m for m in selected_models if m in usable_models] if selected_models else usable_models
+        if not models_to_use:
+            return jsonify({
+                'success': False,
+                'error': '所选模型都不可用' if selected_models else '没有可用的tokenizer，请重启服务'
+            }), 400 if selected_models else 500
+        print(f"[API] /api/calculate_batch - {len(texts)} 段文本, {len(models_to_use)} 个模型")
+        
+        counts = calculator.iter_calculate_tokens_batch(texts, models_to_use)
+        
+        # stream=true或Accept: application/x-ndjson时逐行返回每段文本的结果，最后一行为汇总
+        stream = _request_flag('stream') or (
+            request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+            == 'application/x-ndjson'
+        )
+        if stream:
+            def generate():
+                totals = {model_key: 0 for model_key in models_to_use}
+                for index, (text, tokens) in enumerate(zip(texts, counts)):
+                    for model_key, count in tokens.items():
+                        if count >= 0 and totals[model_key] >= 0:
+                            totals[model_key] += count
+                        else:
+                            totals[model_key] = -1
+                    yield json.dumps({'index': index, 'chars': len(text), 'tokens': tokens}, ensure_ascii=False) + '\n'
+                yield json.dumps({'summary': {'texts': len(texts), 'tokens': totals}}, ensure_ascii=False) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        return jsonify({
+            'success': True,
+            'models': models_to_use,
+            'results': [
+                {'index': index, 'chars': len(text), 'tokens': tokens}
+                for index, (text, tokens) in enumerate(zip(texts, counts))
+            ]
+        })
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': f'处理请求时出错: {str(e)}'
+        }), 500
+
+
+@app.route('/api/calculate_chat', methods=['POST'])
+def calculate_chat_tokens():
+    """按各模型的chat template计算消息列表的token数量（含角色标记等模板开销）"""
+    try:
+        data = request.get_json(silent=True)
+        messages = data.get('messages') if isinstance(data, dict) else None
+        if not isinstance(messages, list) or not messages or not all(
+                isinstance(message, dict) and isinstance(message.get('role'), str) for message in messages):
+            return jsonify({
+                'success': False,
+                'error': '请在JSON请求体的messages字段中提供消息列表，每条消息需包含role'
+            }), 400
+        template_kwargs = data.get('template_kwargs') or {}
+        if not isinstance(template_kwargs, dict):
+            return jsonify({
+                'success': False,
+                'error': 'template_kwargs必须是对象'
+            }), 400
+        add_generation_prompt = _flag(data.get('add_generation_prompt', True))
+        selected_models = data.get('models') or []
         
-        for model_key in sorted(results.keys()):
-            token_count = results[model_key]
-            if token_count >= 0:
-                ratio = len(text) / token_count if token_count > 0 else 0
-                details = token_details.get(model_key, {})
-                # 获取模型显示名称（优先从MODELS字典，否则使用key）
-                model_name = MODELS.get(model_key, model_key)
-                response_data['results'].append({
-                    'model': model_key,
-                    'model_name': model_name,
-                    'token_count': token_count,
-                    'char_per_token': round(ratio, 2),
-                    'token_preview': details.get('preview_tokens', []),
-                    'preview_count': details.get('preview_count', 0)
-                })
-        
-        return jsonify(response_data)
+        calculator = get_calculator()
+        if calculator is None:
+            return not_ready_response()
+        
+        usable_models = calculator.usable_models()
+        models_to_use = [m for m in selected_models if m in usable_models] if selected_models else usable_models
+        if not models_to_use:
+            return jsonify({
+                'success': False,
+                'error': '所选模型都不可用' if selected_models else '没有可用的tokenizer，请重启服务'
+            }), 400 if selected_models else 500
+        print(f"[API] /api/calculate_chat - {len(messages)} 条消息, {len(models_to_use)} 个模型")
+        
+        counts = calculator.count_chat_all(messages, models_to_use, add_generation_prompt, template_kwargs)
+        g.timings.lap('encode')
+        results = []
+        errors = {}
+        for model_key, count in counts.items():
+            if 'error' in count:
+                errors[model_key] = count['error']
+                continue
+            results.append(dict(count, model=model_key, model_name=MODELS.get(model_key, model_key)))
+        if not results:
+            return jsonify({
+                'success': False,
+                'error': '所选模型都无法计算对话的token数量',
+                'errors': errors
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'message_count': len(messages),
+            'results': results,
+            'errors': errors
+        })
     
     except Exception as e:
         import traceback
@@ -314,37 +843,356 @@ def calculate_tokens():
         }), 500
 
 
+@app.route('/api/chunk', methods=['POST'])
+def chunk_text():
+    """按某个模型的token数把文本切分为不超过max_tokens的片段，返回各块的字符区间"""
+    try:
+        data = request.get_json(silent=True)
+        params = data if isinstance(data, dict) else request.form
+        
+        text = None
+        file = request.files.get('file')
+        if file is not None and file.filename:
+            try:
+                text = DecodingReader(file.stream, sniff_bytes=app.config['MAX_CONTENT_LENGTH']).read()
+            except UnicodeDecodeError:
+                return jsonify({
+                    'success': False,
+                    'error': '无法读取文件，请确保文件是UTF-8或GBK编码的文本文件'
+                }), 400
+        if not text:
+            text = params.get('text') or ''
+        if not isinstance(text, str) or not text:
+            return jsonify({
+                'success': False,
+                'error': '请提供文本或上传文件'
+            }), 400
+        
+        model_key = params.get('model') or ''
+        snap = params.get('snap') or 'none'
+        try:
+            max_tokens = int(params.get('max_tokens', 0))
+            overlap = int(params.get('overlap', 0))
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': 'max_tokens和overlap必须是整数'
+            }), 400
+        if max_tokens <= 0 or overlap < 0 or overlap >= max_tokens or snap not in CHUNK_SNAP_MODES:
+            return jsonify({
+                'success': False,
+                'error': f'max_tokens必须大于0，overlap必须大于等于0且小于max_tokens，'
+                         f'snap必须是 {", ".join(CHUNK_SNAP_MODES)} 之一'
+            }), 400
+        include_text = _flag(params.get('include_text', True))
+        strict = _flag(params.get('strict', False))
+        g.timings.lap('decode')
+        g.timings.info['chars'] = len(text)
+        
+        calculator = get_calculator()
+        if calculator is None:
+            return not_ready_response()
+        if model_key not in calculator.usable_models():
+            return jsonify({
+                'success': False,
+                'error': f'模型不可用: {model_key}' if model_key else '请通过model指定模型'
+            }), 400
+        print(f"[API] /api/chunk - {len(text)} 字符, 模型 {model_key}, 每块最多 {max_tokens} 个token")
+        
+        chunks = calculator.iter_chunks(text, model_key, max_tokens, overlap=overlap, snap=snap, strict=strict)
+        
+        def with_text(chunk):
+            if include_text:
+                chunk['text'] = text[chunk['start']:chunk['end']]
+            return chunk
+        
+        # stream=true或Accept: application/x-ndjson时每切出一块立即返回一行，最后一行为汇总
+        stream = _flag(params.get('stream')) or _flag(request.args.get('stream')) or (
+            request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+            == 'application/x-ndjson'
+        )
+        if stream:
+            def generate():
+                count = 0
+                try:
+                    for chunk in chunks:
+                        count += 1
+                        yield json.dumps(with_text(chunk), ensure_ascii=False) + '\n'
+                except Exception as e:
+                    yield json.dumps({'error': str(e)}, ensure_ascii=False) + '\n'
+                    return
+                yield json.dumps({'summary': {'model': model_key, 'chars': len(text), 'chunks': count}},
+                                 ensure_ascii=False) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        try:
+            result = [with_text(chunk) for chunk in chunks]
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        g.timings.lap('encode')
+        return jsonify({
+            'success': True,
+            'model': model_key,
+            'max_tokens': max_tokens,
+            'overlap': overlap,
+            'snap': snap,
+            'chars': len(text),
+            'chunk_count': len(result),
+            'chunks': result
+        })
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': f'处理请求时出错: {str(e)}'
+        }), 500
+
+
+def _session_response(session_id: str, session: EditSession, include_tokens_id: bool):
+    """编辑会话的当前结果（格式与/api/calculate相同，另含session_id和version）"""
+    state = session.state()
+    text_length = state['text_length']
+    results = []
+    for model_key, token_count in state['counts'].items():
+        results.append({
+            'model': model_key,
+            'model_name': MODELS.get(model_key, model_key),
+            'token_count': token_count,
+            'char_per_token': round(text_length / token_count, 2) if token_count > 0 else 0
+        })
+    payload = {
+        'success': True,
+        'session_id': session_id,
+        'version': state['version'],
+        'text_length': text_length,
+        'encoded_chars': state['encoded_chars'],
+        'results': results,
+        'errors': session.errors
+    }
+    if include_tokens_id:
+        # 拼接各片段的token ID放入暂存区，供/api/tokens分页查看
+        payload['tokens_id'] = token_store.put(session.encodings())
+    return jsonify(payload)
+
+
+@app.route('/api/session', methods=['POST'])
+def create_session():
+    """创建增量编码会话：编码初始文本，之后通过/api/session/<session_id>/edit只发送修改"""
+    try:
+        data = request.get_json(silent=True)
+        text = data.get('text', '') if isinstance(data, dict) else None
+        if not isinstance(text, str):
+            return jsonify({
+                'success': False,
+                'error': '请在JSON请求体的text字段中提供文本'
+            }), 400
+        selected_models = data.get('models') or []
+        include_tokens_id = _flag(data.get('include_tokens_id', True))
+        
+        calculator = get_calculator()
+        if calculator is None:
+            return not_ready_response()
+        
+        usable_models = calculator.usable_models()
+        models_to_use = [m for m in selected_models if m in usable_models] if selected_models else usable_models
+        if not models_to_use:
+            return jsonify({
+                'success': False,
+                'error': '所选模型都不可用' if selected_models else '没有可用的tokenizer，请重启服务'
+            }), 400 if selected_models else 500
+        print(f"[API] /api/session - {len(text)} 字符, {len(models_to_use)} 个模型")
+        
+        session = EditSession(calculator, text, models_to_use)
+        g.timings.lap('encode')
+        if not session.models:
+            return jsonify({
+                'success': False,
+                'error': '所选模型都无法计算token数量',
+                'errors': session.errors
+            }), 500
+        session_id = session_store.put(session)
+        if session_id is None:
+            return jsonify({
+                'success': False,
+                'error': '文本过大，无法创建编辑会话'
+            }), 413
+        return _session_response(session_id, session, include_tokens_id)
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': f'处理请求时出错: {str(e)}'
+        }), 500
+
+
+@app.route('/api/session/<session_id>/edit', methods=['POST'])
+def apply_session_edits(session_id: str):
+    """
+    对编辑会话执行一组编辑，只重新编码修改位置附近的片段
+    
+    请求体: {"version": 客户端持有的版本号, "edits": [{"offset": 位置, "delete": 删除的字符数, "insert": 插入的文本}]}
+    位置和长度以Unicode码点计。版本号不一致时返回409，会话过期时返回404，客户端应重新创建会话。
+    """
+    try:
+        data = request.get_json(silent=True)
+        edits = data.get('edits') if isinstance(data, dict) else None
+        if not isinstance(edits, list) or not all(isinstance(edit, dict) for edit in edits):
+            return jsonify({
+                'success': False,
+                'error': '请在JSON请求体的edits字段中提供编辑列表'
+            }), 400
+        version = data.get('version')
+        if version is not None and not isinstance(version, int):
+            return jsonify({
+                'success': False,
+                'error': 'version必须是整数'
+            }), 400
+        include_tokens_id = _flag(data.get('include_tokens_id', True))
+        
+        calculator = get_calculator()
+        if calculator is None:
+            return not_ready_response()
+        
+        session = session_store.get(session_id)
+        if session is None:
+            return jsonify({
+                'success': False,
+                'error': '编辑会话不存在或已过期，请重新创建'
+            }), 404
+        
+        try:
+            session.edit(edits, version)
+        except VersionConflict as e:
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'version': session.version
+            }), 409
+        except EditError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        g.timings.lap('encode')
+        g.timings.info['chars'] = session.encoded_chars
+        session_store.resize(session_id, session)
+        return _session_response(session_id, session, include_tokens_id)
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': f'处理请求时出错: {str(e)}'
+        }), 500
+
+
+@app.route('/api/tokens', methods=['GET'])
+def get_tokens():
+    """分页获取某次计算中某个模型的token字符串和ID"""
+    try:
+        handle = request.args.get('id', '')
+        model_key = request.args.get('model', '')
+        try:
+            offset = int(request.args.get('offset', 0))
+            limit = int(request.args.get('limit', app.config['TOKEN_PAGE_SIZE']))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'offset和limit必须是整数'
+            }), 400
+        if offset < 0 or limit <= 0:
+            return jsonify({
+                'success': False,
+                'error': 'offset不能为负数，limit必须大于0'
+            }), 400
+        limit = min(limit, app.config['TOKEN_PAGE_MAX'])
+        
+        calculator = get_calculator()
+        if calculator is None:
+            return not_ready_response()
+        
+        encodings = token_store.get(handle) if handle else None
+        if encodings is None:
+            # 暂存的编码结果已过期或被淘汰，需要重新计算
+            return jsonify({
+                'success': False,
+                'error': '编码结果不存在或已过期，请重新计算'
+            }), 404
+        encoding = encodings.get(model_key)
+        if encoding is None:
+            return jsonify({
+                'success': False,
+                'error': f'该次计算中没有模型 {model_key} 的结果'
+            }), 404
+        
+        # 只切片并解码请求的这一页
+        ids = encoding.ids[offset:offset + limit]
+        return jsonify({
+            'success': True,
+            'model': model_key,
+            'offset': offset,
+            'limit': limit,
+            'total_tokens': encoding.count,
+            'ids': ids.tolist(),
+            'tokens': calculator.decode_tokens(ids, model_key)
+        })
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': f'获取token详情时出错: {str(e)}'
+        }), 500
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus格式的运行指标"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查端点"""
     try:
         calculator = get_calculator()
         if calculator is None:
-            return jsonify({
-                'status': 'error',
-                'message': 'TokenCalculator未初始化'
-            }), 500
+            return not_ready_response(error_key='message')
         
-        tokenizer_count = len(calculator.tokenizers)
+        registry = calculator.registry_stats()
+        tokenizer_count = len(registry['loaded_models'])
         
         # 本地模式：期望数量等于实际发现的模型数
         # 在线模式：期望数量等于MODELS字典中的数量
-        if calculator.local_mode:
-            expected_count = len(calculator.available_models)
-            missing_models = sorted([m for m in calculator.available_models if m not in calculator.tokenizers])
-        else:
-            expected_count = len(MODELS)
-            missing_models = sorted([m for m in MODELS.keys() if m not in calculator.tokenizers])
+        expected_count = len(calculator.models)
+        # 延迟加载时尚未加载的模型不算缺失，只有加载失败的才算
+        missing_models = sorted(calculator.load_errors.keys())
         
-        status = 'healthy' if tokenizer_count == expected_count else 'degraded'
+        status = 'healthy' if not missing_models else 'degraded'
         
         return jsonify({
             'status': status,
             'tokenizer_count': tokenizer_count,
             'expected_count': expected_count,
-            'loaded_models': sorted(list(calculator.tokenizers.keys())),
+            'loaded_models': registry['loaded_models'],
             'missing_models': missing_models,
-            'local_mode': calculator.local_mode
+            'local_mode': calculator.local_mode,
+            'readiness': readiness_info(),
+            'registry': registry,
+            'cache': calculator.cache.stats() if calculator.cache is not None else None,
+            'chat_prefix_cache': calculator.chat_prefix_cache.stats(),
+            'token_store': token_store.stats(),
+            'sessions': session_store.stats(),
+            'batching': calculator.batcher.stats() if calculator.batcher is not None else None
         })
     except Exception as e:
         return jsonify({
@@ -370,4 +1218,8 @@ if __name__ == '__main__':
     print("=" * 60)
     print()
     
+    # 启动时在后台加载tokenizer（debug模式下只在实际处理请求的子进程中加载）
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_loading()
+    
     app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+微批处理调度器 - 合并并发请求中对同一tokenizer的编码调用
+
+短时间窗口内（或达到最大批大小前）到达的、使用同一tokenizer的编码请求合并为一次
+encode_batch调用（Rust端并行编码，并分摊每次调用的开销），结果再分发给各个调用方。
+
+不使用后台线程：队列为空时到达的请求成为“领队”，在自己的线程中执行整批编码；
+其他请求只需等待自己的结果。只有同一键已有一批正在执行（存在竞争）时，领队才等待：
+直到该批执行完、窗口结束或队列满。没有并发时请求立即执行，不增加延迟。
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Sequence
+
+from metrics import BATCH_QUEUE_WAIT_SECONDS, BATCH_SIZE
+
+
+# 计算排队延迟分位数时保留的最近样本数
+LATENCY_SAMPLES = 1024
+
+
+class MicroBatcher:
+    """按键（tokenizer）合并并发的编码请求"""
+
+    def __init__(self, run_batch: Callable[[Hashable, List[Any]], Sequence[Any]],
+                 window_seconds: float, max_batch_size: int):
+        """
+        Args:
+            run_batch: 执行一批请求的函数，参数为(键, 请求列表)，返回与请求一一对应的结果
+            window_seconds: 同一键已有一批正在执行时，第一个请求到达后等待更多请求的最长时间
+            max_batch_size: 每批最多合并的请求数，达到后立即执行
+        """
+        self.run_batch = run_batch
+        self.window_seconds = window_seconds
+        self.max_batch_size = max(1, max_batch_size)
+        # 键 -> 正在收集的一批请求 [(请求, Future, 入队时间)]
+        self._queues: Dict[Hashable, list] = {}
+        # 键 -> 正在执行的批数
+        self._running: Dict[Hashable, int] = {}
+        self._cond = threading.Condition()
+        # 统计
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes: Dict[int, int] = {}
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self._queue_waits: deque = deque(maxlen=LATENCY_SAMPLES)
+
+    def submit(self, key: Hashable, request: Any) -> Any:
+        """
+        提交一个请求并等待结果
+
+        Args:
+            key: 批处理键（同一键的请求可以合并）
+            request: 传给run_batch的请求
+
+        Returns:
+            该请求的结果（run_batch出错时抛出对应异常）
+        """
+        future: Future = Future()
+        with self._cond:
+            queue = self._queues.get(key)
+            leader = queue is None or len(queue) >= self.max_batch_size
+            if leader:
+                # 没有正在收集的批，或该批已满，开始新的一批
+                queue = self._queues[key] = []
+            queue.append((request, future, time.perf_counter()))
+            if len(queue) >= self.max_batch_size:
+                self._cond.notify_all()
+            if leader:
+                # 没有同一键的批在执行时立即执行；否则在该批执行期间收集请求
+                deadline = time.perf_counter() + self.window_seconds
+                while len(queue) < self.max_batch_size and self._running.get(key, 0) > 0:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # 之后到达的请求进入新的一批
+                if self._queues.get(key) is queue:
+                    del self._queues[key]
+                self._running[key] = self._running.get(key, 0) + 1
+        if leader:
+            try:
+                self._run(key, queue)
+            finally:
+                with self._cond:
+                    self._running[key] -= 1
+                    if not self._running[key]:
+                        del self._running[key]
+                    self._cond.notify_all()
+        return future.result()
+
+    def _run(self, key: Hashable, queue: list):
+        """执行一批请求并把结果分发给各个Future"""
+        start = time.perf_counter()
+        waits = [start - enqueued for _, _, enqueued in queue]
+        self._record(len(queue), waits)
+        try:
+            results = list(self.run_batch(key, [request for request, _, _ in queue]))
+            if len(results) != len(queue):
+                # 结果与请求无法一一对应，不能按位置分发（否则可能把别人的结果交给调用方）
+                raise RuntimeError(f'批处理返回了 {len(results)} 个结果，但提交了 {len(queue)} 个请求')
+        except BaseException as e:
+            # 每个Future都必须完成，否则等待结果的调用方会一直阻塞
+            for _, future, _ in queue:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(queue, results):
+            future.set_result(result)
+
+    def _record(self, size: int, waits: List[float]):
+        """记录批大小和排队延迟（同时写入/metrics的直方图）"""
+        BATCH_SIZE.observe(size)
+        for wait in waits:
+            BATCH_QUEUE_WAIT_SECONDS.observe(wait)
+        with self._stats_lock:
+            self.batches += 1
+            self.items += size
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+            self.queue_wait_total += sum(waits)
+            self.queue_wait_max = max(self.queue_wait_max, max(waits))
+            self._queue_waits.extend(waits)
+
+    def stats(self) -> Dict[str, Any]:
+        """批大小分布和排队延迟统计"""
+        with self._stats_lock:
+            waits = sorted(self._queue_waits)
+
+            def percentile(p: float) -> float:
+                return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 3) if waits else 0.0
+
+            return {
+                'window_ms': round(self.window_seconds * 1000, 3),
+                'max_batch_size': self.max_batch_size,
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+                'batch_sizes': dict(sorted(self.batch_sizes.items())),
+                'queue_wait_ms': {
+                    'mean': round(self.queue_wait_total / self.items * 1000, 3) if self.items else 0.0,
+                    'p50': percentile(0.5),
+                    'p99': percentile(0.99),
+                    'max': round(self.queue_wait_max * 1000, 3)
+                }
+            }
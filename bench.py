@@ -0,0 +1,690 @@
+#!/usr/bin/env python3
+"""
+性能基准测试 - TokenCalculator
+"""
+
+import argparse
+import bisect
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from calculate_tokens import TokenCalculator, iter_text_chunks
+from edit_session import EditSession
+from id_codec import ids_base64, ids_buffer, iter_binary, msgpack_available, pack_msgpack
+from tokenizer_backends import BACKEND_AUTO, BACKEND_TOKENIZERS, BACKEND_TRANSFORMERS, BACKENDS, is_available
+
+
+# 基准测试使用的样本文本（中文、英文、代码混合）
+SAMPLE_TEXT = (
+    "Hello, world! 你好，世界！\n"
+    "这是一个测试文件，用于演示token计算工具的功能。\n"
+    "This is a test file to demonstrate the token calculation tool.\n"
+    "def calculate(x: int) -> int:\n    return x * 2  # 计算结果\n"
+)
+
+
+# 吞吐量测试套件的各类文本素材（按固定随机种子拼接，保证每次生成的文本相同）
+WORKLOAD_SENTENCES = {
+    'zh': [
+        '这是一个测试文件，用于演示token计算工具的功能。',
+        '大语言模型按token计费，不同模型的分词方式差别很大。',
+        '今天天气很好，我们去公园散步，顺便讨论一下项目的进展。',
+        '数据集中的每一行都需要统计token数量，以便估算训练成本。',
+        '分词器会把常见的词语合并为一个token，而生僻字可能被拆成多个字节。',
+    ],
+    'en': [
+        'This is a test file to demonstrate the token calculation tool. ',
+        'Large language models are billed by tokens, and tokenizers differ a lot. ',
+        'The quick brown fox jumps over the lazy dog near the riverbank. ',
+        'Every row in the dataset needs a token count to estimate training cost. ',
+        'Common words become a single token, while rare words are split into pieces. ',
+    ],
+    'code': [
+        'def calculate(x: int) -> int:\n    return x * 2  # compute result\n\n',
+        'for (let i = 0; i < items.length; i++) {\n    total += items[i].price;\n}\n',
+        'class Cache:\n    def __init__(self, size):\n        self.size = size\n        self.items = {}\n\n',
+        'SELECT id, name FROM users WHERE created_at > NOW() - INTERVAL 7 DAY;\n',
+        'if err != nil {\n\treturn fmt.Errorf("failed: %w", err)\n}\n',
+    ],
+}
+WORKLOAD_SENTENCES['mixed'] = [s for sentences in WORKLOAD_SENTENCES.values() for s in sentences]
+WORKLOADS = list(WORKLOAD_SENTENCES.keys())
+SUITE_MODES = ['single', 'threads', 'batch']
+# 默认的文本大小，--quick只跑前三档
+SUITE_SIZES = '1KB,64KB,1MB,16MB,100MB'
+QUICK_SIZES = '1KB,64KB,1MB'
+# 超过该大小的文本按安全切分点分块流式计数（与命令行处理大文件的方式一致）
+SUITE_STREAM_BYTES = 16 * 1024 * 1024
+# 拼接文本时先生成的不重复块大小（字节），之后重复该块直到目标大小
+WORKLOAD_BLOCK_BYTES = 256 * 1024
+
+
+# 冷启动测试在子进程中运行的脚本：导入+加载tokenizer的耗时、峰值RSS、是否导入了transformers/torch
+COLDSTART_SCRIPT = """
+import json, sys, time
+from contextlib import redirect_stdout
+start = time.perf_counter()
+with redirect_stdout(sys.stderr):
+    from calculate_tokens import TokenCalculator
+    calculator = TokenCalculator(local_mode=True, tokenizers_dir=sys.argv[1], backend=sys.argv[2], workers=1)
+elapsed = time.perf_counter() - start
+from bench import peak_rss_bytes
+print(json.dumps({
+    'seconds': elapsed,
+    'peak_rss_bytes': peak_rss_bytes(),
+    'tokenizers': len(calculator.tokenizers),
+    'transformers_imported': 'transformers' in sys.modules,
+    'torch_imported': 'torch' in sys.modules,
+}))
+"""
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """当前进程的峰值RSS（字节），不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def make_text(size_kb: int) -> str:
+    """生成指定大小（约）的测试文本"""
+    repeat = max(1, size_kb * 1024 // len(SAMPLE_TEXT.encode('utf-8')))
+    return SAMPLE_TEXT * repeat
+
+
+def create_calculator(tokenizers_dir: Optional[str], workers: int, **options) -> TokenCalculator:
+    """创建计算器（有本地tokenizer目录时使用本地模式，options传给TokenCalculator）"""
+    tokenizers_path = Path(tokenizers_dir) if tokenizers_dir else Path(__file__).parent / 'tokenizers'
+    if tokenizers_path.exists() and any(tokenizers_path.iterdir()):
+        return TokenCalculator(local_mode=True, tokenizers_dir=str(tokenizers_path), workers=workers, **options)
+    return TokenCalculator(local_mode=False, workers=workers, **options)
+
+
+def parse_size(value: str) -> int:
+    """解析大小，如 1KB、16MB、100MB（1024进制）"""
+    value = value.strip().upper()
+    for unit, factor in (('GB', 1 << 30), ('MB', 1 << 20), ('KB', 1 << 10), ('B', 1)):
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value)
+
+
+def make_workload_text(workload: str, size_bytes: int, seed: int = 0) -> str:
+    """
+    生成指定类型和大小（UTF-8字节数，约）的可复现文本
+
+    Args:
+        workload: zh/en/code/mixed
+        size_bytes: 目标大小
+        seed: 随机种子
+    """
+    rng = random.Random(f'{workload}-{seed}')
+    sentences = WORKLOAD_SENTENCES[workload]
+    parts = []
+    block_bytes = 0
+    target = min(size_bytes, WORKLOAD_BLOCK_BYTES)
+    while block_bytes < target:
+        sentence = rng.choice(sentences)
+        if rng.random() < 0.1:
+            sentence += '\n'
+        parts.append(sentence)
+        block_bytes += len(sentence.encode('utf-8'))
+    block = ''.join(parts)
+    text = block * max(1, size_bytes // block_bytes)
+    return text
+
+
+def _percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def _run_case(run, chars: int, repeat: int, case_seconds: float) -> Dict:
+    """
+    重复运行一个用例（至少一次，直到次数或时间预算用完）
+
+    Args:
+        run: 执行一次并返回token数的函数
+        chars: 文本字符数
+    """
+    latencies = []
+    tokens = 0
+    started = time.perf_counter()
+    while len(latencies) < repeat and (not latencies or time.perf_counter() - started < case_seconds):
+        start = time.perf_counter()
+        tokens = run()
+        latencies.append(time.perf_counter() - start)
+    elapsed = sum(latencies)
+    return {
+        'chars': chars,
+        'tokens': tokens,
+        'runs': len(latencies),
+        'chars_per_s': round(chars * len(latencies) / elapsed, 1),
+        'tokens_per_s': round(tokens * len(latencies) / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+        'peak_rss_bytes': peak_rss_bytes()
+    }
+
+
+def run_suite(calculator: TokenCalculator, workloads: List[str], sizes: List[int], modes: List[str],
+              repeat: int, case_seconds: float, doc_chars: int) -> List[Dict]:
+    """
+    运行吞吐量测试矩阵：文本类型 × 大小 × 模式（single逐个模型单线程、threads多模型线程池、batch批量编码）
+
+    Returns:
+        每个用例的结果（single模式每个模型一条，其余模式为所有模型合计）
+    """
+    models = calculator.usable_models()
+    cases = []
+    for size in sorted(sizes):
+        for workload in workloads:
+            text = make_workload_text(workload, size)
+            streamed = len(text.encode('utf-8')) > SUITE_STREAM_BYTES
+            base = {'workload': workload, 'size_bytes': size, 'streamed': streamed}
+
+            def count_all() -> int:
+                if streamed:
+                    totals, _ = calculator.calculate_tokens_stream(iter_text_chunks(io.StringIO(text)))
+                    return sum(totals.values())
+                return sum(r.count for r in calculator.encode_all(text, use_cache=False).values() if r is not None)
+
+            for mode in modes:
+                if mode == 'single':
+                    for model_key in models:
+                        def count_one(model_key=model_key) -> int:
+                            if streamed:
+                                return sum(calculator.encode(chunk, model_key, use_cache=False).count
+                                           for chunk in iter_text_chunks(io.StringIO(text)))
+                            return calculator.encode(text, model_key, use_cache=False).count
+                        result = _run_case(count_one, len(text), repeat, case_seconds)
+                        cases.append(dict(base, mode=mode, model=model_key, **result))
+                        print(f"  {workload:<6} {size:>11} {mode:<8} {model_key:<24} "
+                              f"{result['chars_per_s']:>14,.0f} 字符/秒  p50 {result['p50_ms']:.2f}ms", file=sys.stderr)
+                    continue
+                if mode == 'threads':
+                    run = count_all
+                else:
+                    docs = [text[i:i + doc_chars] for i in range(0, len(text), doc_chars)]
+
+                    def run() -> int:
+                        return sum(sum(counts.values()) for counts in calculator.iter_calculate_tokens_batch(docs))
+                result = _run_case(run, len(text), repeat, case_seconds)
+                cases.append(dict(base, mode=mode, model='all', **result))
+                print(f"  {workload:<6} {size:>11} {mode:<8} {'all':<24} "
+                      f"{result['chars_per_s']:>14,.0f} 字符/秒  p50 {result['p50_ms']:.2f}ms", file=sys.stderr)
+    return cases
+
+
+def compare_baseline(cases: List[Dict], baseline: Dict, threshold: float) -> List[Dict]:
+    """
+    与基准结果对比，找出吞吐量下降或p50延迟上升超过阈值的用例
+
+    Args:
+        cases: 本次结果
+        baseline: 之前保存的套件输出
+        threshold: 允许的相对变化，如0.1表示10%
+
+    Returns:
+        退化的用例列表
+    """
+    def key(case):
+        return case['workload'], case['size_bytes'], case['mode'], case['model']
+
+    previous = {key(case): case for case in baseline.get('cases', [])}
+    regressions = []
+    for case in cases:
+        old = previous.get(key(case))
+        if old is None:
+            continue
+        throughput = case['chars_per_s'] / old['chars_per_s'] if old['chars_per_s'] else 1.0
+        latency = case['p50_ms'] / old['p50_ms'] if old['p50_ms'] else 1.0
+        if throughput < 1 - threshold or latency > 1 + threshold:
+            regressions.append({
+                'workload': case['workload'], 'size_bytes': case['size_bytes'],
+                'mode': case['mode'], 'model': case['model'],
+                'chars_per_s': case['chars_per_s'], 'baseline_chars_per_s': old['chars_per_s'],
+                'p50_ms': case['p50_ms'], 'baseline_p50_ms': old['p50_ms'],
+                'throughput_ratio': round(throughput, 3), 'latency_ratio': round(latency, 3)
+            })
+    return regressions
+
+
+def bench_suite(args):
+    """可复现的吞吐量测试矩阵，输出JSON，可与基准文件对比"""
+    sizes = [parse_size(size) for size in (QUICK_SIZES if args.quick else args.sizes).split(',')]
+    workloads = args.workloads.split(',')
+    modes = args.modes.split(',')
+    for name, values, allowed in (('workloads', workloads, WORKLOADS), ('modes', modes, SUITE_MODES)):
+        unknown = [v for v in values if v not in allowed]
+        if unknown:
+            print(f"错误: 未知的{name}: {unknown}（可选: {allowed}）", file=sys.stderr)
+            sys.exit(2)
+
+    with redirect_stdout(sys.stderr):
+        calculator = create_calculator(args.tokenizers_dir, workers=args.workers or os.cpu_count() or 1)
+    if args.models:
+        calculator.models = [m for m in args.models.split(',') if m in calculator.models]
+
+    print(f"模型数: {len(calculator.usable_models())}, 线程数: {calculator.workers}", file=sys.stderr)
+    cases = run_suite(calculator, workloads, sizes, modes, args.repeat, args.case_seconds, args.doc_chars)
+    calculator.close()
+
+    try:
+        import tokenizers
+        tokenizers_version = tokenizers.__version__
+    except ImportError:
+        tokenizers_version = None
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'workers': calculator.workers,
+            'tokenizers_version': tokenizers_version,
+            'models': calculator.usable_models(),
+            'repeat': args.repeat,
+            'doc_chars': args.doc_chars,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'cases': cases
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(cases, baseline, args.threshold)
+        report['baseline'] = {'file': args.baseline, 'threshold': args.threshold, 'regressions': regressions}
+        if regressions:
+            exit_code = 1
+            print(f"性能退化（超过 {args.threshold:.0%}）: {len(regressions)} 个用例", file=sys.stderr)
+            for r in regressions:
+                print(f"  {r['workload']} {r['size_bytes']} {r['mode']} {r['model']}: "
+                      f"吞吐量 {r['throughput_ratio']:.2f}x, p50延迟 {r['latency_ratio']:.2f}x", file=sys.stderr)
+        else:
+            print("与基准相比没有超过阈值的退化", file=sys.stderr)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+
+def bench_workers(args):
+    """多模型并行编码：线程数从1到N的耗时与加速比"""
+    text = make_text(args.size_kb)
+    max_workers = args.max_workers or os.cpu_count() or 1
+    calculator = create_calculator(args.tokenizers_dir, workers=1)
+
+    print(f"文本大小: {len(text.encode('utf-8')) / 1024:.0f} KB, 模型数: {len(calculator.tokenizers)}")
+    print("-" * 60)
+    print(f"{'线程数':<10} {'耗时(秒)':<15} {'加速比':<10}")
+    print("-" * 60)
+
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        calculator.close()
+        calculator.workers = workers
+        calculator.calculate_tokens(text)  # 预热
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            calculator.calculate_tokens(text)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        baseline = baseline or elapsed
+        print(f"{workers:<10} {elapsed:<15.3f} {baseline / elapsed:.2f}x")
+
+    calculator.close()
+
+
+def _stress_round(calculator: TokenCalculator, models: List[str], text: str, expected: Dict[str, int],
+                  threads: int, seconds: float) -> Dict:
+    """
+    一轮压力测试：threads个线程在seconds秒内不断编码（轮流使用各模型，不使用缓存）
+
+    Returns:
+        编码次数、字符数、错误数、结果与单线程不一致的次数及错误示例
+    """
+    lock = threading.Lock()
+    totals = {'encodes': 0, 'chars': 0, 'errors': 0, 'mismatches': 0, 'samples': []}
+    start_barrier = threading.Barrier(threads + 1)
+    deadline = [0.0]
+
+    def worker(index: int):
+        encodes = errors = mismatches = 0
+        samples = []
+        start_barrier.wait()
+        i = index
+        while time.perf_counter() < deadline[0]:
+            model_key = models[i % len(models)]
+            i += 1
+            try:
+                result = calculator.encode(text, model_key, use_cache=False)
+                if result is None or result.count != expected[model_key]:
+                    mismatches += 1
+            except Exception as e:
+                errors += 1
+                if len(samples) < 3:
+                    samples.append(f"{type(e).__name__}: {e}")
+            encodes += 1
+        with lock:
+            totals['encodes'] += encodes
+            totals['chars'] += encodes * len(text)
+            totals['errors'] += errors
+            totals['mismatches'] += mismatches
+            totals['samples'].extend(samples)
+
+    workers = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    deadline[0] = time.perf_counter() + seconds
+    started = time.perf_counter()
+    start_barrier.wait()
+    for thread in workers:
+        thread.join()
+    totals['seconds'] = time.perf_counter() - started
+    return totals
+
+
+def bench_stress(args):
+    """并发压力测试：多个线程同时编码同一批模型，检查错误与结果一致性，以及吞吐量随线程数的扩展"""
+    calculator = create_calculator(args.tokenizers_dir, workers=1, backend=args.backend, pool_size=args.pool_size)
+    models = args.models.split(',') if args.models else calculator.usable_models()[:1]
+    models = [m for m in models if calculator.get_tokenizer(m) is not None]
+    if not models:
+        print("错误: 没有可用的模型")
+        sys.exit(1)
+    text = make_text(args.size_kb)
+    # 单线程的结果作为正确答案
+    expected = {model_key: calculator.encode(text, model_key, use_cache=False).count for model_key in models}
+    max_threads = args.max_threads or max(2, (os.cpu_count() or 1) * 2)
+    thread_counts = [1]
+    while thread_counts[-1] * 2 <= max_threads:
+        thread_counts.append(thread_counts[-1] * 2)
+
+    print(f"文本大小: {len(text.encode('utf-8')) / 1024:.0f} KB, 模型: {', '.join(models)}, "
+          f"实例池上限: {calculator.pool_size}, CPU核数: {os.cpu_count()}")
+    print("-" * 90)
+    print(f"{'线程数':<8} {'编码/秒':<12} {'字符/秒':<16} {'扩展比':<10} {'效率':<8} {'错误':<8} {'结果不一致':<10}")
+    print("-" * 90)
+
+    failed = False
+    baseline = None
+    for threads in thread_counts:
+        totals = _stress_round(calculator, models, text, expected, threads, args.seconds)
+        rate = totals['encodes'] / totals['seconds']
+        baseline = baseline or rate
+        scaling = rate / baseline if baseline else 0.0
+        print(f"{threads:<8} {rate:<12.1f} {totals['chars'] / totals['seconds']:<16,.0f} "
+              f"{scaling:<10.2f} {scaling / threads:<8.0%} {totals['errors']:<8} {totals['mismatches']:<10}")
+        for sample in totals['samples']:
+            print(f"    {sample}")
+        failed = failed or totals['errors'] > 0 or totals['mismatches'] > 0
+
+    print("-" * 90)
+    for model_key, stats in calculator.registry_stats()['pools'].items():
+        print(f"实例池 {model_key}: {stats['size']} 个实例, 借出 {stats['checkouts']} 次, "
+              f"等待 {stats['waits']} 次（共 {stats['wait_ms']:.0f} ms）")
+    calculator.close()
+    if failed:
+        print("存在编码错误或结果不一致")
+        sys.exit(1)
+
+
+def _random_edit(rng: random.Random, text: str, target_length: int, starts: List[int]) -> Dict:
+    """
+    随机生成一次编辑（插入/删除/替换，偏向空白、换行、emoji等切分点附近的字符）
+
+    约五分之一的编辑位于片段边界附近，删除范围跨越边界；文本长于target_length时偏向删除，
+    短于时偏向插入，大段删除与大段粘贴（复制文本中的一段）成对出现，文本大小保持在初始大小附近。
+    """
+    snippets = ['\n', ' ', '  ', '\n\n', '\t', ' \n', '。', '，', '👍🏽', '🎉', 'é', '123', 'a', '中',
+                '\r\n', '::', '->', '"""', "'s"]
+    length = len(text)
+    roll = rng.random()
+    if roll < 0.2 and len(starts) > 1:
+        # 片段边界前后几个字符，之后的删除会跨越边界
+        offset = min(length, max(0, rng.choice(starts[1:]) + rng.randint(-3, 2)))
+    elif roll < 0.3:
+        offset = rng.choice([0, length, rng.randint(0, length)])
+    else:
+        offset = rng.randint(0, length)
+    # 偶尔编辑一大段，跨越多个片段
+    limit = 5000 if rng.random() < 0.05 else 60
+    drift = max(-0.4, min(0.4, (length - target_length) / max(target_length, 1) * 4))
+    if rng.random() < 1 / 3:
+        kind = 'replace'
+    else:
+        kind = 'delete' if rng.random() < 0.5 + drift else 'insert'
+    delete = 0
+    if kind != 'insert' and offset < length:
+        delete = rng.randint(1, min(limit, length - offset))
+    insert = ''
+    if kind != 'delete':
+        if limit > 60 and length:
+            # 粘贴文本中的一段
+            size = rng.randint(1, min(limit, length))
+            start = rng.randint(0, length - size)
+            insert = text[start:start + size]
+        elif rng.random() < 0.3:
+            insert = rng.choice(WORKLOAD_SENTENCES[rng.choice(WORKLOADS)])
+        else:
+            insert = ''.join(rng.choice(snippets) for _ in range(rng.randint(1, 4)))
+    return {'offset': offset, 'delete': delete, 'insert': insert}
+
+
+def bench_verify_incremental(args):
+    """增量编码的差分测试：随机编辑会话，每次编辑后与整体重新编码的结果对比"""
+    calculator = create_calculator(args.tokenizers_dir, workers=args.workers or os.cpu_count() or 1)
+    models = args.models.split(',') if args.models else calculator.usable_models()
+    models = [m for m in models if calculator.get_tokenizer(m) is not None]
+    if not models:
+        print("错误: 没有可用的模型")
+        sys.exit(1)
+    rng = random.Random(args.seed)
+    text = make_workload_text(args.workload, parse_size(args.size), args.seed)
+    session = EditSession(calculator, text, models)
+    print(f"文本: {args.workload} {len(text):,} 字符, 片段: {len(session.starts)}, 模型: {', '.join(models)}, "
+          f"编辑次数: {args.edits}, 随机种子: {args.seed}")
+
+    mismatches = 0
+    boundary_edits = 0
+    incremental_seconds = 0.0
+    full_seconds = 0.0
+    encoded_chars = 0
+    for step in range(1, args.edits + 1):
+        edit = _random_edit(rng, session.text, len(text), session.starts)
+        edits = [edit]
+        if rng.random() < 0.1:
+            # 一次请求中的多个编辑，位置基于前一个编辑之后的文本
+            edited = session.text[:edit['offset']] + edit['insert'] + session.text[edit['offset'] + edit['delete']:]
+            edits.append(_random_edit(rng, edited, len(text), session.starts))
+        # 删除范围内含片段起点（跨越片段边界）
+        first = bisect.bisect_right(session.starts, edit['offset'])
+        if first < len(session.starts) and session.starts[first] < edit['offset'] + edit['delete']:
+            boundary_edits += 1
+        start = time.perf_counter()
+        session.edit(edits)
+        incremental_seconds += time.perf_counter() - start
+        encoded_chars += session.encoded_chars
+
+        start = time.perf_counter()
+        expected = calculator.encode_batch_all([session.text], models, use_cache=False)
+        full_seconds += time.perf_counter() - start
+        check_ids = step % args.check_ids_every == 0 or step == args.edits
+        encodings = session.encodings() if check_ids else None
+        for model_key in models:
+            full = expected[model_key][0]
+            if session.counts[model_key] != full.count or (
+                    encodings is not None and encodings[model_key].ids != full.ids):
+                mismatches += 1
+                print(f"不一致: 第 {step} 次编辑 {edits}, {model_key}: "
+                      f"增量 {session.counts[model_key]}, 整体 {full.count}")
+                # 重新建立会话，继续检查之后的编辑
+                session = EditSession(calculator, session.text, models)
+                break
+
+    print("-" * 70)
+    print(f"增量编码: 平均 {incremental_seconds / args.edits * 1000:.2f} ms/次, "
+          f"平均重新编码 {encoded_chars / args.edits:,.0f} 字符")
+    print(f"整体编码: 平均 {full_seconds / args.edits * 1000:.2f} ms/次, "
+          f"文本长度 {len(text):,} -> {len(session.text):,} 字符")
+    print(f"跨片段边界的编辑: {boundary_edits} 次")
+    if incremental_seconds > 0:
+        print(f"加速比: {full_seconds / incremental_seconds:.1f}x")
+    calculator.close()
+    if mismatches:
+        print(f"{mismatches} 次编辑的结果与整体编码不一致")
+        sys.exit(1)
+    print("所有编辑的结果均与整体编码一致")
+
+
+def bench_coldstart(args):
+    """冷启动：两种后端从导入到加载完所有tokenizer的耗时和峰值RSS（各在独立子进程中测量）"""
+    tokenizers_dir = args.tokenizers_dir or str(Path(__file__).parent / 'tokenizers')
+    print(f"{'后端':<15} {'耗时(秒)':<12} {'峰值RSS(MB)':<14} {'tokenizer数':<12} {'导入transformers':<18} {'导入torch'}")
+    print("-" * 90)
+    for backend in (BACKEND_TOKENIZERS, BACKEND_TRANSFORMERS):
+        if not is_available(backend):
+            print(f"{backend:<15} 未安装，跳过")
+            continue
+        runs = []
+        for _ in range(args.repeat):
+            completed = subprocess.run(
+                [sys.executable, '-c', COLDSTART_SCRIPT, tokenizers_dir, backend],
+                cwd=str(Path(__file__).parent), capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                print(f"{backend:<15} 失败: {completed.stderr.strip().splitlines()[-1:]}")
+                break
+            runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        if not runs:
+            continue
+        best = min(runs, key=lambda r: r['seconds'])
+        rss = f"{best['peak_rss_bytes'] / 1024 / 1024:.0f}" if best['peak_rss_bytes'] else '-'
+        print(f"{backend:<15} {best['seconds']:<12.2f} {rss:<14} {best['tokenizers']:<12} "
+              f"{str(best['transformers_imported']):<18} {best['torch_imported']}")
+
+
+def bench_serialize(args):
+    """token ID序列化：JSON整数数组与紧凑格式（base64/binary/msgpack）的耗时和大小"""
+    rng = random.Random(0)
+    ids = array('I', (rng.randrange(args.vocab_size) for _ in range(args.tokens)))
+    header = {'success': True, 'results': [{'model': 'bench', 'token_count': len(ids)}]}
+
+    def json_list():
+        # 当前方式：转换为Python int列表后JSON序列化
+        return json.dumps(dict(header, ids=ids.tolist())).encode('utf-8')
+
+    def json_base64():
+        return json.dumps(dict(header, ids=ids_base64(ids))).encode('utf-8')
+
+    def binary():
+        return b''.join(iter_binary(json.loads(json.dumps(header)), [{}], [ids]))
+
+    formats = [('json (int list)', json_list), ('json (base64)', json_base64), ('binary', binary)]
+    if msgpack_available():
+        formats.append(('msgpack', lambda: pack_msgpack(dict(header, ids=ids_buffer(ids)))))
+
+    print(f"token数: {len(ids)}, 原始数据: {ids.itemsize * len(ids) / 1024:.0f} KB")
+    print("-" * 60)
+    print(f"{'格式':<20} {'耗时(毫秒)':<15} {'大小(KB)':<12} {'相对JSON'}")
+    print("-" * 60)
+    baseline = None
+    for name, serialize in formats:
+        serialize()  # 预热
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            payload = serialize()
+        elapsed = (time.perf_counter() - start) / args.repeat
+        baseline = baseline or (elapsed, len(payload))
+        print(f"{name:<20} {elapsed * 1000:<15.2f} {len(payload) / 1024:<12.0f} "
+              f"{baseline[0] / elapsed:.1f}x更快, {len(payload) / baseline[1]:.0%}大小")
+    if not msgpack_available():
+        print("msgpack 未安装，跳过")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TokenCalculator性能基准测试")
+    parser.add_argument('--tokenizers-dir', type=str, default=None, help='本地tokenizer目录（默认./tokenizers）')
+    subparsers = parser.add_subparsers(dest='command')
+
+    workers_parser = subparsers.add_parser('workers', help='多模型并行编码的线程数扩展性')
+    workers_parser.add_argument('--size-kb', type=int, default=1024, help='测试文本大小（KB）')
+    workers_parser.add_argument('--max-workers', type=int, default=None, help='最大线程数（默认CPU核数）')
+    workers_parser.add_argument('--repeat', type=int, default=3, help='每种配置重复次数')
+    workers_parser.set_defaults(func=bench_workers)
+
+    coldstart_parser = subparsers.add_parser('coldstart', help='两种tokenizer后端的冷启动耗时和内存')
+    coldstart_parser.add_argument('--repeat', type=int, default=3, help='每种后端重复次数（取最快一次）')
+    coldstart_parser.set_defaults(func=bench_coldstart)
+
+    serialize_parser = subparsers.add_parser('serialize', help='token ID序列化格式的耗时和大小')
+    serialize_parser.add_argument('--tokens', type=int, default=1000000, help='token数量')
+    serialize_parser.add_argument('--vocab-size', type=int, default=152000, help='随机ID的取值范围')
+    serialize_parser.add_argument('--repeat', type=int, default=5, help='重复次数')
+    serialize_parser.set_defaults(func=bench_serialize)
+
+    suite_parser = subparsers.add_parser('suite', help='吞吐量测试矩阵（文本类型×大小×模式），输出JSON并可与基准对比')
+    suite_parser.add_argument('--workloads', type=str, default=','.join(WORKLOADS), help='文本类型，逗号分隔')
+    suite_parser.add_argument('--sizes', type=str, default=SUITE_SIZES, help='文本大小，逗号分隔（如1KB,1MB,100MB）')
+    suite_parser.add_argument('--quick', action='store_true', help=f'只测试 {QUICK_SIZES}')
+    suite_parser.add_argument('--modes', type=str, default=','.join(SUITE_MODES),
+                              help='single（逐个模型单线程）、threads（多模型线程池）、batch（分成短文本批量编码）')
+    suite_parser.add_argument('--models', type=str, default=None, help='只测试这些模型，逗号分隔')
+    suite_parser.add_argument('--workers', type=int, default=None, help='threads/batch模式的线程数（默认CPU核数）')
+    suite_parser.add_argument('--repeat', type=int, default=5, help='每个用例最多重复次数')
+    suite_parser.add_argument('--case-seconds', type=float, default=10.0, help='每个用例的时间预算（秒，至少运行一次）')
+    suite_parser.add_argument('--doc-chars', type=int, default=1000, help='batch模式每段短文本的字符数')
+    suite_parser.add_argument('-o', '--output', type=str, default=None, help='结果JSON文件（默认输出到stdout）')
+    suite_parser.add_argument('--baseline', type=str, default=None, help='基准结果JSON文件（之前的输出）')
+    suite_parser.add_argument('--threshold', type=float, default=0.1, help='判定为退化的相对变化（默认0.1即10%%）')
+    suite_parser.set_defaults(func=bench_suite)
+
+    stress_parser = subparsers.add_parser('stress', help='多线程并发编码的压力测试（错误检查与吞吐量扩展）')
+    stress_parser.add_argument('--models', type=str, default=None, help='并发编码的模型，逗号分隔（默认第一个模型）')
+    stress_parser.add_argument('--size-kb', type=int, default=16, help='每次编码的文本大小（KB）')
+    stress_parser.add_argument('--seconds', type=float, default=3.0, help='每种线程数运行的秒数')
+    stress_parser.add_argument('--max-threads', type=int, default=None, help='最大线程数（默认CPU核数的2倍），按2的幂递增')
+    stress_parser.add_argument('--pool-size', type=int, default=None, help='每个tokenizer的实例池上限（默认CPU核数，1表示不克隆）')
+    stress_parser.add_argument('--backend', type=str, default=BACKEND_AUTO, choices=BACKENDS, help='tokenizer后端')
+    stress_parser.set_defaults(func=bench_stress)
+
+    verify_parser = subparsers.add_parser('verify-incremental',
+                                          help='增量编码会话的差分测试（随机编辑后与整体编码对比，不一致时退出码为1）')
+    verify_parser.add_argument('--models', type=str, default=None, help='要检查的模型，逗号分隔（默认所有模型）')
+    verify_parser.add_argument('--workload', type=str, default='mixed', choices=WORKLOADS, help='初始文本类型')
+    verify_parser.add_argument('--size', type=str, default='64KB', help='初始文本大小')
+    verify_parser.add_argument('--edits', type=int, default=500, help='随机编辑次数')
+    verify_parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    verify_parser.add_argument('--check-ids-every', type=int, default=50, help='每隔多少次编辑同时比较完整的token ID')
+    verify_parser.add_argument('--workers', type=int, default=None, help='多模型并行编码的线程数（默认CPU核数）')
+    verify_parser.set_defaults(func=bench_verify_incremental)
+
+    args = parser.parse_args()
+    if not getattr(args, 'func', None):
+        parser.print_help()
+        sys.exit(1)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
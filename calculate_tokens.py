@@ -4,16 +4,30 @@ Token计算工具 - 支持Qwen3系列和DeepSeek系列模型
 """
 
 import argparse
+import codecs
+import hashlib
+import json
+import os
 import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from itertools import islice
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
-# 延迟导入transformers，以便在显示帮助信息时不需要安装
-try:
-    from transformers import AutoTokenizer
-    TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    TRANSFORMERS_AVAILABLE = False
+from batching import MicroBatcher
+from chat_template import ChatTemplateError, boundary_pattern, last_boundary, render_chat
+from metrics import CACHE_HITS, ENCODE_SECONDS, ENCODED_CHARS, ENCODED_TOKENS
+from result_cache import ResultCache, text_digest
+from tokenizer_pool import TokenizerPool
+# tokenizers/transformers在真正加载tokenizer时才导入，--help、--list-models等无需加载
+from tokenizer_backends import (
+    BACKEND_AUTO, BACKEND_TOKENIZERS, BACKEND_TRANSFORMERS, BACKENDS, is_available, load_backend
+)
 
 
 # 支持的模型列表
@@ -34,11 +48,135 @@ MODELS = {
     # 注意：DeepSeek-671B在HuggingFace上不存在，已移除
 }
 
+# 决定tokenizer行为的文件（用于计算tokenizer指纹）
+TOKENIZER_FILES = [
+    "tokenizer.json",
+    "tokenizer_config.json",
+    "vocab.json",
+    "merges.txt",
+    "vocab.txt",
+    "special_tokens_map.json",
+    "added_tokens.json",
+    "chat_template.jinja",
+]
+TOKENIZER_FILE_PATTERNS = ["*.model", "*.bpe", "*.vocab", "*.tiktoken"]
+
+# 流式计数时每次读取的字符数
+STREAM_CHUNK_CHARS = 1024 * 1024
+# 寻找安全切分点时，从块尾向前搜索的最大字符数
+SAFE_SPLIT_WINDOW = 64 * 1024
+# 一直找不到安全切分点时，缓冲区的最大字符数（超过后硬切分）
+MAX_CARRY_CHARS = 4 * STREAM_CHUNK_CHARS
+# 检测上传内容编码时查看的开头字节数
+SNIFF_BYTES = 64 * 1024
+# 从字节流增量解码时每次读取的字节数
+DECODE_READ_BYTES = 256 * 1024
+# 批量计数时每组的文本数（每个tokenizer对每组调用一次encode_batch）
+BATCH_SLICE_TEXTS = 256
+# 超过该字符数的文本直接编码，不参与微批处理（长文本的单次调用开销可以忽略，不值得等待窗口）
+BATCH_MAX_CHARS = 64 * 1024
+# 对话前缀token数缓存的字节预算（每个条目只有长度、数量和摘要）
+CHAT_PREFIX_CACHE_BYTES = 16 * 1024 * 1024
+CHAT_PREFIX_ENTRY_BYTES = 256
+# 分块时的切分方式：none（任意token边界）、newline（优先在换行处）、sentence（优先在句末或换行处）
+CHUNK_SNAP_MODES = ['none', 'newline', 'sentence']
+# 句末标点（ASCII标点之后还需有空白，避免切开3.14、e.g.等）
+CJK_SENTENCE_ENDS = '。！？；…'
+ASCII_SENTENCE_ENDS = '.!?;'
+# 对齐到换行/句末时，块至少保留max_tokens的这一比例，找不到时在token边界处切分
+CHUNK_SNAP_MIN_FRACTION = 0.5
+
+
+@dataclass
+class EncodeResult:
+    """
+    单个模型对一段文本的一次编码结果
+    
+    同一次请求中的token数量、字符/Token比率和分词预览都复用这一个结果，
+    避免对同一文本重复编码。
+    """
+    ids: array  # token IDs（array('I')，连续存储）
+    offsets: Optional[List[Tuple[int, int]]] = None  # 每个token在原文中的字符区间（可选）
+    
+    @property
+    def count(self) -> int:
+        """token数量"""
+        return len(self.ids)
+    
+    @property
+    def nbytes(self) -> int:
+        """结果占用内存的估计值（字节）"""
+        size = self.ids.itemsize * len(self.ids)
+        if self.offsets is not None:
+            # 每个偏移元组约为一个tuple对象加两个int对象
+            size += 120 * len(self.offsets)
+        return size
+
+
+class VocabDisplayTable:
+    """
+    词表显示字符串表：token ID -> 分词预览中显示的字符串
+    
+    在tokenizer加载时一次性构建，所有字符串拼接成一个大字符串，
+    另用数组记录每个ID的起止位置，查表代替逐个token调用decode。
+    每个ID单独解码，因此不完整的UTF-8字节片段（byte-level BPE/byte fallback）
+    与逐个decode一样显示为替换字符。
+    """
+    
+    def __init__(self, pieces: List[str]):
+        self._blob = ''.join(pieces)
+        self._offsets = array('I', [0])
+        position = 0
+        for piece in pieces:
+            position += len(piece)
+            self._offsets.append(position)
+    
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+    
+    @property
+    def nbytes(self) -> int:
+        """显示表占用内存（字节）"""
+        return sys.getsizeof(self._blob) + self._offsets.itemsize * len(self._offsets)
+    
+    def __getitem__(self, token_id: int) -> str:
+        return self._blob[self._offsets[token_id]:self._offsets[token_id + 1]]
+    
+    def lookup(self, token_ids: List[int]) -> List[str]:
+        """
+        批量查表
+        
+        Args:
+            token_ids: token ID列表（必须都在词表范围内）
+            
+        Returns:
+            token字符串列表
+        """
+        blob = self._blob
+        offsets = self._offsets
+        return [blob[offsets[i]:offsets[i + 1]] for i in token_ids]
+    
+    @classmethod
+    def build(cls, tokenizer) -> 'VocabDisplayTable':
+        """
+        为tokenizer后端构建显示表
+        
+        Args:
+            tokenizer: 已加载的tokenizer后端
+            
+        Returns:
+            显示表
+        """
+        return cls(tokenizer.display_pieces())
+
 
 class TokenCalculator:
     """Token计算器"""
     
-    def __init__(self, models: Optional[List[str]] = None, local_mode: bool = False, tokenizers_dir: Optional[str] = None):
+    def __init__(self, models: Optional[List[str]] = None, local_mode: bool = False, tokenizers_dir: Optional[str] = None,
+                 workers: Optional[int] = None, cache_bytes: int = 0, backend: str = BACKEND_AUTO,
+                 lazy: bool = False, memory_budget: int = 0, batch_window_ms: float = 0,
+                 max_batch_size: int = 32, pool_size: Optional[int] = None):
         """
         初始化Token计算器
         
@@ -46,8 +184,20 @@ class TokenCalculator:
             models: 要使用的模型列表，如果为None则使用所有模型
             local_mode: 是否使用本地模式（从本地文件系统加载）
             tokenizers_dir: 本地tokenizer目录路径（local_mode=True时使用）
+            workers: 多模型并行编码的线程数，None表示取模型数与CPU核数的较小值，1表示串行
+            cache_bytes: 编码结果缓存的字节预算，0表示不缓存
+            backend: tokenizer后端（auto/tokenizers/transformers），auto优先使用轻量的tokenizers库
+            lazy: 是否延迟加载（每个模型第一次被使用时才加载tokenizer）
+            memory_budget: 已加载tokenizer的内存预算（字节，估计值），超出时卸载最久未使用的，0表示不限制
+            batch_window_ms: 微批处理窗口（毫秒），并发请求中同一tokenizer的编码合并为一次encode_batch，0表示不合并
+            max_batch_size: 每批最多合并的编码请求数
+            pool_size: 每个tokenizer实例池的实例数上限（并发编码时按需克隆），None表示CPU核数，1表示不克隆
         """
         self.local_mode = local_mode
+        self.backend = backend
+        self.lazy = lazy
+        self.memory_budget = memory_budget
+        self.pool_size = max(1, pool_size if pool_size is not None else (os.cpu_count() or 1))
         self.tokenizers_dir = Path(tokenizers_dir) if tokenizers_dir else Path(__file__).parent / "tokenizers"
         
         # 如果是本地模式，自动扫描tokenizers目录
@@ -63,8 +213,137 @@ class TokenCalculator:
         else:
             self.models = self.available_models
         
+        # 当前已加载的tokenizer（延迟加载或被淘汰时会变化）
         self.tokenizers: Dict[str, any] = {}
-        self._load_tokenizers()
+        self.display_tables: Dict[str, VocabDisplayTable] = {}
+        # 编码时从实例池借出独占的tokenizer实例（共享tokenizer的模型共用同一个池）
+        self.pools: Dict[str, TokenizerPool] = {}
+        self.fingerprints: Dict[str, str] = {}
+        self.load_errors: Dict[str, str] = {}
+        self.load_times: Dict[str, float] = {}
+        self.evictions = 0
+        # 指纹 -> 已加载的tokenizer实例（按最近使用排序，用于LRU淘汰）
+        self._instances: 'OrderedDict[str, dict]' = OrderedDict()
+        self._registry_lock = threading.RLock()
+        # 每个模型一把锁，同一模型的并发加载只执行一次
+        self._key_locks: Dict[str, threading.Lock] = {}
+        # 每个tokenizer指纹一把锁，共享同一tokenizer的不同模型并发加载时也只加载一次
+        self._fingerprint_locks: Dict[str, threading.Lock] = {}
+        
+        if lazy:
+            self._check_backends()
+            print(f"延迟加载模式: {len(self.models)} 个模型将在首次使用时加载\n")
+        else:
+            self._load_tokenizers()
+        
+        # 按内容寻址的编码结果缓存：键为（文本摘要, tokenizer指纹）
+        self.cache: Optional[ResultCache] = ResultCache(cache_bytes) if cache_bytes > 0 else None
+        # 对话前缀的token数缓存：键为消息列表的滚动哈希，追加消息时只需编码新增的部分
+        self.chat_prefix_cache = ResultCache(CHAT_PREFIX_CACHE_BYTES)
+        # 指纹 -> 匹配特殊token的正则（寻找安全切分点）
+        self._chat_boundaries: Dict[str, object] = {}
+        
+        # 多模型编码共享的线程池（fast tokenizer编码时会释放GIL），首次使用时创建
+        if workers is None:
+            workers = min(len(self.models), os.cpu_count() or 1)
+        self.workers = max(1, workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        
+        # 跨请求的微批处理调度器（服务端并发请求时使用）
+        self.batcher: Optional[MicroBatcher] = (
+            MicroBatcher(self._run_batch, batch_window_ms / 1000, max_batch_size) if batch_window_ms > 0 else None
+        )
+    
+    def _get_executor(self) -> Optional[ThreadPoolExecutor]:
+        """获取共享线程池，串行模式下返回None"""
+        if self.workers <= 1:
+            return None
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='token-encode'
+                    )
+        return self._executor
+    
+    def close(self):
+        """关闭共享线程池"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+    
+    def _build_display_table(self, model_key: str, tokenizer) -> Optional[VocabDisplayTable]:
+        """为刚加载的tokenizer构建词表显示字符串表（失败时decode_tokens退化为逐个decode）"""
+        try:
+            return VocabDisplayTable.build(tokenizer)
+        except Exception as e:
+            print(f"  警告: 无法为 {model_key} 构建词表显示表: {e}")
+            return None
+    
+    def _tokenizer_files(self, model_key: str) -> List[Path]:
+        """本地模式下决定tokenizer行为的文件"""
+        local_path = self.tokenizers_dir / model_key
+        files = [local_path / name for name in TOKENIZER_FILES]
+        for pattern in TOKENIZER_FILE_PATTERNS:
+            files.extend(local_path.glob(pattern))
+        return sorted(p for p in set(files) if p.is_file())
+    
+    def _tokenizer_fingerprint(self, model_key: str, tokenizer=None) -> str:
+        """
+        计算tokenizer指纹
+        
+        指纹相同的tokenizer行为完全相同：加载时据此去重，缓存键也使用指纹，
+        tokenizer文件变化后旧的缓存结果自然失效。
+        本地模式对目录下的tokenizer文件内容做哈希（无需加载）；在线模式使用
+        序列化后的tokenizer（非fast tokenizer则使用模型名和词表大小），以及
+        tokenizer配置、chat template和特殊token（同一个tokenizer.json可能配有不同的模板）。
+        
+        Args:
+            model_key: 模型键名
+            tokenizer: 在线模式下已加载的tokenizer
+            
+        Returns:
+            十六进制指纹字符串
+        """
+        digest = hashlib.sha256()
+        if self.local_mode:
+            for file_path in self._tokenizer_files(model_key):
+                digest.update(file_path.name.encode('utf-8'))
+                with open(file_path, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(block)
+        else:
+            serialized = tokenizer.serialized()
+            if serialized is not None:
+                digest.update(serialized.encode('utf-8'))
+            else:
+                digest.update(f"{MODELS.get(model_key, model_key)}:{len(tokenizer)}".encode('utf-8'))
+            behavior = {
+                'settings': tokenizer.settings(),
+                'chat_template': tokenizer.chat_template(),
+                'special_tokens': tokenizer.special_tokens(),
+            }
+            digest.update(json.dumps(behavior, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def _estimate_tokenizer_bytes(self, model_key: str, tokenizer, table: Optional[VocabDisplayTable]) -> int:
+        """
+        估计tokenizer实例占用的内存
+        
+        解析后的词表、合并规则等约为tokenizer文件大小的3倍，再加上显示表。
+        只用于内存预算的相对比较，不是精确值。
+        """
+        if self.local_mode:
+            size = sum(p.stat().st_size for p in self._tokenizer_files(model_key))
+        else:
+            size = len(tokenizer.serialized() or '')
+        size *= 3
+        if table is not None:
+            size += table.nbytes
+        return size
     
     def _scan_tokenizers_dir(self) -> List[str]:
         """
@@ -109,47 +388,736 @@ class TokenCalculator:
         
         return models
     
+    def _check_backends(self):
+        """检查是否安装了可用的tokenizer后端"""
+        if not (is_available(BACKEND_TOKENIZERS) or is_available(BACKEND_TRANSFORMERS)):
+            print("错误: 请先安装tokenizers或transformers库")
+            print("运行: pip install tokenizers")
+            sys.exit(1)
+    
     def _load_tokenizers(self):
         """加载所有需要的tokenizer"""
-        if not TRANSFORMERS_AVAILABLE:
-            print("错误: 请先安装transformers库")
-            print("运行: pip install transformers")
-            sys.exit(1)
+        self._check_backends()
         
         print(f"正在加载 {len(self.models)} 个tokenizers...")
         for model_key in self.models:
-            try:
-                if self.local_mode:
-                    # 从本地加载
-                    local_path = self.tokenizers_dir / model_key
-                    if not local_path.exists():
-                        print(f"  警告: 本地tokenizer不存在: {local_path}，跳过")
-                        continue
-                    print(f"  加载 {model_key} (本地: {local_path})...")
-                    self.tokenizers[model_key] = AutoTokenizer.from_pretrained(
-                        str(local_path),
-                        trust_remote_code=True,
-                        local_files_only=True
-                    )
-                else:
-                    # 从HuggingFace Hub加载（需要MODELS字典）
-                    if model_key not in MODELS:
-                        print(f"  警告: 未知的模型 '{model_key}'，跳过")
-                        continue
-                    model_name = MODELS[model_key]
-                    print(f"  加载 {model_key} ({model_name})...")
-                    self.tokenizers[model_key] = AutoTokenizer.from_pretrained(
-                        model_name,
-                        trust_remote_code=True
-                    )
-            except Exception as e:
-                print(f"  错误: 无法加载 {model_key}: {e}")
+            self.get_tokenizer(model_key)
         
         if not self.tokenizers:
             print("错误: 没有成功加载任何tokenizer")
             sys.exit(1)
         
-        print(f"成功加载 {len(self.tokenizers)} 个tokenizer\n")
+        print(f"成功加载 {len(self.tokenizers)} 个tokenizer（{len(self._instances)} 个不同的tokenizer实例）\n")
+    
+    def get_tokenizer(self, model_key: str):
+        """
+        获取模型的tokenizer，未加载时加载（同一模型的并发加载只执行一次）
+        
+        Args:
+            model_key: 模型键名
+            
+        Returns:
+            tokenizer后端，模型不可用或加载失败时返回None
+        """
+        tokenizer = self.tokenizers.get(model_key)
+        if tokenizer is not None:
+            return tokenizer
+        if model_key not in self.models:
+            return None
+        with self._registry_lock:
+            key_lock = self._key_locks.setdefault(model_key, threading.Lock())
+        with key_lock:
+            # 等锁期间可能已被其他线程加载
+            tokenizer = self.tokenizers.get(model_key)
+            if tokenizer is None:
+                tokenizer = self._load_one(model_key)
+        return tokenizer
+    
+    def _load_one(self, model_key: str):
+        """加载单个tokenizer并注册；文件完全相同的tokenizer只加载一次，多个模型共享"""
+        start = time.perf_counter()
+        try:
+            if self.local_mode:
+                # 从本地加载
+                local_path = self.tokenizers_dir / model_key
+                if not local_path.exists():
+                    print(f"  警告: 本地tokenizer不存在: {local_path}，跳过")
+                    self.load_errors[model_key] = '本地tokenizer不存在'
+                    return None
+                # 加载前先按文件内容计算指纹，相同的tokenizer直接共享；
+                # 按指纹加锁，共享同一tokenizer的模型并发加载（如preload）时也只加载一次
+                fingerprint = self._tokenizer_fingerprint(model_key)
+                with self._fingerprint_lock(fingerprint):
+                    with self._registry_lock:
+                        if fingerprint in self._instances:
+                            self.load_times[model_key] = time.perf_counter() - start
+                            return self._attach(model_key, fingerprint)
+                    print(f"  加载 {model_key} (本地: {local_path})...")
+                    tokenizer = load_backend(str(local_path), local=True, backend=self.backend)
+                    return self._register(model_key, fingerprint, tokenizer, start)
+            else:
+                # 从HuggingFace Hub加载（需要MODELS字典）
+                if model_key not in MODELS:
+                    print(f"  警告: 未知的模型 '{model_key}'，跳过")
+                    self.load_errors[model_key] = '未知的模型'
+                    return None
+                model_name = MODELS[model_key]
+                print(f"  加载 {model_key} ({model_name})...")
+                tokenizer = load_backend(model_name, local=False, backend=self.backend)
+                # 在线模式只能在加载后计算指纹，相同时丢弃新实例改为共享（显示表只构建一次）
+                fingerprint = self._tokenizer_fingerprint(model_key, tokenizer)
+                with self._fingerprint_lock(fingerprint):
+                    return self._register(model_key, fingerprint, tokenizer, start)
+        except Exception as e:
+            print(f"  错误: 无法加载 {model_key}: {e}")
+            self.load_errors[model_key] = str(e)
+            return None
+    
+    def _fingerprint_lock(self, fingerprint: str) -> threading.Lock:
+        """指纹对应的加载锁"""
+        with self._registry_lock:
+            return self._fingerprint_locks.setdefault(fingerprint, threading.Lock())
+    
+    def _register(self, model_key: str, fingerprint: str, tokenizer, start: float):
+        """注册新加载的tokenizer（调用方持有该指纹的加载锁；已有相同指纹的实例时直接共享）"""
+        table = None
+        if fingerprint not in self._instances:
+            table = self._build_display_table(model_key, tokenizer)
+        with self._registry_lock:
+            if fingerprint not in self._instances:
+                self._instances[fingerprint] = {
+                    'tokenizer': tokenizer,
+                    'table': table,
+                    'pool': TokenizerPool(tokenizer, self.pool_size),
+                    'keys': set(),
+                    'bytes': self._estimate_tokenizer_bytes(model_key, tokenizer, table),
+                    'clone_bytes': self._estimate_tokenizer_bytes(model_key, tokenizer, None)
+                }
+            tokenizer = self._attach(model_key, fingerprint)
+            self.load_errors.pop(model_key, None)
+            self.load_times[model_key] = time.perf_counter() - start
+            self._evict_if_needed(keep=fingerprint)
+        return tokenizer
+    
+    def _attach(self, model_key: str, fingerprint: str):
+        """让model_key使用指纹对应的已加载实例（调用方持有_registry_lock）"""
+        instance = self._instances[fingerprint]
+        if instance['keys'] and model_key not in instance['keys']:
+            source_key = sorted(instance['keys'])[0]
+            print(f"  {model_key} 与 {source_key} 的tokenizer完全相同，共享同一实例")
+        instance['keys'].add(model_key)
+        self.tokenizers[model_key] = instance['tokenizer']
+        self.pools[model_key] = instance['pool']
+        self.fingerprints[model_key] = fingerprint
+        if instance['table'] is not None:
+            self.display_tables[model_key] = instance['table']
+        self._instances.move_to_end(fingerprint)
+        return instance['tokenizer']
+    
+    def _evict_if_needed(self, keep: str):
+        """超出内存预算时卸载最久未使用的tokenizer实例（调用方持有_registry_lock）"""
+        if self.memory_budget <= 0:
+            return
+        total = sum(self._instance_bytes(instance) for instance in self._instances.values())
+        for fingerprint in list(self._instances.keys()):
+            if total <= self.memory_budget:
+                break
+            if fingerprint == keep:
+                continue
+            instance = self._instances.pop(fingerprint)
+            total -= self._instance_bytes(instance)
+            self.evictions += 1
+            print(f"  内存预算不足，卸载 {', '.join(sorted(instance['keys']))}")
+            # 正在编码的线程仍持有实例引用，不受影响
+            for model_key in instance['keys']:
+                self.tokenizers.pop(model_key, None)
+                self.pools.pop(model_key, None)
+                self.display_tables.pop(model_key, None)
+    
+    @staticmethod
+    def _instance_bytes(instance: dict) -> int:
+        """tokenizer实例（含实例池中克隆的副本）的内存估计值"""
+        return instance['bytes'] + (instance['pool'].size - 1) * instance['clone_bytes']
+    
+    def _touch(self, model_key: str):
+        """标记模型最近被使用（仅在有内存预算时需要维护LRU顺序）"""
+        if self.memory_budget <= 0:
+            return
+        fingerprint = self.fingerprints.get(model_key)
+        with self._registry_lock:
+            if fingerprint in self._instances:
+                self._instances.move_to_end(fingerprint)
+    
+    def preload(self, models: Optional[List[str]] = None) -> Dict[str, float]:
+        """
+        并行加载tokenizer（用于服务启动时预热）
+        
+        Args:
+            models: 要加载的模型列表，如果为None则加载所有模型
+            
+        Returns:
+            每个模型的加载耗时（秒）
+        """
+        model_keys = models if models is not None else self.models
+        print(f"正在并行加载 {len(model_keys)} 个tokenizers...")
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(model_keys))),
+                                thread_name_prefix='token-load') as executor:
+            list(executor.map(self.get_tokenizer, model_keys))
+        print(f"成功加载 {len(self.tokenizers)} 个tokenizer（{len(self._instances)} 个不同的tokenizer实例）\n")
+        return dict(self.load_times)
+    
+    def tokenizer_bytes(self) -> Dict[str, int]:
+        """每个已加载模型的tokenizer内存估计值（含克隆的副本，共享实例的模型报告同一个值）"""
+        with self._registry_lock:
+            return {
+                model_key: self._instance_bytes(instance)
+                for instance in self._instances.values()
+                for model_key in instance['keys']
+            }
+    
+    def usable_models(self) -> List[str]:
+        """可以使用的模型（已加载的，以及尚未加载且没有加载失败的）"""
+        return [m for m in self.models if m in self.tokenizers or m not in self.load_errors]
+    
+    def registry_stats(self) -> Dict:
+        """tokenizer加载情况统计"""
+        with self._registry_lock:
+            return {
+                'lazy': self.lazy,
+                'loaded_models': sorted(self.tokenizers.keys()),
+                'loaded_instances': len(self._instances),
+                'estimated_bytes': sum(self._instance_bytes(instance) for instance in self._instances.values()),
+                'memory_budget': self.memory_budget,
+                'evictions': self.evictions,
+                'pool_size': self.pool_size,
+                'pools': {
+                    sorted(instance['keys'])[0]: instance['pool'].stats()
+                    for instance in self._instances.values() if instance['keys']
+                }
+            }
+    
+    def get_pool(self, model_key: str) -> Optional[TokenizerPool]:
+        """
+        获取模型的tokenizer实例池，未加载时加载
+        
+        Returns:
+            实例池，模型不可用或加载失败时返回None
+        """
+        tokenizer = self.get_tokenizer(model_key)
+        if tokenizer is None:
+            return None
+        pool = self.pools.get(model_key)
+        if pool is None or pool.prototype is not tokenizer:
+            # 刚好被内存预算淘汰，本次编码直接独占使用该实例
+            pool = TokenizerPool(tokenizer, 1)
+        return pool
+    
+    def encode(self, text: str, model_key: str, return_offsets: bool = False,
+               digest: Optional[str] = None, use_cache: bool = True) -> Optional[EncodeResult]:
+        """
+        使用指定模型对文本编码一次（启用缓存时优先读取缓存）
+        
+        Args:
+            text: 输入文本
+            model_key: 模型键名
+            return_offsets: 是否同时返回每个token的字符偏移
+            digest: 预先计算好的文本摘要（多模型编码时只对文本哈希一次）
+            use_cache: 是否使用结果缓存（流式计数的分块不需要缓存）
+            
+        Returns:
+            编码结果，模型不可用时返回None
+        """
+        pool = self.get_pool(model_key)
+        if pool is None:
+            return None
+        self._touch(model_key)
+        
+        cache_key = None
+        if self.cache is not None and use_cache:
+            # 指纹相同的模型共享缓存结果
+            cache_key = (digest or text_digest(text), self.fingerprints.get(model_key, model_key))
+            cached = self.cache.get(cache_key)
+            if cached is not None and (cached.offsets is not None or not return_offsets):
+                CACHE_HITS.inc(1, model_key)
+                return cached
+        
+        if self.batcher is not None and len(text) <= BATCH_MAX_CHARS:
+            # 与其他并发请求中使用同一tokenizer的编码合并为一批
+            batch_key = (self.fingerprints.get(model_key, model_key), return_offsets)
+            result = self.batcher.submit(batch_key, (pool, text, model_key))
+        else:
+            result = self._encode_uncached(text, pool, return_offsets, model_key)
+        ENCODED_TOKENS.inc(result.count, model_key)
+        ENCODED_CHARS.inc(len(text), model_key)
+        if cache_key is not None:
+            self.cache.put(cache_key, result, result.nbytes)
+        return result
+    
+    def _encode_uncached(self, text: str, pool: TokenizerPool, return_offsets: bool, model_key: str) -> EncodeResult:
+        """
+        从实例池借出tokenizer编码
+        
+        ENCODE_SECONDS只记录tokenizer调用本身的耗时（不含等待实例池和微批处理排队），
+        每次tokenizer调用记录一个样本。
+        """
+        with pool.checkout() as tokenizer:
+            start = time.perf_counter()
+            ids, offsets = tokenizer.encode(text, return_offsets=return_offsets)
+            ENCODE_SECONDS.observe(time.perf_counter() - start, model_key)
+        return EncodeResult(ids=array('I', ids), offsets=offsets)
+    
+    def _encode_batch_uncached(self, texts: List[str], pool: TokenizerPool,
+                               return_offsets: bool, model_key: str) -> List[EncodeResult]:
+        """从实例池借出tokenizer批量编码（一次encode_batch记录一个ENCODE_SECONDS样本）"""
+        with pool.checkout() as tokenizer:
+            start = time.perf_counter()
+            encoded = tokenizer.encode_batch(texts, return_offsets=return_offsets)
+            ENCODE_SECONDS.observe(time.perf_counter() - start, model_key)
+        return [EncodeResult(ids=array('I', ids), offsets=offsets) for ids, offsets in encoded]
+    
+    def _run_batch(self, batch_key: Tuple[str, bool],
+                   requests: List[Tuple[TokenizerPool, str, str]]) -> List[EncodeResult]:
+        """
+        执行微批处理调度器合并的一批编码
+        
+        同一批的tokenizer指纹相同，使用第一个请求的实例池；一批可能包含共享tokenizer的多个模型，
+        耗时样本记在第一个请求的模型下。
+        """
+        pool, _, model_key = requests[0]
+        return self._encode_batch_uncached([text for _, text, _ in requests], pool, batch_key[1], model_key)
+    
+    def encode_batch(self, texts: List[str], model_key: str, return_offsets: bool = False,
+                     use_cache: bool = True) -> Optional[List[EncodeResult]]:
+        """
+        使用指定模型对多段文本批量编码（只对未命中缓存的文本调用一次encode_batch）
+        
+        Args:
+            texts: 文本列表
+            model_key: 模型键名
+            return_offsets: 是否同时返回每个token的字符偏移
+            use_cache: 是否使用结果缓存
+            
+        Returns:
+            与texts一一对应的编码结果列表，模型不可用时返回None
+        """
+        pool = self.get_pool(model_key)
+        if pool is None:
+            return None
+        self._touch(model_key)
+        
+        results: List[Optional[EncodeResult]] = [None] * len(texts)
+        cache_keys: List[Optional[tuple]] = [None] * len(texts)
+        if self.cache is not None and use_cache:
+            fingerprint = self.fingerprints.get(model_key, model_key)
+            for i, text in enumerate(texts):
+                cache_keys[i] = (text_digest(text), fingerprint)
+                cached = self.cache.get(cache_keys[i])
+                if cached is not None and (cached.offsets is not None or not return_offsets):
+                    results[i] = cached
+        
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) < len(texts):
+            CACHE_HITS.inc(len(texts) - len(missing), model_key)
+        if missing:
+            encoded = self._encode_batch_uncached([texts[i] for i in missing], pool, return_offsets, model_key)
+            ENCODED_TOKENS.inc(sum(result.count for result in encoded), model_key)
+            ENCODED_CHARS.inc(sum(len(texts[i]) for i in missing), model_key)
+            for i, result in zip(missing, encoded):
+                results[i] = result
+                if cache_keys[i] is not None:
+                    self.cache.put(cache_keys[i], result, result.nbytes)
+        return results
+    
+    def _group_by_tokenizer(self, model_keys: List[str]) -> Dict[str, List[str]]:
+        """
+        按tokenizer指纹对模型分组（延迟加载的模型在加载前指纹未知，按模型键名单独成组）
+        
+        Returns:
+            字典，键为指纹，值为使用该tokenizer的模型列表（保持输入顺序）
+        """
+        groups: Dict[str, List[str]] = {}
+        for model_key in model_keys:
+            groups.setdefault(self.fingerprints.get(model_key, model_key), []).append(model_key)
+        return groups
+    
+    def iter_encode_all(self, text: str, models: Optional[List[str]] = None,
+                        return_offsets: bool = False, use_cache: bool = True,
+                        timings: Optional[Dict[str, float]] = None
+                        ) -> Iterator[Tuple[str, Optional[EncodeResult]]]:
+        """
+        使用多个模型对文本编码，每个模型编码完成后立即产出结果
+        
+        多个模型时在共享线程池中并行编码，按完成顺序产出（最快的tokenizer最先返回）；
+        共享同一tokenizer的模型只编码一次，完成时一起产出。
+        
+        Args:
+            text: 输入文本
+            models: 要使用的模型列表，如果为None则使用所有可用的模型
+            return_offsets: 是否同时返回每个token的字符偏移
+            use_cache: 是否使用结果缓存
+            timings: 传入字典时，记录每个实际编码的模型的耗时（秒）
+            
+        Yields:
+            (模型名, 编码结果)，出错时编码结果为None
+        """
+        model_keys = models if models is not None else self.usable_models()
+        model_keys = [m for m in model_keys if m in self.models]
+        # 启用缓存时，文本只哈希一次，所有模型共用
+        digest = text_digest(text) if self.cache is not None and use_cache else None
+        
+        def encode_one(model_key: str) -> Optional[EncodeResult]:
+            start = time.perf_counter()
+            try:
+                return self.encode(text, model_key, return_offsets=return_offsets,
+                                   digest=digest, use_cache=use_cache)
+            except Exception as e:
+                print(f"警告: 计算 {model_key} 的tokens时出错: {e}")
+                return None
+            finally:
+                if timings is not None:
+                    timings[model_key] = time.perf_counter() - start
+        
+        # 共享同一tokenizer的模型只编码一次，结果分发给每个模型
+        groups = self._group_by_tokenizer(model_keys)
+        
+        executor = self._get_executor() if len(groups) > 1 else None
+        if executor is None:
+            for keys in groups.values():
+                encoding = encode_one(keys[0])
+                for model_key in keys:
+                    yield model_key, encoding
+            return
+        
+        futures = {executor.submit(encode_one, keys[0]): keys for keys in groups.values()}
+        for future in as_completed(futures):
+            encoding = future.result()
+            for model_key in futures[future]:
+                yield model_key, encoding
+    
+    def encode_all(self, text: str, models: Optional[List[str]] = None,
+                   return_offsets: bool = False, use_cache: bool = True,
+                   timings: Optional[Dict[str, float]] = None) -> Dict[str, Optional[EncodeResult]]:
+        """
+        使用多个模型对文本编码，每个模型只编码一次
+        
+        多个模型时在共享线程池中并行编码，返回结果的顺序与models一致。
+        
+        Args:
+            text: 输入文本
+            models: 要使用的模型列表，如果为None则使用所有可用的模型
+            return_offsets: 是否同时返回每个token的字符偏移
+            use_cache: 是否使用结果缓存
+            timings: 传入字典时，记录每个实际编码的模型的耗时（秒）
+            
+        Returns:
+            字典，键为模型名，值为编码结果（出错时为None）
+        """
+        encoded = dict(self.iter_encode_all(text, models, return_offsets=return_offsets,
+                                            use_cache=use_cache, timings=timings))
+        # 按模型顺序重新排列，保证输出顺序确定
+        model_keys = models if models is not None else self.usable_models()
+        return {model_key: encoded[model_key] for model_key in model_keys if model_key in encoded}
+    
+    def encode_batch_all(self, texts: List[str], models: Optional[List[str]] = None,
+                         use_cache: bool = True) -> Dict[str, Optional[List[EncodeResult]]]:
+        """
+        使用多个模型对多段文本批量编码（共享同一tokenizer的模型只编码一次，多个tokenizer并行）
+    
+        Args:
+            texts: 文本列表
+            models: 要使用的模型列表，如果为None则使用所有可用的模型
+            use_cache: 是否使用结果缓存
+    
+        Returns:
+            字典，键为模型名，值为与texts一一对应的编码结果列表（出错时为None）
+        """
+        model_keys = models if models is not None else self.usable_models()
+        model_keys = [m for m in model_keys if m in self.models]
+    
+        def encode_one(model_key: str) -> Optional[List[EncodeResult]]:
+            try:
+                return self.encode_batch(texts, model_key, use_cache=use_cache)
+            except Exception as e:
+                print(f"警告: 批量计算 {model_key} 的tokens时出错: {e}")
+                return None
+    
+        groups = self._group_by_tokenizer(model_keys)
+        executor = self._get_executor() if len(groups) > 1 else None
+        if executor is None:
+            encoded = [encode_one(keys[0]) for keys in groups.values()]
+        else:
+            futures = [executor.submit(encode_one, keys[0]) for keys in groups.values()]
+            encoded = [future.result() for future in futures]
+    
+        by_model: Dict[str, Optional[List[EncodeResult]]] = {}
+        for keys, results in zip(groups.values(), encoded):
+            for model_key in keys:
+                by_model[model_key] = results
+        return {model_key: by_model[model_key] for model_key in model_keys}
+    
+    def _chat_boundary_pattern(self, model_key: str, tokenizer):
+        """模型的特殊token正则（按指纹缓存）"""
+        fingerprint = self.fingerprints.get(model_key, model_key)
+        pattern = self._chat_boundaries.get(fingerprint)
+        if pattern is None:
+            pattern = self._chat_boundaries[fingerprint] = boundary_pattern(tokenizer.boundary_tokens()) or False
+        return pattern or None
+    
+    def count_chat(self, messages: List[Dict], model_key: str, add_generation_prompt: bool = True,
+                   template_kwargs: Optional[Dict] = None) -> Optional[Dict[str, int]]:
+        """
+        按模型的chat template计算消息列表的token数量（含角色标记、特殊token等模板开销）
+        
+        每次计算后记住整个对话在最后一个安全切分点（特殊token之后）之前的token数，
+        键为消息列表的滚动哈希；之后在同一对话末尾追加消息时，从最长的已缓存前缀开始，
+        只编码其后的文本。前缀的渲染结果发生变化（例如模板根据后续消息改写了之前的内容）
+        时摘要不匹配，改用更短的前缀或整体编码。
+        
+        Args:
+            messages: 消息列表，如 [{"role": "system", "content": "..."}, {"role": "user", "content": "..."}]
+            model_key: 模型键名
+            add_generation_prompt: 是否计入assistant回复的开头
+            template_kwargs: 传给模板的其他变量（如enable_thinking）
+            
+        Returns:
+            {'token_count': 总数, 'cached_tokens': 复用的前缀token数, 'encoded_chars': 本次编码的字符数,
+             'rendered_chars': 渲染后的字符数}；模型不可用时返回None，没有chat template或渲染失败时抛出ChatTemplateError
+        """
+        tokenizer = self.get_tokenizer(model_key)
+        if tokenizer is None:
+            return None
+        template = tokenizer.chat_template()
+        if template is None:
+            raise ChatTemplateError(f'{model_key} 没有chat template')
+        template_kwargs = template_kwargs or {}
+        rendered = render_chat(template, messages, add_generation_prompt, tokenizer.special_tokens(), **template_kwargs)
+        
+        # 滚动哈希：每个前缀的哈希由上一个前缀的哈希和新消息计算；
+        # 初始值包含模板文本的摘要，共用tokenizer.json但模板不同的模型不会复用彼此的前缀
+        fingerprint = self.fingerprints.get(model_key, model_key)
+        seed = f"{fingerprint}:{text_digest(template)}:{json.dumps(template_kwargs, sort_keys=True, ensure_ascii=False)}"
+        state = hashlib.blake2b(seed.encode('utf-8', 'surrogatepass'), digest_size=20).digest()
+        prefix_hashes = []
+        for message in messages:
+            encoded = json.dumps(message, sort_keys=True, ensure_ascii=False).encode('utf-8', 'surrogatepass')
+            state = hashlib.blake2b(state + encoded, digest_size=20).digest()
+            prefix_hashes.append(state)
+        
+        # 从最长的前缀开始查找缓存，渲染出的前缀文本必须完全相同
+        start, cached_tokens = 0, 0
+        for prefix_hash in reversed(prefix_hashes):
+            entry = self.chat_prefix_cache.get(('chat', prefix_hash))
+            if entry is not None:
+                length, count, digest = entry
+                if length <= len(rendered) and text_digest(rendered[:length]) == digest:
+                    start, cached_tokens = length, count
+                    break
+        
+        suffix = rendered[start:]
+        encoding = self.encode(suffix, model_key, return_offsets=True, use_cache=False)
+        total = cached_tokens + encoding.count
+        
+        # 记住本次对话到最后一个安全切分点为止的token数，供下次追加消息时复用
+        boundary = last_boundary(rendered, self._chat_boundary_pattern(model_key, tokenizer), start)
+        if prefix_hashes and boundary > start and encoding.offsets is not None:
+            cut = boundary - start
+            tail = len(encoding.offsets)
+            while tail > 0 and encoding.offsets[tail - 1][0] >= cut:
+                tail -= 1
+            self.chat_prefix_cache.put(
+                ('chat', prefix_hashes[-1]),
+                (boundary, cached_tokens + tail, text_digest(rendered[:boundary])),
+                CHAT_PREFIX_ENTRY_BYTES
+            )
+        return {
+            'token_count': total,
+            'cached_tokens': cached_tokens,
+            'encoded_chars': len(suffix),
+            'rendered_chars': len(rendered)
+        }
+    
+    def count_chat_all(self, messages: List[Dict], models: Optional[List[str]] = None,
+                       add_generation_prompt: bool = True, template_kwargs: Optional[Dict] = None
+                       ) -> Dict[str, Dict]:
+        """
+        使用多个模型计算消息列表的token数量（共享tokenizer的模型只计算一次，不同tokenizer并行）
+        
+        Returns:
+            字典，键为模型名，值为count_chat的结果，出错时为 {'error': 错误信息}
+        """
+        model_keys = models if models is not None else self.usable_models()
+        model_keys = [m for m in model_keys if m in self.models]
+        
+        def count_one(model_key: str) -> Dict:
+            try:
+                result = self.count_chat(messages, model_key, add_generation_prompt, template_kwargs)
+                return result if result is not None else {'error': '模型不可用'}
+            except ChatTemplateError as e:
+                return {'error': str(e)}
+            except Exception as e:
+                print(f"警告: 计算 {model_key} 的对话tokens时出错: {e}")
+                return {'error': str(e)}
+        
+        groups = self._group_by_tokenizer(model_keys)
+        executor = self._get_executor() if len(groups) > 1 else None
+        if executor is None:
+            counted = {fingerprint: count_one(keys[0]) for fingerprint, keys in groups.items()}
+        else:
+            futures = {fingerprint: executor.submit(count_one, keys[0]) for fingerprint, keys in groups.items()}
+            counted = {fingerprint: future.result() for fingerprint, future in futures.items()}
+        results = {}
+        for fingerprint, keys in groups.items():
+            for model_key in keys:
+                results[model_key] = counted[fingerprint]
+        return {model_key: results[model_key] for model_key in model_keys}
+    
+    def _iter_token_spans(self, text: str, model_key: str,
+                          segment_chars: int = STREAM_CHUNK_CHARS) -> Iterator[Tuple[int, int]]:
+        """
+        逐个产出文本中每个token的字符区间
+        
+        不超过segment_chars的文本只编码一次；更长的文本在安全切分点处分段编码，
+        同一时刻只保留一段的偏移，内存占用与文本长度无关。
+        """
+        pos = 0
+        while pos < len(text):
+            end = min(len(text), pos + segment_chars)
+            while end < len(text):
+                split = find_safe_split(text[pos:end])
+                if split > 0:
+                    end = pos + split
+                    break
+                # 窗口内没有安全切分点，扩大这一段
+                end = min(len(text), end + segment_chars)
+            encoding = self.encode(text[pos:end], model_key, return_offsets=True, use_cache=False)
+            if encoding is None:
+                raise ValueError(f'{model_key} 不可用')
+            if encoding.offsets is None:
+                raise ValueError(f'{model_key} 的tokenizer不支持字符偏移，无法分块')
+            for start, stop in encoding.offsets:
+                yield pos + start, pos + stop
+            pos = end
+    
+    @staticmethod
+    def _is_snap_point(text: str, pos: int, snap: str) -> bool:
+        """pos（下一块的开头）之前是否为换行（snap=sentence时还包括句末标点）"""
+        k = pos
+        while k > 0 and text[k - 1] in ' \t\r':
+            k -= 1
+        if k == 0:
+            return False
+        char = text[k - 1]
+        if char == '\n':
+            return True
+        if snap != 'sentence':
+            return False
+        if char in CJK_SENTENCE_ENDS:
+            return True
+        return char in ASCII_SENTENCE_ENDS and (k < pos or (pos < len(text) and text[pos].isspace()))
+    
+    def iter_chunks(self, text: str, model_key: str, max_tokens: int, overlap: int = 0,
+                    snap: str = 'none', strict: bool = False) -> Iterator[Dict[str, int]]:
+        """
+        把文本切分为每块不超过max_tokens个token的片段，逐块产出
+        
+        基于一次带字符偏移的编码（超长文本分段编码），在token边界处切分：
+        块的字符区间首尾相接覆盖整个文本（overlap为0时），token_count为该块在整体编码中的token数。
+        snap为newline/sentence时，在块的后半部分中寻找最后一个换行/句末作为切分点。
+        在token边界处切开的文本单独编码时，token数可能与整体编码中略有不同；
+        strict为True时对每块重新编码，超出max_tokens时缩短该块（每块额外编码一次）。
+        
+        Args:
+            text: 输入文本
+            model_key: 模型键名
+            max_tokens: 每块的最大token数
+            overlap: 相邻块重叠的token数（小于max_tokens）
+            snap: 切分方式（none/newline/sentence）
+            strict: 是否保证每块单独编码时也不超过max_tokens
+            
+        Yields:
+            {'index': 块序号, 'start': 起始字符, 'end': 结束字符（不含）,
+             'token_start': 第一个token在整体编码中的序号, 'token_count': token数}
+        """
+        if max_tokens <= 0:
+            raise ValueError('max_tokens必须大于0')
+        if overlap < 0 or overlap >= max_tokens:
+            raise ValueError('overlap必须大于等于0且小于max_tokens')
+        if snap not in CHUNK_SNAP_MODES:
+            raise ValueError(f'snap必须是 {", ".join(CHUNK_SNAP_MODES)} 之一')
+        
+        spans = self._iter_token_spans(text, model_key)
+        # 缓冲区保存从第base个token开始的字符区间
+        starts: List[int] = []
+        ends: List[int] = []
+        base = 0
+        exhausted = False
+        i = 0
+        index = 0
+        min_tokens = max(1, int(max_tokens * CHUNK_SNAP_MIN_FRACTION))
+        
+        def valid(cut: int) -> bool:
+            # 多个token共享同一个字符（byte-level BPE拆开的多字节字符）时不能在它们之间切分
+            return starts[cut - base] >= ends[cut - 1 - base]
+        
+        while True:
+            # 需要第i+max_tokens个token的起始位置来确定块的结束位置
+            while not exhausted and base + len(starts) <= i + max_tokens:
+                span = next(spans, None)
+                if span is None:
+                    exhausted = True
+                else:
+                    starts.append(span[0])
+                    ends.append(span[1])
+            available = base + len(starts)
+            if i >= available:
+                return
+            
+            j = min(i + max_tokens, available)
+            if j < available:
+                cut = None
+                if snap != 'none':
+                    cut = next((c for c in range(j, i + min_tokens - 1, -1)
+                                if valid(c) and self._is_snap_point(text, starts[c - base], snap)), None)
+                if cut is None:
+                    cut = next((c for c in range(j, i, -1) if valid(c)), j)
+                j = cut
+            
+            start = 0 if i == 0 else starts[i - base]
+            end = len(text) if j == available else starts[j - base]
+            if strict:
+                while j > i + 1:
+                    encoding = self.encode(text[start:end], model_key, use_cache=False)
+                    if encoding is None or encoding.count <= max_tokens:
+                        break
+                    j -= 1
+                    end = starts[j - base]
+            
+            yield {'index': index, 'start': start, 'end': end, 'token_start': i, 'token_count': j - i}
+            index += 1
+            if j == available:
+                return
+            # 重叠部分的开头同样不能落在多个token共享的字符中间
+            previous = i
+            i = max(i + 1, j - overlap)
+            while i > previous + 1 and not valid(i):
+                i -= 1
+            while i < j and not valid(i):
+                i += 1
+            # 丢弃已不再需要的token区间
+            if i - base > 4096:
+                del starts[:i - base]
+                del ends[:i - base]
+                base = i
+    
+    def chunk(self, text: str, model_key: str, max_tokens: int, overlap: int = 0,
+              snap: str = 'none', strict: bool = False) -> List[Dict[str, int]]:
+        """
+        把文本切分为每块不超过max_tokens个token的片段（参数与返回的字段见iter_chunks）
+        
+        Returns:
+            块列表
+        """
+        return list(self.iter_chunks(text, model_key, max_tokens, overlap=overlap, snap=snap, strict=strict))
     
     def calculate_tokens(self, text: str) -> Dict[str, int]:
         """
@@ -161,16 +1129,102 @@ class TokenCalculator:
         Returns:
             字典，键为模型名，值为token数量
         """
-        results = {}
-        for model_key, tokenizer in self.tokenizers.items():
+        return {
+            model_key: encoding.count if encoding is not None else -1
+            for model_key, encoding in self.encode_all(text).items()
+        }
+    
+    def iter_calculate_tokens_batch(self, texts: Iterable[str], models: Optional[List[str]] = None,
+                                    batch_size: int = BATCH_SLICE_TEXTS) -> Iterator[Dict[str, int]]:
+        """
+        批量计算多段文本的token数量，按输入顺序逐个产出结果
+        
+        文本每batch_size段一组，每个tokenizer对每组只调用一次encode_batch；
+        不同tokenizer在共享线程池中并行。只保留数量，不缓存编码结果，
+        因此内存占用与一组的大小有关，而与文本总数无关。
+        
+        Args:
+            texts: 文本迭代器
+            models: 要使用的模型列表，如果为None则使用所有可用的模型
+            batch_size: 每组的文本数
+            
+        Yields:
+            每段文本的字典，键为模型名，值为token数量（出错时为-1）
+        """
+        model_keys = models if models is not None else self.usable_models()
+        model_keys = [m for m in model_keys if m in self.models]
+        
+        def count_batch(model_key: str, batch: List[str]) -> Optional[List[int]]:
             try:
-                tokens = tokenizer.encode(text, add_special_tokens=False)
-                results[model_key] = len(tokens)
+                results = self.encode_batch(batch, model_key, use_cache=False)
             except Exception as e:
-                print(f"警告: 计算 {model_key} 的tokens时出错: {e}")
-                results[model_key] = -1
+                print(f"警告: 批量计算 {model_key} 的tokens时出错: {e}")
+                return None
+            return [result.count for result in results] if results is not None else None
         
-        return results
+        texts = iter(texts)
+        while True:
+            batch = list(islice(texts, batch_size))
+            if not batch:
+                return
+            # 加载后指纹才确定，每组重新分组
+            groups = self._group_by_tokenizer(model_keys)
+            representatives = [keys[0] for keys in groups.values()]
+            executor = self._get_executor() if len(representatives) > 1 else None
+            if executor is None:
+                counted = [count_batch(model_key, batch) for model_key in representatives]
+            else:
+                futures = [executor.submit(count_batch, model_key, batch) for model_key in representatives]
+                counted = [future.result() for future in futures]
+            
+            by_model: Dict[str, Optional[List[int]]] = {}
+            for keys, counts in zip(groups.values(), counted):
+                for model_key in keys:
+                    by_model[model_key] = counts
+            for i in range(len(batch)):
+                yield {
+                    model_key: by_model[model_key][i] if by_model[model_key] is not None else -1
+                    for model_key in model_keys
+                }
+    
+    def calculate_tokens_batch(self, texts: List[str], models: Optional[List[str]] = None) -> List[Dict[str, int]]:
+        """
+        批量计算多段文本的token数量（使用tokenizer的批量编码）
+        
+        Args:
+            texts: 文本列表
+            models: 要使用的模型列表，如果为None则使用所有可用的模型
+            
+        Returns:
+            与texts一一对应的字典列表，键为模型名，值为token数量（出错时为-1）
+        """
+        return list(self.iter_calculate_tokens_batch(texts, models))
+    
+    def calculate_tokens_stream(self, chunks: Iterable[str],
+                                models: Optional[List[str]] = None) -> Tuple[Dict[str, int], int]:
+        """
+        流式计算token数量，内存占用与输入总大小无关
+        
+        chunks应在安全切分点处切分（见iter_text_chunks），每块编码后只累加数量，
+        不保留token IDs。
+        
+        Args:
+            chunks: 文本块迭代器
+            models: 要使用的模型列表，如果为None则使用所有可用的模型
+            
+        Returns:
+            (字典：键为模型名、值为token数量, 总字符数)
+        """
+        totals: Dict[str, int] = {}
+        char_count = 0
+        for chunk in chunks:
+            char_count += len(chunk)
+            for model_key, encoding in self.encode_all(chunk, models, use_cache=False).items():
+                if encoding is None or totals.get(model_key, 0) < 0:
+                    totals[model_key] = -1
+                else:
+                    totals[model_key] = totals.get(model_key, 0) + encoding.count
+        return totals, char_count
     
     def get_token_ids(self, text: str, model_key: str) -> List[int]:
         """
@@ -183,10 +1237,9 @@ class TokenCalculator:
         Returns:
             token ID列表
         """
-        if model_key not in self.tokenizers:
-            return []
         try:
-            return self.tokenizers[model_key].encode(text, add_special_tokens=False)
+            encoding = self.encode(text, model_key)
+            return encoding.ids.tolist() if encoding is not None else []
         except Exception as e:
             print(f"警告: 获取 {model_key} 的token IDs时出错: {e}")
             return []
@@ -202,32 +1255,46 @@ class TokenCalculator:
         Returns:
             token字符串列表
         """
-        if model_key not in self.tokenizers:
+        tokenizer = self.get_tokenizer(model_key)
+        if tokenizer is None:
             return []
         try:
-            tokenizer = self.tokenizers[model_key]
+            table = self.display_tables.get(model_key)
+            if table is not None:
+                try:
+                    return table.lookup(token_ids)
+                except IndexError:
+                    # 含有超出显示表范围的ID，逐个处理
+                    pass
             tokens = []
             for token_id in token_ids:
-                token_str = tokenizer.decode([token_id], skip_special_tokens=False)
+                if table is not None and 0 <= token_id < len(table):
+                    token_str = table[token_id]
+                else:
+                    token_str = tokenizer.decode_one(token_id)
                 tokens.append(token_str)
             return tokens
         except Exception as e:
             print(f"警告: 解码 {model_key} 的tokens时出错: {e}")
             return []
     
-    def print_results(self, text: str, results: Dict[str, int]):
+    @staticmethod
+    def print_results(text: str, results: Dict[str, int], text_length: Optional[int] = None):
         """
-        打印结果
+        打印结果（静态方法，守护进程模式下没有计算器实例）
         
         Args:
-            text: 原始文本
+            text: 原始文本（流式计数时为文本开头，仅用于预览）
             results: token计算结果
+            text_length: 文本总字符数，默认为len(text)
         """
+        if text_length is None:
+            text_length = len(text)
         print("=" * 80)
         print("Token计算结果")
         print("=" * 80)
-        print(f"\n输入文本长度: {len(text)} 字符")
-        print(f"输入文本预览: {text[:100]}{'...' if len(text) > 100 else ''}\n")
+        print(f"\n输入文本长度: {text_length} 字符")
+        print(f"输入文本预览: {text[:100]}{'...' if text_length > 100 else ''}\n")
         print("-" * 80)
         print(f"{'模型':<30} {'Token数量':<15} {'字符/Token':<15}")
         print("-" * 80)
@@ -235,7 +1302,7 @@ class TokenCalculator:
         for model_key in sorted(results.keys()):
             token_count = results[model_key]
             if token_count >= 0:
-                ratio = len(text) / token_count if token_count > 0 else 0
+                ratio = text_length / token_count if token_count > 0 else 0
                 print(f"{model_key:<30} {token_count:<15} {ratio:.2f}")
             else:
                 print(f"{model_key:<30} {'错误':<15}")
@@ -245,6 +1312,150 @@ class TokenCalculator:
         print("=" * 80)
 
 
+def find_safe_split(text: str, window: int = SAFE_SPLIT_WINDOW) -> int:
+    """
+    在文本末尾window个字符内寻找最后一个安全切分点
+    
+    安全切分点两侧的文本分别编码后token数之和与整体编码相同：
+    1. 换行符之后、紧跟非空白字符的位置（所有支持模型的预分词都在此处断开）；
+    2. 其次是两侧均为非空白字符的单个空格之前（空格归属后面的词）。
+    
+    Args:
+        text: 文本
+        window: 从末尾向前搜索的最大字符数
+        
+    Returns:
+        切分位置（前一块为text[:pos]），找不到时返回-1
+    """
+    low = max(0, len(text) - window)
+    pos = text.rfind('\n', low, len(text) - 1)
+    while pos >= low:
+        if not text[pos + 1].isspace():
+            return pos + 1
+        pos = text.rfind('\n', low, pos)
+    pos = text.rfind(' ', low + 1, len(text) - 1)
+    while pos > low:
+        if not text[pos - 1].isspace() and not text[pos + 1].isspace():
+            return pos
+        pos = text.rfind(' ', low + 1, pos)
+    return -1
+
+
+def iter_text_chunks(stream: TextIO, chunk_size: int = STREAM_CHUNK_CHARS) -> Iterator[str]:
+    """
+    分块读取文本流，并在安全切分点处切分
+    
+    每读入一块，只在缓冲区末尾SAFE_SPLIT_WINDOW个字符内寻找安全切分点（见find_safe_split），
+    切分点之后的部分并入下一块；找不到时整个缓冲区并入下一块。缓冲区达到MAX_CARRY_CHARS
+    个字符时改为搜索整个缓冲区，仍找不到（即连续MAX_CARRY_CHARS个字符内没有可用的换行或
+    空格，例如不换行的长段中文）才在缓冲区末尾硬切分。
+    
+    不发生硬切分时，对于Qwen/DeepSeek等byte-level BPE tokenizer，按块计数的总数与整体
+    编码完全一致。硬切分会把切分处所在的预分词片段拆成两段分别编码，误差只限于这个片段，
+    每次硬切分通常相差0~2个token；相邻两次硬切分至少间隔MAX_CARRY_CHARS个字符。
+    
+    Args:
+        stream: 文本流（文件或标准输入）
+        chunk_size: 每次读取的字符数
+        
+    Yields:
+        文本块
+    """
+    carry = ''
+    while True:
+        block = stream.read(chunk_size)
+        if not block:
+            break
+        buffer = carry + block
+        split = find_safe_split(buffer, SAFE_SPLIT_WINDOW)
+        if split <= 0 and len(buffer) >= MAX_CARRY_CHARS:
+            # 末尾窗口之前的部分只在这里搜索一次，避免漏掉缓冲区中间的切分点
+            split = find_safe_split(buffer, len(buffer))
+        if split > 0:
+            yield buffer[:split]
+            carry = buffer[split:]
+        elif len(buffer) >= MAX_CARRY_CHARS:
+            # 找不到安全切分点，硬切分
+            yield buffer
+            carry = ''
+        else:
+            carry = buffer
+    if carry:
+        yield carry
+
+
+def detect_encoding(head: bytes) -> str:
+    """
+    根据开头的字节检测文本编码：BOM，其次UTF-8，其次GBK
+    
+    Args:
+        head: 内容开头的字节（可能在多字节字符中间截断）
+        
+    Returns:
+        编码名称
+        
+    Raises:
+        UnicodeDecodeError: 既不是UTF-8也不是GBK
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        # 增量解码不把末尾被截断的字符当作错误
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        codecs.getincrementaldecoder('gbk')().decode(head)
+        return 'gbk'
+
+
+class DecodingReader:
+    """
+    从字节流增量解码文本，提供read(size)接口（可直接交给iter_text_chunks）
+    
+    编码按开头SNIFF_BYTES字节检测，之后边读边解码，不需要先读完或落盘；
+    检测为UTF-8但后面出现非法字节时抛出UnicodeDecodeError（流无法回退重读）。
+    """
+    
+    def __init__(self, raw: BinaryIO, sniff_bytes: int = SNIFF_BYTES):
+        """
+        Args:
+            raw: 字节流（上传的请求体、文件等）
+            sniff_bytes: 检测编码时查看的开头字节数
+        """
+        self._raw = raw
+        head = b''
+        while len(head) < sniff_bytes:
+            data = raw.read(sniff_bytes - len(head))
+            if not data:
+                break
+            head += data
+        self.bytes_read = len(head)
+        self._eof = len(head) < sniff_bytes
+        self.encoding = detect_encoding(head)
+        self._decoder = codecs.getincrementaldecoder(self.encoding)()
+        self._pending = self._decoder.decode(head, final=self._eof)
+    
+    def read(self, size: int = -1) -> str:
+        """
+        读取最多size个字符（size<0时读取全部），读完时返回空字符串
+        """
+        while not self._eof and (size < 0 or len(self._pending) < size):
+            data = self._raw.read(DECODE_READ_BYTES)
+            if not data:
+                self._eof = True
+                self._pending += self._decoder.decode(b'', final=True)
+            else:
+                self.bytes_read += len(data)
+                self._pending += self._decoder.decode(data)
+        if size < 0 or size >= len(self._pending):
+            text, self._pending = self._pending, ''
+        else:
+            text, self._pending = self._pending[:size], self._pending[size:]
+        return text
+
+
 def read_text_from_file(file_path: str) -> str:
     """
     从文件读取文本
@@ -268,6 +1479,54 @@ def read_text_from_file(file_path: str) -> str:
         sys.exit(1)
 
 
+def iter_file_chunks(file_path: str, chunk_size: int = STREAM_CHUNK_CHARS) -> Iterator[str]:
+    """
+    流式读取文件，按安全切分点分块
+    
+    Args:
+        file_path: 文件路径
+        chunk_size: 每次读取的字符数
+        
+    Yields:
+        文本块
+    """
+    path = Path(file_path)
+    if not path.exists():
+        print(f"错误: 文件不存在: {file_path}")
+        sys.exit(1)
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from iter_text_chunks(f, chunk_size)
+    except Exception as e:
+        print(f"错误: 无法读取文件 {file_path}: {e}")
+        sys.exit(1)
+
+
+def run_stream(calculator, chunks: Iterator[str]):
+    """
+    流式计数并打印结果
+    
+    Args:
+        calculator: Token计算器（或守护进程客户端）
+        chunks: 文本块迭代器
+    """
+    preview = ''
+    
+    def remember_preview(chunks: Iterator[str]) -> Iterator[str]:
+        nonlocal preview
+        for chunk in chunks:
+            if len(preview) < 100:
+                preview += chunk[:100 - len(preview)]
+            yield chunk
+    
+    results, char_count = calculator.calculate_tokens_stream(remember_preview(chunks))
+    if char_count == 0:
+        print("错误: 输入文本为空")
+        sys.exit(1)
+    TokenCalculator.print_results(preview, results, text_length=char_count)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="计算文本在不同大模型tokenizer下的token数量",
@@ -285,6 +1544,17 @@ def main():
   
   # 从标准输入读取
   echo "Hello" | python calculate_tokens.py
+  
+  # 流式计数超大文件（内存占用恒定）
+  python calculate_tokens.py -f corpus.txt --stream
+  
+  # 语料模式：多进程统计目录下的所有文件，输出JSONL
+  python calculate_tokens.py --dir corpus/ --glob "*.md" -o counts.jsonl
+  
+  # 守护进程模式：常驻进程保持tokenizer已加载，之后的调用自动连接，只需一次套接字往返
+  python calculate_tokens.py --daemon &
+  python calculate_tokens.py -t "Hello"
+  python calculate_tokens.py --daemon-stop
         """
     )
     
@@ -300,6 +1570,31 @@ def main():
         help='直接输入文本'
     )
     
+    parser.add_argument(
+        '--dir',
+        type=str,
+        help='语料模式：递归统计目录下的文件（可配合--glob过滤）'
+    )
+    
+    parser.add_argument(
+        '--glob',
+        type=str,
+        help='语料模式：文件通配符，如 "data/**/*.txt"（配合--dir时相对该目录）'
+    )
+    
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        help='语料模式：JSONL输出文件（默认输出到标准输出）'
+    )
+    
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help='语料模式：进程数（默认CPU核数）'
+    )
+    
     parser.add_argument(
         '--models',
         nargs='+',
@@ -307,6 +1602,58 @@ def main():
         help='指定要使用的模型（可选，默认使用所有模型）'
     )
     
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='多模型并行编码的线程数（默认取模型数与CPU核数的较小值，1表示串行）'
+    )
+    
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='流式计数（适用于-f和标准输入的超大文本，内存占用恒定）'
+    )
+    
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=STREAM_CHUNK_CHARS,
+        help=f'流式计数时每次读取的字符数（默认{STREAM_CHUNK_CHARS}）'
+    )
+    
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default=BACKEND_AUTO,
+        help='tokenizer后端（默认auto：优先使用轻量的tokenizers库，无需导入transformers/torch）'
+    )
+    
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='以守护进程模式运行：加载tokenizer后在本地Unix域套接字上等待计数请求'
+    )
+    
+    parser.add_argument(
+        '--daemon-stop',
+        action='store_true',
+        help='让正在运行的守护进程退出'
+    )
+    
+    parser.add_argument(
+        '--no-daemon',
+        action='store_true',
+        help='不连接守护进程，总是在进程内加载tokenizer'
+    )
+    
+    parser.add_argument(
+        '--socket',
+        type=str,
+        default=None,
+        help='守护进程的套接字路径（默认取环境变量TOKEN_DAEMON_SOCKET，或临时目录下按用户区分的路径）'
+    )
+    
     parser.add_argument(
         '--list-models',
         action='store_true',
@@ -323,6 +1670,66 @@ def main():
             print(f"  {key:<30} {value}")
         return
     
+    # 语料模式：多进程统计大量文件
+    if args.dir or args.glob:
+        from corpus import collect_files, print_summary, run_corpus
+        files = collect_files(args.dir, args.glob)
+        if not files:
+            print("错误: 没有匹配的文件", file=sys.stderr)
+            sys.exit(1)
+        print(f"共 {len(files)} 个文件", file=sys.stderr)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as output:
+                summary = run_corpus(files, output, models=args.models, processes=args.processes,
+                                     backend=args.backend)
+        else:
+            summary = run_corpus(files, sys.stdout, models=args.models, processes=args.processes,
+                                 backend=args.backend)
+        print_summary(summary)
+        return
+    
+    # 守护进程模式：加载tokenizer后常驻，在Unix域套接字上处理计数请求
+    if args.daemon:
+        from token_daemon import serve
+        calculator = TokenCalculator(models=args.models, local_mode=False, workers=args.workers,
+                                     backend=args.backend)
+        serve(calculator, args.socket)
+        return
+    
+    from token_daemon import DaemonClient, DaemonError, DaemonUnavailable
+    client = DaemonClient(args.socket, models=args.models, backend=args.backend)
+    if args.daemon_stop:
+        try:
+            client.shutdown()
+            print("守护进程已停止")
+        except (DaemonUnavailable, DaemonError) as e:
+            print(f"错误: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+    # 守护进程在运行时把请求发给它，否则在进程内加载tokenizer
+    use_daemon = not args.no_daemon and client.available()
+    
+    # 流式计数：先加载tokenizer，再边读边算
+    if args.stream and (args.file or (not args.text and not sys.stdin.isatty())):
+        if args.file:
+            chunks = iter_file_chunks(args.file, args.chunk_size)
+        else:
+            chunks = iter_text_chunks(sys.stdin, args.chunk_size)
+        if use_daemon:
+            try:
+                run_stream(client, chunks)
+                return
+            except DaemonUnavailable:
+                # 连接失败或守护进程不支持本次请求时文本块尚未读取
+                pass
+            except DaemonError as e:
+                print(f"错误: 守护进程计数失败: {e}", file=sys.stderr)
+                sys.exit(1)
+        calculator = TokenCalculator(models=args.models, local_mode=False, workers=args.workers,
+                                     backend=args.backend)
+        run_stream(calculator, chunks)
+        return
+    
     # 获取输入文本
     text = None
     if args.file:
@@ -341,8 +1748,16 @@ def main():
         print("错误: 输入文本为空")
         sys.exit(1)
     
+    if use_daemon:
+        try:
+            TokenCalculator.print_results(text, client.calculate_tokens(text))
+            return
+        except (DaemonUnavailable, DaemonError) as e:
+            print(f"提示: 守护进程不可用（{e}），改为在进程内计算", file=sys.stderr)
+    
     # 创建计算器并计算
-    calculator = TokenCalculator(models=args.models, local_mode=False)
+    calculator = TokenCalculator(models=args.models, local_mode=False, workers=args.workers,
+                                 backend=args.backend)
     results = calculator.calculate_tokens(text)
     calculator.print_results(text, results)
 
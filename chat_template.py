@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Chat template渲染 - 按模型的chat_template把消息列表渲染为文本
+
+与transformers的apply_chat_template使用相同的Jinja环境（沙箱、trim_blocks/lstrip_blocks、
+tojson过滤器、raise_exception/strftime_now函数），两种tokenizer后端渲染结果一致。
+jinja2在第一次渲染时才导入（Flask已依赖jinja2）。
+"""
+
+import json
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class ChatTemplateError(Exception):
+    """模型没有chat template，或渲染失败"""
+
+
+def token_content(value: Any) -> Optional[str]:
+    """tokenizer_config.json中特殊token的文本（可能是字符串或AddedToken的字典形式）"""
+    if isinstance(value, dict):
+        return value.get('content')
+    return value
+
+
+def select_template(value: Any) -> Optional[str]:
+    """
+    从chat_template配置中选出默认模板
+
+    Args:
+        value: 字符串，或命名模板列表 [{"name": ..., "template": ...}] / 字典 {名称: 模板}
+    """
+    if isinstance(value, list):
+        value = {item.get('name'): item.get('template') for item in value if isinstance(item, dict)}
+    if isinstance(value, dict):
+        return value.get('default') or next(iter(value.values()), None)
+    return value or None
+
+
+@lru_cache(maxsize=64)
+def _compile(source: str):
+    """编译模板（同一模板只编译一次）"""
+    try:
+        from jinja2.exceptions import TemplateError
+        from jinja2.ext import loopcontrols
+        from jinja2.sandbox import ImmutableSandboxedEnvironment
+    except ImportError:
+        raise ChatTemplateError('渲染chat template需要安装jinja2: pip install jinja2')
+
+    def raise_exception(message):
+        raise TemplateError(message)
+
+    def tojson(value, ensure_ascii=False, indent=None, separators=None, sort_keys=False):
+        return json.dumps(value, ensure_ascii=ensure_ascii, indent=indent, separators=separators, sort_keys=sort_keys)
+
+    def strftime_now(fmt):
+        return datetime.now().strftime(fmt)
+
+    env = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True, extensions=[loopcontrols])
+    env.filters['tojson'] = tojson
+    env.globals['raise_exception'] = raise_exception
+    env.globals['strftime_now'] = strftime_now
+    return env.from_string(source)
+
+
+def render_chat(template: str, messages: List[Dict[str, Any]], add_generation_prompt: bool = True,
+                special_tokens: Optional[Dict[str, Optional[str]]] = None, **kwargs) -> str:
+    """
+    渲染消息列表
+
+    Args:
+        template: chat template源码
+        messages: 消息列表，如 [{"role": "user", "content": "你好"}]
+        add_generation_prompt: 是否在末尾添加assistant回复的开头
+        special_tokens: bos_token/eos_token等模板中使用的特殊token文本
+        kwargs: 传给模板的其他变量（如tools、enable_thinking）
+
+    Returns:
+        渲染后的文本
+    """
+    variables = dict(special_tokens or {})
+    variables.update(kwargs)
+    try:
+        return _compile(template).render(messages=messages, add_generation_prompt=add_generation_prompt, **variables)
+    except ChatTemplateError:
+        raise
+    except Exception as e:
+        raise ChatTemplateError(f'渲染chat template失败: {e}')
+
+
+def boundary_pattern(tokens: Iterable[str]) -> Optional['re.Pattern']:
+    """
+    匹配特殊token的正则表达式（长的优先）
+
+    tokenizer在编码前先按特殊token切开文本，各段分别编码，
+    因此紧跟在特殊token之后的位置是安全切分点：两侧分别编码的token数之和与整体编码相同。
+    """
+    tokens = sorted({token for token in tokens if token}, key=len, reverse=True)
+    if not tokens:
+        return None
+    return re.compile('|'.join(re.escape(token) for token in tokens))
+
+
+def last_boundary(text: str, pattern: Optional['re.Pattern'], start: int = 0, window: int = 4096) -> int:
+    """
+    查找text[start:]中最后一个安全切分点（某个特殊token的结束位置）
+
+    从末尾window个字符开始查找，找不到时窗口加倍，长对话也不必扫描全文。
+
+    Returns:
+        切分位置，找不到时返回-1
+    """
+    if pattern is None:
+        return -1
+    low = len(text)
+    while low > start:
+        low = max(start, low - window)
+        end = -1
+        for match in pattern.finditer(text, low):
+            end = match.end()
+        if end > 0:
+            return end
+        window *= 2
+    return -1
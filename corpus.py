@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+语料模式 - 多进程统计目录/通配符匹配的大量文件的token数量，输出JSONL
+"""
+
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Dict, List, Optional, TextIO
+
+from calculate_tokens import TokenCalculator, iter_text_chunks
+from tokenizer_backends import BACKEND_AUTO
+
+
+# 每个工作进程内的计算器（进程启动时加载一次tokenizer）
+_worker_calculator: Optional[TokenCalculator] = None
+
+
+def collect_files(directory: Optional[str], pattern: Optional[str]) -> List[Path]:
+    """
+    收集要统计的文件
+
+    Args:
+        directory: 目录（递归查找），为None时pattern相对当前目录解析
+        pattern: 通配符，如 "**/*.md"；只给目录时匹配所有文件
+
+    Returns:
+        排序后的文件路径列表
+    """
+    if directory:
+        files = Path(directory).rglob(pattern or '*')
+    else:
+        files = (Path(p) for p in glob.glob(pattern, recursive=True))
+    return sorted(p for p in files if p.is_file())
+
+
+def _init_worker(models: Optional[List[str]], local_mode: bool, tokenizers_dir: Optional[str], backend: str):
+    """工作进程初始化：加载一次tokenizer（加载日志输出到stderr，避免混入JSONL）"""
+    global _worker_calculator
+    with redirect_stdout(sys.stderr):
+        _worker_calculator = TokenCalculator(
+            models=models,
+            local_mode=local_mode,
+            tokenizers_dir=tokenizers_dir,
+            workers=1,
+            backend=backend
+        )
+
+
+def _count_file(path: Path) -> Dict:
+    """在工作进程中流式统计单个文件"""
+    row = {'path': str(path), 'bytes': 0, 'chars': 0, 'tokens': {}}
+    try:
+        row['bytes'] = path.stat().st_size
+        for encoding in ('utf-8', 'gbk'):
+            try:
+                with open(path, 'r', encoding=encoding) as f:
+                    row['tokens'], row['chars'] = _worker_calculator.calculate_tokens_stream(iter_text_chunks(f))
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            row['error'] = '无法解码，请确保文件是UTF-8或GBK编码的文本文件'
+    except Exception as e:
+        row['error'] = str(e)
+    return row
+
+
+def run_corpus(files: List[Path], output: TextIO, models: Optional[List[str]] = None,
+               local_mode: bool = False, tokenizers_dir: Optional[str] = None,
+               processes: Optional[int] = None, backend: str = BACKEND_AUTO) -> Dict:
+    """
+    多进程统计文件列表，逐文件写出JSONL，最后写出汇总行
+
+    Args:
+        files: 文件列表
+        output: JSONL输出流
+        models: 要使用的模型列表，如果为None则使用所有模型
+        local_mode: 是否使用本地tokenizer
+        tokenizers_dir: 本地tokenizer目录
+        processes: 进程数，默认为CPU核数
+        backend: tokenizer后端
+
+    Returns:
+        汇总信息
+    """
+    processes = processes or os.cpu_count() or 1
+    totals: Dict[str, int] = {}
+    summary = {'files': 0, 'errors': 0, 'bytes': 0, 'chars': 0}
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(models, local_mode, tokenizers_dir, backend)) as executor:
+        # map保持输入顺序，chunksize减少进程间通信次数
+        for row in executor.map(_count_file, files, chunksize=16):
+            output.write(json.dumps(row, ensure_ascii=False) + '\n')
+            summary['files'] += 1
+            summary['bytes'] += row['bytes']
+            summary['chars'] += row['chars']
+            if 'error' in row:
+                summary['errors'] += 1
+                continue
+            for model_key, count in row['tokens'].items():
+                if count >= 0:
+                    totals[model_key] = totals.get(model_key, 0) + count
+    elapsed = time.perf_counter() - start
+
+    summary.update({
+        'tokens': dict(sorted(totals.items())),
+        'processes': processes,
+        'elapsed_seconds': round(elapsed, 3),
+        'files_per_second': round(summary['files'] / elapsed, 2) if elapsed > 0 else 0.0,
+        'mb_per_second': round(summary['bytes'] / 1024 / 1024 / elapsed, 2) if elapsed > 0 else 0.0
+    })
+    output.write(json.dumps({'summary': summary}, ensure_ascii=False) + '\n')
+    output.flush()
+    return summary
+
+
+def print_summary(summary: Dict):
+    """打印汇总信息（输出到stderr，stdout留给JSONL）"""
+    out = sys.stderr
+    print("=" * 80, file=out)
+    print("语料统计汇总", file=out)
+    print("=" * 80, file=out)
+    print(f"文件数: {summary['files']}（失败 {summary['errors']}）", file=out)
+    print(f"总大小: {summary['bytes'] / 1024 / 1024:.2f} MB, 总字符数: {summary['chars']}", file=out)
+    print(f"耗时: {summary['elapsed_seconds']:.2f} 秒（{summary['processes']} 个进程）", file=out)
+    print(f"吞吐量: {summary['files_per_second']:.2f} 文件/秒, {summary['mb_per_second']:.2f} MB/秒", file=out)
+    print("-" * 80, file=out)
+    for model_key, count in summary['tokens'].items():
+        print(f"{model_key:<30} {count}", file=out)
+    print("=" * 80, file=out)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+增量编码会话 - 实时编辑文档时只重新编码修改位置附近的文本
+
+会话在安全切分点（见find_safe_split）处把文档切成约SEGMENT_CHARS个字符的片段，
+保存每个模型对每个片段的编码结果。安全切分点两侧分别编码的token数之和与整体编码相同，
+因此文档的token数就是各片段token数之和。收到一次编辑（offset, delete, insert）时，
+只取出包含修改位置的片段重新切分、重新编码，再拼回片段列表；
+其余片段的编码结果原样复用，只平移起始位置。
+
+取出的范围在修改位置两侧各至少保留EDIT_MARGIN个未修改的字符：
+安全切分点只取决于其前后各一个字符，范围两端的切分点在编辑后仍然安全。
+片段内找不到安全切分点时片段会变长，而不是硬切分，所以结果与整体编码完全一致。
+"""
+
+import bisect
+import sys
+import threading
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from calculate_tokens import EncodeResult, find_safe_split
+from token_store import ENTRY_OVERHEAD_BYTES, TokenStore
+
+
+# 片段的目标字符数（编辑时重新编码的文本约为一到两个片段）
+SEGMENT_CHARS = 4096
+# 重新编码的范围在修改位置两侧至少保留的未修改字符数
+EDIT_MARGIN = 2
+# 每个片段除token ID外的固定开销估计（EncodeResult、array对象、列表项）
+SEGMENT_OVERHEAD_BYTES = 160
+
+
+class EditError(ValueError):
+    """编辑的位置或长度超出文本范围"""
+
+
+class VersionConflict(EditError):
+    """客户端的版本号与会话不一致（客户端应重新创建会话）"""
+
+
+def split_segments(text: str, start: int, end: int, segment_chars: int = SEGMENT_CHARS) -> List[int]:
+    """
+    在安全切分点处把text[start:end]切成片段
+
+    Returns:
+        片段边界 [start, ..., end]（文本为空时为 [start]）
+    """
+    bounds = [start]
+    pos = start
+    while pos < end:
+        stop = min(end, pos + segment_chars)
+        while stop < end:
+            split = find_safe_split(text[pos:stop], segment_chars)
+            if split > 0:
+                stop = pos + split
+                break
+            # 找不到安全切分点时向后延长片段
+            stop = min(end, stop + segment_chars)
+        bounds.append(stop)
+        pos = stop
+    return bounds
+
+
+class EditSession:
+    """一份正在编辑的文档及其按片段保存的编码结果（edit在会话锁内依次执行）"""
+
+    def __init__(self, calculator, text: str, models: List[str]):
+        """
+        Args:
+            calculator: TokenCalculator实例
+            text: 文档的初始文本
+            models: 要计算的模型列表（编码失败的模型记入errors，不再计算）
+        """
+        self.calculator = calculator
+        self.text = text
+        self.version = 0
+        self.lock = threading.Lock()
+        self.errors: Dict[str, str] = {}
+        # 每个片段的起始位置，片段k为text[starts[k]:starts[k+1]]（最后一个到文本末尾）
+        bounds = split_segments(text, 0, len(text))
+        self.starts: List[int] = bounds[:-1]
+        self.segments: Dict[str, List[EncodeResult]] = {}
+        self.counts: Dict[str, int] = {}
+        encoded = calculator.encode_batch_all([text[a:b] for a, b in zip(bounds, bounds[1:])],
+                                              models, use_cache=False)
+        for model_key in models:
+            results = encoded.get(model_key)
+            if results is None:
+                self.errors[model_key] = '模型不可用或编码失败'
+                continue
+            self.segments[model_key] = results
+            self.counts[model_key] = sum(result.count for result in results)
+        # 最近一次edit重新编码的字符数
+        self.encoded_chars = len(text)
+
+    @property
+    def models(self) -> List[str]:
+        """会话中正在计算的模型"""
+        return list(self.segments)
+
+    @property
+    def nbytes(self) -> int:
+        """会话占用内存的估计值（字节，多个模型共享的同一组结果只计算一次）"""
+        unique = {id(results): results for results in self.segments.values()}
+        size = sys.getsizeof(self.text) + 8 * len(self.starts)
+        for results in unique.values():
+            size += sum(result.nbytes for result in results) + SEGMENT_OVERHEAD_BYTES * len(results)
+        return size
+
+    def _edit_range(self, offset: int, delete: int) -> Tuple[int, int]:
+        """
+        需要重新编码的片段下标范围 [first, last]
+
+        范围覆盖 [offset - EDIT_MARGIN, offset + delete + EDIT_MARGIN) 内所有字符所在的片段。
+        """
+        if not self.starts:
+            return 0, -1
+        low = max(0, offset - EDIT_MARGIN)
+        high = min(len(self.text) - 1, offset + delete + EDIT_MARGIN - 1)
+        first = bisect.bisect_right(self.starts, low) - 1
+        last = bisect.bisect_right(self.starts, high) - 1
+        return first, last
+
+    def _apply(self, offset: int, delete: int, insert: str):
+        """执行一次编辑（调用方持有锁，参数已检查）"""
+        text = self.text[:offset] + insert + self.text[offset + delete:]
+        delta = len(insert) - delete
+        first, last = self._edit_range(offset, delete)
+        region_start = self.starts[first] if first < len(self.starts) else 0
+        region_end = (self.starts[last + 1] if last + 1 < len(self.starts) else len(self.text)) + delta
+
+        bounds = split_segments(text, region_start, region_end)
+        texts = [text[a:b] for a, b in zip(bounds, bounds[1:])]
+        # 先编码所有模型，全部成功后再修改会话，编码失败时会话保持编辑前的状态
+        encoded = self.calculator.encode_batch_all(texts, self.models, use_cache=False)
+        failed = [model_key for model_key, results in encoded.items() if results is None]
+        if failed:
+            raise RuntimeError(f'重新编码失败: {failed}')
+
+        # 共享同一tokenizer的模型共用一个片段列表，每个列表只替换一次
+        changes: Dict[int, int] = {}
+        for model_key, results in encoded.items():
+            segments = self.segments[model_key]
+            if id(segments) not in changes:
+                replaced = segments[first:last + 1]
+                changes[id(segments)] = sum(r.count for r in results) - sum(r.count for r in replaced)
+                segments[first:last + 1] = results
+            self.counts[model_key] += changes[id(segments)]
+        self.starts[first:] = bounds[:-1] + [start + delta for start in self.starts[last + 1:]]
+        self.text = text
+        self.encoded_chars += region_end - region_start
+
+    def edit(self, edits: List[Dict[str, Any]], version: Optional[int] = None) -> int:
+        """
+        依次执行一组编辑
+
+        Args:
+            edits: 编辑列表，每项为 {"offset": 位置, "delete": 删除的字符数, "insert": 插入的文本}，
+                位置和长度以Unicode码点计，每项的位置基于前一项执行后的文本
+            version: 客户端持有的版本号，与会话不一致时拒绝执行
+
+        Returns:
+            执行后的版本号
+
+        Raises:
+            VersionConflict: 版本号不一致（此时不执行任何编辑）
+            EditError: 编辑超出文本范围（此时不执行任何编辑）
+        """
+        with self.lock:
+            if version is not None and version != self.version:
+                raise VersionConflict(f'版本号不一致: 会话为 {self.version}，请求为 {version}')
+            # 先检查所有编辑，避免只执行了一部分
+            parsed = []
+            length = len(self.text)
+            for edit in edits:
+                try:
+                    offset = int(edit.get('offset', 0))
+                    delete = int(edit.get('delete', 0))
+                except (TypeError, ValueError, AttributeError):
+                    raise EditError(f'无效的编辑: {edit}')
+                insert = edit.get('insert') or ''
+                if not isinstance(insert, str):
+                    raise EditError('insert必须是字符串')
+                if offset < 0 or delete < 0 or offset + delete > length:
+                    raise EditError(f'编辑超出文本范围: offset={offset}, delete={delete}, 文本长度={length}')
+                parsed.append((offset, delete, insert))
+                length += len(insert) - delete
+
+            self.encoded_chars = 0
+            try:
+                for offset, delete, insert in parsed:
+                    if delete or insert:
+                        self._apply(offset, delete, insert)
+            finally:
+                # 中途编码失败时前面的编辑已经生效，同样更新版本号，让客户端重新同步
+                self.version += 1
+            return self.version
+
+    def state(self) -> Dict[str, Any]:
+        """当前版本号、文本长度、各模型token数和最近一次edit重新编码的字符数（一致的快照）"""
+        with self.lock:
+            return {
+                'version': self.version,
+                'text_length': len(self.text),
+                'counts': dict(self.counts),
+                'encoded_chars': self.encoded_chars
+            }
+
+    def encodings(self) -> Dict[str, EncodeResult]:
+        """拼接各片段，得到每个模型对整个文档的编码结果（共享同一tokenizer的模型共用一个结果）"""
+        with self.lock:
+            joined: Dict[int, EncodeResult] = {}
+            encodings = {}
+            for model_key, results in self.segments.items():
+                if id(results) not in joined:
+                    ids = array('I')
+                    for result in results:
+                        ids.extend(result.ids)
+                    joined[id(results)] = EncodeResult(ids)
+                encodings[model_key] = joined[id(results)]
+            return encodings
+
+
+class SessionStore(TokenStore):
+    """编辑会话的暂存区，按访问时间过期，超出字节预算时淘汰最久未使用的会话"""
+
+    @staticmethod
+    def _size_of(session: EditSession) -> int:
+        return session.nbytes + ENTRY_OVERHEAD_BYTES
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Token ID的紧凑序列化格式
+
+token ID在EncodeResult中以array('I')连续存储，序列化时直接使用这块内存，
+不为每个ID创建Python int对象：
+
+- json：ids为小端uint32数组的base64字符串（ids_encoding为uint32le-base64）；
+- binary（application/octet-stream）：4字节小端头部长度 + UTF-8 JSON头部 + 各模型的小端uint32数组，
+  头部中每个结果的ids_offset/ids_count给出其ID在数组区的位置（按ID个数计）；
+- msgpack（application/msgpack，需安装msgpack）：ids为bin类型的小端uint32数组。
+"""
+
+import base64
+import importlib.util
+import json
+import struct
+import sys
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+FORMAT_MSGPACK = 'msgpack'
+
+# 各格式对应的媒体类型
+MIMETYPES = {
+    FORMAT_JSON: 'application/json',
+    FORMAT_BINARY: 'application/octet-stream',
+    FORMAT_MSGPACK: 'application/msgpack',
+}
+# Accept头中可识别的媒体类型
+ACCEPT_FORMATS = {
+    'application/json': FORMAT_JSON,
+    'application/octet-stream': FORMAT_BINARY,
+    'application/msgpack': FORMAT_MSGPACK,
+    'application/x-msgpack': FORMAT_MSGPACK,
+}
+
+# JSON/msgpack响应中ids字段的编码说明
+IDS_ENCODING = 'uint32le'
+IDS_ENCODING_BASE64 = 'uint32le-base64'
+
+
+def msgpack_available() -> bool:
+    """是否安装了msgpack（不导入该库）"""
+    return importlib.util.find_spec('msgpack') is not None
+
+
+def negotiate(accept_mimetypes) -> str:
+    """
+    根据Accept头选择响应格式
+
+    Args:
+        accept_mimetypes: werkzeug的MIMEAccept对象（request.accept_mimetypes）
+
+    Returns:
+        格式名称；未安装msgpack时不会选择msgpack
+    """
+    offered = [mimetype for mimetype, fmt in ACCEPT_FORMATS.items()
+               if fmt != FORMAT_MSGPACK or msgpack_available()]
+    best = accept_mimetypes.best_match(offered, default='application/json')
+    return ACCEPT_FORMATS.get(best, FORMAT_JSON)
+
+
+def ids_buffer(ids: array) -> memoryview:
+    """
+    token ID的小端uint32字节视图
+
+    小端主机上直接返回array的内存视图（不复制），大端主机上返回字节序翻转后的副本。
+    """
+    if sys.byteorder != 'little':
+        ids = array(ids.typecode, ids)
+        ids.byteswap()
+    return memoryview(ids).cast('B')
+
+
+def ids_base64(ids: array) -> str:
+    """token ID的base64字符串（小端uint32）"""
+    return base64.b64encode(ids_buffer(ids)).decode('ascii')
+
+
+def decode_ids(data: bytes) -> array:
+    """
+    将小端uint32字节解码为array('I')（供客户端和基准测试使用）
+
+    Args:
+        data: 小端uint32字节（base64需先解码）
+    """
+    ids = array('I')
+    ids.frombytes(data)
+    if sys.byteorder != 'little':
+        ids.byteswap()
+    return ids
+
+
+def iter_binary(header: Dict, results: List[Dict], id_arrays: List[Optional[array]]) -> Iterator[bytes]:
+    """
+    生成binary格式的响应体
+
+    Args:
+        header: 响应的JSON部分（会在其中为每个结果写入ids_offset/ids_count）
+        results: header中的结果列表，与id_arrays一一对应
+        id_arrays: 每个结果的token ID（None表示没有ID）
+
+    Yields:
+        头部长度、JSON头部，以及各模型ID数组的字节（WSGI要求响应体为bytes，不能是内存视图）
+    """
+    position = 0
+    for result, ids in zip(results, id_arrays):
+        count = len(ids) if ids is not None else 0
+        result['ids_offset'] = position
+        result['ids_count'] = count
+        position += count
+    header['ids_encoding'] = IDS_ENCODING
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    yield struct.pack('<I', len(header_bytes))
+    yield header_bytes
+    for ids in id_arrays:
+        if ids:
+            yield ids_buffer(ids).tobytes()
+
+
+def parse_binary(data: bytes) -> Tuple[Dict, List[Optional[array]]]:
+    """
+    解析binary格式的响应体（供客户端和基准测试使用）
+
+    Returns:
+        (JSON头部, 每个结果的token ID数组)
+    """
+    (header_length,) = struct.unpack_from('<I', data, 0)
+    header = json.loads(data[4:4 + header_length].decode('utf-8'))
+    body = memoryview(data)[4 + header_length:]
+    id_arrays = []
+    for result in header.get('results', []):
+        start = result['ids_offset'] * 4
+        id_arrays.append(decode_ids(body[start:start + result['ids_count'] * 4]))
+    return header, id_arrays
+
+
+def pack_msgpack(payload: Dict) -> bytes:
+    """将响应序列化为msgpack（ids字段应已是字节视图）"""
+    import msgpack
+
+    return msgpack.packb(payload, use_bin_type=True, default=bytes)
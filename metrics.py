@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+运行指标 - Prometheus文本格式的计数器、直方图和仪表
+
+热路径上的计数不加锁：每个线程写入自己的分片（threading.local），
+只有导出（/metrics被抓取）时才汇总所有分片。已退出线程的分片在导出或新建分片时
+并入一个公共的基准值，分片数量不会随线程数无限增长。
+速率类指标（tokens/s、chars/s）由Prometheus对计数器取rate()得到。
+"""
+
+import bisect
+import os
+import re
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# 编码耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 请求大小直方图的桶（字节）
+SIZE_BUCKETS = tuple(float(1 << shift) for shift in range(8, 31, 2))  # 256B ~ 1GB
+# 批大小直方图的桶
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# 新建这么多分片后顺便合并一次已退出线程的分片
+COMPACT_EVERY = 64
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Tuple, extra: str = '') -> str:
+    """格式化标签，如 {model="qwen3-8b",le="0.1"}"""
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _ShardedMetric:
+    """按线程分片存储的指标基类"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # (所属线程, 分片)；分片为 标签值元组 -> 数值
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        self._retired: dict = {}
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _shard(self) -> dict:
+        """当前线程的分片（首次使用时创建）"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                self._created += 1
+                if self._created % COMPACT_EVERY == 0:
+                    self._compact()
+        return shard
+
+    def _compact(self):
+        """把已退出线程的分片并入基准值（调用方持有锁；已退出的线程不会再写入）"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for key, value in shard.items():
+                    self._merge(self._retired, key, value)
+        self._shards = alive
+
+    def _merge(self, target: dict, key: Tuple, value):
+        raise NotImplementedError
+
+    def _snapshot(self) -> dict:
+        """汇总所有分片"""
+        with self._lock:
+            self._compact()
+            total: dict = {}
+            for key, value in self._retired.items():
+                self._merge(total, key, value)
+            for _, shard in self._shards:
+                # 其他线程可能正在写入，复制键列表后再读取
+                for key in list(shard.keys()):
+                    self._merge(total, key, shard[key])
+            return total
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_ShardedMetric):
+    """只增不减的计数器"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, *labelvalues):
+        """
+        增加计数
+
+        Args:
+            amount: 增加的数量
+            labelvalues: 标签值（与labelnames一一对应）
+        """
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def _merge(self, target: dict, key: Tuple, value):
+        target[key] = target.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(self._snapshot().items())]
+
+
+class Histogram(_ShardedMetric):
+    """直方图（每个桶的计数、总和与样本数）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues):
+        """
+        记录一个样本
+
+        Args:
+            value: 样本值
+            labelvalues: 标签值（与labelnames一一对应）
+        """
+        shard = self._shard()
+        entry = shard.get(labelvalues)
+        if entry is None:
+            # 各桶计数（最后一个为+Inf）、总和、样本数
+            entry = shard[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def _merge(self, target: dict, key: Tuple, value):
+        existing = target.get(key)
+        if existing is None:
+            target[key] = list(value)
+        else:
+            for i, v in enumerate(value):
+                existing[i] += v
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, entry in sorted(self._snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(entry[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {entry[-1]}')
+        return lines
+
+
+class Gauge:
+    """仪表：导出时调用函数取当前值（用于加载耗时、内存等状态量）"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        """
+        Args:
+            function: 返回 标签值元组 -> 数值 的函数
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._function = function
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, *labelvalues):
+        """设置当前值"""
+        self._values[labelvalues] = value
+
+    def set_function(self, function: Callable[[], Dict[Tuple, float]]):
+        """改为导出时调用function取值"""
+        self._function = function
+
+    def render(self) -> List[str]:
+        values = self._function() if self._function is not None else dict(self._values)
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float],
+                  labelnames: Sequence[str] = ()) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              function: Optional[Callable[[], Dict[Tuple, float]]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def render(self) -> str:
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimings:
+    """
+    单个请求各阶段的耗时，用于Server-Timing响应头、响应中的timings字段和慢请求日志
+
+    顺序执行的阶段用lap()记录（距上一次lap的时间），并行的部分（如每个模型的编码）用add()。
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.phases: Dict[str, float] = {}  # 阶段名 -> 耗时（秒），按记录顺序
+        self.models: Dict[str, float] = {}  # 模型名 -> 编码耗时（秒）
+        self.info: Dict[str, object] = {}   # 输入大小等附加信息
+
+    def lap(self, name: str):
+        """记录从上一次lap（或请求开始）到现在的阶段耗时"""
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + (now - self._last)
+        self._last = now
+
+    def add_models(self, timings: Dict[str, float]):
+        """记录每个模型的编码耗时（秒）"""
+        self.models.update(timings)
+
+    def total(self) -> float:
+        """请求开始到现在的总耗时（秒）"""
+        return time.perf_counter() - self.start
+
+    def as_dict(self) -> Dict[str, object]:
+        """各阶段及每个模型的耗时（毫秒）"""
+        return {
+            'total_ms': round(self.total() * 1000, 3),
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+            'models_ms': {name: round(seconds * 1000, 3) for name, seconds in sorted(self.models.items())}
+        }
+
+    def server_timing(self) -> str:
+        """Server-Timing响应头的值，如 read;dur=1.2, encode;dur=30.5, model-qwen3-8b;dur=12.1, total;dur=33.0"""
+        entries = [f'{_timing_name(name)};dur={seconds * 1000:.3f}' for name, seconds in self.phases.items()]
+        entries.extend(
+            f'{_timing_name("model-" + name)};dur={seconds * 1000:.3f};desc="{name}"'
+            for name, seconds in sorted(self.models.items())
+        )
+        entries.append(f'total;dur={self.total() * 1000:.3f}')
+        return ', '.join(entries)
+
+
+def _timing_name(name: str) -> str:
+    """Server-Timing的指标名只能包含token字符"""
+    return re.sub(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]", '_', name)
+
+
+def current_rss_bytes() -> Optional[int]:
+    """当前进程的常驻内存（字节），不支持的平台返回峰值RSS或None"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# 全局注册表及热路径上使用的指标
+REGISTRY = MetricsRegistry()
+
+ENCODE_SECONDS = REGISTRY.histogram(
+    'token_encode_seconds', '每次tokenizer调用（encode或合并后的encode_batch）的编码耗时，不含实例池等待、批处理排队和缓存命中',
+    LATENCY_BUCKETS, ('model',))
+ENCODED_TOKENS = REGISTRY.counter(
+    'token_encoded_tokens_total', '编码产生的token总数（rate()即tokens/s）', ('model',))
+ENCODED_CHARS = REGISTRY.counter(
+    'token_encoded_chars_total', '编码的字符总数（rate()即chars/s）', ('model',))
+CACHE_HITS = REGISTRY.counter(
+    'token_cache_hits_total', '编码结果缓存命中次数', ('model',))
+BATCH_SIZE = REGISTRY.histogram(
+    'token_batch_size', '微批处理每批合并的编码请求数', BATCH_SIZE_BUCKETS)
+BATCH_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    'token_batch_queue_wait_seconds', '编码请求在微批处理队列中等待的时间', LATENCY_BUCKETS)
+REQUEST_BYTES = REGISTRY.histogram(
+    'http_request_bytes', 'HTTP请求体大小', SIZE_BUCKETS, ('endpoint',))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP请求处理耗时', LATENCY_BUCKETS, ('endpoint', 'status'))
+TOKENIZER_LOAD_SECONDS = REGISTRY.gauge(
+    'tokenizer_load_seconds', '每个模型的tokenizer加载耗时', ('model',))
+TOKENIZER_BYTES = REGISTRY.gauge(
+    'tokenizer_estimated_bytes', '每个已加载tokenizer实例的内存估计值', ('model',))
+TOKENIZER_POOL_INSTANCES = REGISTRY.gauge(
+    'tokenizer_pool_instances', '每个模型的tokenizer实例池当前实例数（含克隆的副本）', ('model',))
+PROCESS_RSS = REGISTRY.gauge(
+    'process_resident_memory_bytes', '进程常驻内存', function=lambda: {(): current_rss_bytes() or 0})
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+编码结果缓存 - 按内容寻址，按字节预算做LRU淘汰
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+# 每个缓存条目除结果本身外的固定开销估计（键、OrderedDict节点等）
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def text_digest(text: str) -> str:
+    """
+    计算文本的内容摘要，作为缓存键的一部分
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        十六进制摘要字符串
+    """
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """线程安全的LRU缓存，总大小受字节预算限制（而不是条目数）"""
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: 缓存内容的字节预算，超出时淘汰最久未使用的条目
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        读取缓存并标记为最近使用
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存的值，未命中时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        """
+        写入缓存，必要时淘汰最久未使用的条目
+
+        Args:
+            key: 缓存键
+            value: 要缓存的值（调用方不应再修改）
+            size: 值占用的字节数估计
+        """
+        size += ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            # 单个结果超过整个预算，不缓存
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存（保留计数器）"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -21,11 +21,15 @@ if not web_dir.exists():
 
 # 导入并运行Flask应用
 if __name__ == '__main__':
-    from app import app
+    from app import app, start_background_loading
     
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('DEBUG', 'False').lower() == 'true'
     
+    # 启动时在后台加载tokenizer（debug模式下只在实际处理请求的子进程中加载）
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_loading()
+    
     print("=" * 60)
     print("Token计算工具")
     print("=" * 60)
@@ -0,0 +1,83 @@
+"""测试配置：把项目根目录加入导入路径（项目模块都在根目录下），提供使用测试tokenizer的计算器和Web客户端"""
+
+import json
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# 测试用的小型tokenizer（bpe-chatml、bpe-small），见fixtures/build_tokenizers.py
+FIXTURE_TOKENIZERS_DIR = Path(__file__).resolve().parent / 'fixtures' / 'tokenizers'
+
+
+@pytest.fixture
+def tokenizers_dir() -> Path:
+    """测试tokenizer所在的目录"""
+    return FIXTURE_TOKENIZERS_DIR
+
+
+@pytest.fixture
+def copy_tokenizer(tmp_path):
+    """
+    把测试tokenizer复制到临时目录tmp_path/tokenizers/<name>，可以覆盖tokenizer_config.json中的项
+    （值为None时删除该项），返回临时的tokenizers目录
+    """
+    root = tmp_path / 'tokenizers'
+
+    def copy(name: str, source: str = 'bpe-chatml', **config) -> Path:
+        target = root / name
+        shutil.copytree(FIXTURE_TOKENIZERS_DIR / source, target)
+        if config:
+            config_file = target / 'tokenizer_config.json'
+            settings = json.loads(config_file.read_text(encoding='utf-8'))
+            settings.update(config)
+            settings = {key: value for key, value in settings.items() if value is not None}
+            config_file.write_text(json.dumps(settings, ensure_ascii=False, indent=2), encoding='utf-8')
+        return root
+
+    return copy
+
+
+@pytest.fixture
+def make_calculator():
+    """创建本地模式的TokenCalculator（默认使用测试tokenizer、串行编码），测试结束时关闭"""
+    from calculate_tokens import TokenCalculator
+
+    calculators = []
+
+    def make(**options):
+        options.setdefault('local_mode', True)
+        options.setdefault('tokenizers_dir', str(FIXTURE_TOKENIZERS_DIR))
+        options.setdefault('workers', 1)
+        calculator = TokenCalculator(**options)
+        calculators.append(calculator)
+        return calculator
+
+    yield make
+    for calculator in calculators:
+        calculator.close()
+
+
+@pytest.fixture
+def calculator(make_calculator):
+    """已加载所有测试tokenizer的计算器"""
+    return make_calculator()
+
+
+@pytest.fixture
+def client(calculator, monkeypatch):
+    """Flask测试客户端：计算器已就绪（不启动后台加载线程），暂存区和会话每个测试独立"""
+    import app as app_module
+    from edit_session import SessionStore
+    from token_store import TokenStore
+
+    monkeypatch.setattr(app_module, '_calculator', calculator)
+    # 视为后台加载已启动，get_calculator不再创建加载线程
+    monkeypatch.setattr(app_module, '_loader_thread', object())
+    monkeypatch.setitem(app_module._load_state, 'status', 'ready')
+    monkeypatch.setattr(app_module, 'token_store', TokenStore(600, 64 * 1024 * 1024))
+    monkeypatch.setattr(app_module, 'session_store', SessionStore(600, 64 * 1024 * 1024))
+    return app_module.app.test_client()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+生成测试用的小型tokenizer（tests/fixtures/tokenizers/），结果已提交到仓库，修改后重新运行：
+
+    python tests/fixtures/build_tokenizers.py
+
+- bpe-chatml：byte-level BPE（与Qwen相同的预分词），ChatML模板，eos为<|im_end|>；
+- bpe-small：词表更小的同类tokenizer（合并规则不同），clean_up_tokenization_spaces为true，没有chat template。
+"""
+
+import json
+from pathlib import Path
+
+from tokenizers import Regex, Tokenizer, decoders, models, normalizers, pre_tokenizers, trainers
+
+
+OUTPUT_DIR = Path(__file__).resolve().parent / 'tokenizers'
+
+SPECIAL_TOKENS = ['<|endoftext|>', '<|im_start|>', '<|im_end|>']
+
+SPLIT_PATTERN = (r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}| ?[^\s\p{L}\p{N}]+[\r\n]*"
+                 r"|\s*[\r\n]+|\s+(?!\S)|\s+")
+
+CHATML_TEMPLATE = (
+    "{% for message in messages %}{{'<|im_start|>' + message['role'] + '\\n' + message['content'] + '<|im_end|>' + '\\n'}}"
+    "{% endfor %}{% if add_generation_prompt %}{{ '<|im_start|>assistant\\n' }}{% endif %}"
+)
+
+CORPUS = [
+    "The quick brown fox jumps over the lazy dog. It isn't lazy , it's tired , and we don't know why .",
+    "Tokenizers split words like unbelievably and internationalization into sub-word pieces.",
+    "def fib(n: int) -> int:\n    return n if n < 2 else fib(n - 1) + fib(n - 2)\n",
+    "for (let i = 0; i < items.length; i++) { console.log(items[i]); }\n",
+    "import json\nprint(json.dumps({\"key\": [1, 2, 3]}, indent=2))\n",
+    "大语言模型按token计费，同一段中文在不同tokenizer下的token数量可能相差很大。",
+    "今天天气很好，我们去公园散步吧。机器学习和自然语言处理是人工智能的重要方向。",
+    "繁體中文與简体中文混排，还有全角标点「」——以及数字2024年10月18日。",
+    "emoji: 👍🏽 🎉 🍜 𠮷野家 café naïve résumé",
+]
+
+
+def build(vocab_size: int) -> Tokenizer:
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.normalizer = normalizers.NFC()
+    tokenizer.pre_tokenizer = pre_tokenizers.Sequence([
+        pre_tokenizers.Split(Regex(SPLIT_PATTERN), behavior='isolated'),
+        pre_tokenizers.ByteLevel(add_prefix_space=False, use_regex=False)
+    ])
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=SPECIAL_TOKENS,
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet(), show_progress=False)
+    tokenizer.train_from_iterator(CORPUS * 20, trainer)
+    return tokenizer
+
+
+def save(name: str, tokenizer: Tokenizer, config: dict):
+    path = OUTPUT_DIR / name
+    path.mkdir(parents=True, exist_ok=True)
+    tokenizer.save(str(path / 'tokenizer.json'))
+    with open(path / 'tokenizer_config.json', 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def main():
+    save('bpe-chatml', build(640), {
+        'tokenizer_class': 'PreTrainedTokenizerFast',
+        'clean_up_tokenization_spaces': False,
+        'eos_token': '<|im_end|>',
+        'chat_template': CHATML_TEMPLATE
+    })
+    save('bpe-small', build(400), {
+        'tokenizer_class': 'PreTrainedTokenizerFast',
+        'clean_up_tokenization_spaces': True,
+        'eos_token': '<|endoftext|>'
+    })
+    print(f'已生成: {OUTPUT_DIR}')
+
+
+if __name__ == '__main__':
+    main()
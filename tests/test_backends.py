@@ -0,0 +1,57 @@
+"""tokenizer后端：tokenizers后端不导入transformers，两个后端编码结果一致，auto回退"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from tokenizer_backends import (BACKEND_AUTO, BACKEND_TOKENIZERS, BACKEND_TRANSFORMERS, TokenizersBackend,
+                                TransformersBackend, is_available, load_backend)
+
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+TEXT = 'Hello world! 你好，世界。𠮷野家🍜\n<|im_start|>user\ndef f(x):\n    return x\n'
+
+requires_transformers = pytest.mark.skipif(not is_available(BACKEND_TRANSFORMERS), reason='未安装transformers')
+
+
+@pytest.mark.parametrize('backend', [BACKEND_TOKENIZERS, BACKEND_AUTO])
+def test_tokenizers_backend_does_not_import_transformers(tokenizers_dir, backend):
+    script = (
+        'import sys\n'
+        'from calculate_tokens import TokenCalculator\n'
+        f'calculator = TokenCalculator(local_mode=True, tokenizers_dir={str(tokenizers_dir)!r}, backend={backend!r})\n'
+        'assert calculator.calculate_tokens("hello world")["bpe-chatml"] > 0\n'
+        'print(sorted(m for m in ("transformers", "torch") if m in sys.modules))\n'
+    )
+    result = subprocess.run([sys.executable, '-c', script], cwd=PROJECT_DIR, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == '[]'
+
+
+@requires_transformers
+@pytest.mark.parametrize('model', ['bpe-chatml', 'bpe-small'])
+def test_backends_agree(tokenizers_dir, model):
+    fast = load_backend(str(tokenizers_dir / model), local=True, backend=BACKEND_TOKENIZERS)
+    full = load_backend(str(tokenizers_dir / model), local=True, backend=BACKEND_TRANSFORMERS)
+    assert len(fast) == len(full)
+    assert fast.encode(TEXT, return_offsets=True) == full.encode(TEXT, return_offsets=True)
+    assert fast.encode_batch([TEXT, 'abc']) == full.encode_batch([TEXT, 'abc'])
+    assert fast.chat_template() == full.chat_template()
+    assert fast.special_tokens() == full.special_tokens()
+    assert sorted(fast.boundary_tokens()) == sorted(full.boundary_tokens())
+
+
+@requires_transformers
+def test_auto_falls_back_to_transformers(tokenizers_dir, monkeypatch):
+    assert isinstance(load_backend(str(tokenizers_dir / 'bpe-chatml'), local=True), TokenizersBackend)
+
+    def fail(source, local):
+        raise ValueError('unsupported tokenizer.json')
+
+    monkeypatch.setattr(TokenizersBackend, 'load', fail)
+    tokenizer = load_backend(str(tokenizers_dir / 'bpe-chatml'), local=True)
+    assert isinstance(tokenizer, TransformersBackend)
+    with pytest.raises(ValueError):
+        load_backend(str(tokenizers_dir / 'bpe-chatml'), local=True, backend=BACKEND_TOKENIZERS)
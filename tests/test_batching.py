@@ -0,0 +1,138 @@
+"""微批处理：并发请求合并、等待窗口、异常分发到每个请求"""
+
+import threading
+import time
+
+import pytest
+
+from batching import MicroBatcher
+
+
+class Recorder:
+    """记录每批请求的run_batch；first_gate未打开时第一批阻塞（模拟正在执行的批）"""
+
+    def __init__(self, results=None):
+        self.batches = []
+        self.first_gate = threading.Event()
+        self.results = results
+
+    def __call__(self, key, requests):
+        self.batches.append(list(requests))
+        if len(self.batches) == 1:
+            assert self.first_gate.wait(5)
+        if self.results is not None:
+            return self.results(requests)
+        return [request * 10 for request in requests]
+
+
+def _submit(batcher, key, request, outcomes):
+    """在新线程中提交请求，结果或异常记入outcomes[request]"""
+    def run():
+        try:
+            outcomes[request] = batcher.submit(key, request)
+        except Exception as e:
+            outcomes[request] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline
+        time.sleep(0.001)
+
+
+def _queued(batcher, key):
+    with batcher._cond:
+        return len(batcher._queues.get(key, []))
+
+
+def test_no_contention_runs_immediately():
+    recorder = Recorder()
+    recorder.first_gate.set()
+    batcher = MicroBatcher(recorder, window_seconds=10, max_batch_size=8)
+    start = time.perf_counter()
+    assert batcher.submit('k', 1) == 10
+    assert time.perf_counter() - start < 1
+    assert recorder.batches == [[1]]
+
+
+def test_requests_coalesce_while_batch_running():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, window_seconds=10, max_batch_size=3)
+    outcomes = {}
+    threads = [_submit(batcher, 'k', 1, outcomes)]
+    _wait_until(lambda: len(recorder.batches) == 1)
+    # 第一批执行期间到达的请求合并为一批，队列满时不等窗口结束立即执行
+    threads.append(_submit(batcher, 'k', 2, outcomes))
+    _wait_until(lambda: _queued(batcher, 'k') == 1)
+    threads += [_submit(batcher, 'k', request, outcomes) for request in (3, 4)]
+    _wait_until(lambda: len(recorder.batches) == 2)
+    assert sorted(recorder.batches[1]) == [2, 3, 4]
+    # 其他键不受影响
+    assert batcher.submit('other', 5) == 50
+
+    recorder.first_gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert outcomes == {1: 10, 2: 20, 3: 30, 4: 40}
+    stats = batcher.stats()
+    assert stats['batches'] == 3 and stats['items'] == 5
+    assert stats['batch_sizes'] == {1: 2, 3: 1}
+
+
+def test_window_limits_wait():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, window_seconds=0.05, max_batch_size=8)
+    outcomes = {}
+    first = _submit(batcher, 'k', 1, outcomes)
+    _wait_until(lambda: len(recorder.batches) == 1)
+    # 第一批仍在执行，第二批在窗口结束后执行，不等第一批完成
+    start = time.perf_counter()
+    assert batcher.submit('k', 2) == 20
+    assert time.perf_counter() - start >= 0.05
+    assert recorder.batches[1] == [2] and 1 not in outcomes
+    recorder.first_gate.set()
+    first.join(5)
+    assert outcomes == {1: 10}
+
+
+def _run_contended_batch(recorder):
+    """第一批阻塞时提交三个请求合并为第二批，返回各请求的结果"""
+    batcher = MicroBatcher(recorder, window_seconds=10, max_batch_size=3)
+    outcomes = {}
+    threads = [_submit(batcher, 'k', 1, outcomes)]
+    _wait_until(lambda: len(recorder.batches) == 1)
+    threads.append(_submit(batcher, 'k', 2, outcomes))
+    _wait_until(lambda: _queued(batcher, 'k') == 1)
+    threads += [_submit(batcher, 'k', request, outcomes) for request in (3, 4)]
+    _wait_until(lambda: len(recorder.batches) == 2)
+    recorder.first_gate.set()
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+    return outcomes
+
+
+def test_error_fans_out_to_every_request():
+    def results(requests):
+        if len(requests) > 1:
+            raise ValueError('batch failed')
+        return [request * 10 for request in requests]
+
+    outcomes = _run_contended_batch(Recorder(results))
+    assert outcomes[1] == 10
+    assert all(isinstance(outcomes[request], ValueError) for request in (2, 3, 4))
+
+
+@pytest.mark.parametrize('count', [2, 4])
+def test_mismatched_result_count_fails_every_request(count):
+    def results(requests):
+        return [request * 10 for request in requests] if len(requests) == 1 else list(range(count))
+
+    outcomes = _run_contended_batch(Recorder(results))
+    assert outcomes[1] == 10
+    assert all(isinstance(outcomes[request], RuntimeError) for request in (2, 3, 4))
@@ -0,0 +1,84 @@
+"""基准测试套件：可复现的测试文本、用例矩阵与基准对比（只验证正确性，不测性能）"""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from bench import WORKLOADS, compare_baseline, make_workload_text, parse_size, run_suite
+
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+@pytest.mark.parametrize('value, expected', [('1KB', 1024), ('16MB', 16 << 20), ('1.5kb', 1536), ('100', 100)])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize('workload', WORKLOADS)
+def test_workload_text_is_reproducible(workload):
+    text = make_workload_text(workload, 64 * 1024)
+    assert text == make_workload_text(workload, 64 * 1024)
+    assert text != make_workload_text(workload, 64 * 1024, seed=1)
+    assert 0.9 * 64 * 1024 <= len(text.encode('utf-8')) <= 1.1 * 64 * 1024
+
+
+def test_run_suite_cases(calculator):
+    cases = run_suite(calculator, ['zh', 'code'], [1024], ['single', 'threads', 'batch'],
+                      repeat=2, case_seconds=0, doc_chars=100)
+    # single模式每个模型一条，threads/batch为所有模型合计
+    assert [(case['workload'], case['mode'], case['model']) for case in cases] == [
+        (workload, mode, model)
+        for workload in ['zh', 'code']
+        for mode, model in [('single', 'bpe-chatml'), ('single', 'bpe-small'), ('threads', 'all'), ('batch', 'all')]
+    ]
+    for workload in ['zh', 'code']:
+        text = make_workload_text(workload, 1024)
+        by_mode = {(case['mode'], case['model']): case for case in cases if case['workload'] == workload}
+        counts = calculator.calculate_tokens(text)
+        for model_key, count in counts.items():
+            assert by_mode[('single', model_key)]['tokens'] == count
+        assert by_mode[('threads', 'all')]['tokens'] == sum(counts.values())
+        assert by_mode[('batch', 'all')]['tokens'] > 0
+    assert all(case['runs'] == 1 and case['chars_per_s'] > 0 and not case['streamed'] for case in cases)
+
+
+def _case(mode, chars_per_s, p50_ms):
+    return {'workload': 'zh', 'size_bytes': 1024, 'mode': mode, 'model': 'all',
+            'chars_per_s': chars_per_s, 'p50_ms': p50_ms}
+
+
+def test_compare_baseline():
+    baseline = {'cases': [_case('threads', 1000, 10), _case('batch', 1000, 10), _case('single', 0, 0)]}
+    cases = [_case('threads', 950, 10.5), _case('batch', 800, 10), _case('single', 5, 1), _case('new', 1, 1)]
+    regressions = compare_baseline(cases, baseline, threshold=0.1)
+    # 10%以内的变化、基准值为0的用例和基准中没有的用例都不算退化
+    assert [r['mode'] for r in regressions] == ['batch']
+    assert regressions[0]['throughput_ratio'] == 0.8
+    assert [r['mode'] for r in compare_baseline([_case('threads', 1000, 12)], baseline, 0.1)] == ['threads']
+
+
+def test_suite_cli_exit_code(tmp_path, tokenizers_dir):
+    def run(*extra):
+        return subprocess.run(
+            [sys.executable, 'bench.py', '--tokenizers-dir', str(tokenizers_dir), 'suite', '--workloads', 'en',
+             '--sizes', '1KB', '--modes', 'threads', '--repeat', '1', '--case-seconds', '0', *extra],
+            cwd=PROJECT_DIR, capture_output=True, text=True)
+
+    result = run('-o', str(tmp_path / 'baseline.json'))
+    assert result.returncode == 0, result.stderr
+    report = json.loads((tmp_path / 'baseline.json').read_text(encoding='utf-8'))
+    assert report['meta']['models'] == ['bpe-chatml', 'bpe-small'] and len(report['cases']) == 1
+
+    # 基准吞吐量远高于本次结果时判定为退化，退出码为1
+    report['cases'][0]['chars_per_s'] *= 1000
+    (tmp_path / 'fast.json').write_text(json.dumps(report), encoding='utf-8')
+    result = run('--baseline', str(tmp_path / 'fast.json'))
+    assert result.returncode == 1
+    assert len(json.loads(result.stdout)['baseline']['regressions']) == 1
+
+    result = run('--baseline', str(tmp_path / 'baseline.json'), '--threshold', '1000')
+    assert result.returncode == 0 and json.loads(result.stdout)['baseline']['regressions'] == []
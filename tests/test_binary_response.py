@@ -0,0 +1,53 @@
+"""binary格式的token ID响应：经过真实的WSGI服务器（werkzeug）返回并能被完整解析"""
+
+import threading
+import urllib.request
+from array import array
+
+import pytest
+from flask import Flask
+from werkzeug.serving import make_server
+
+from app import ids_response
+from calculate_tokens import EncodeResult
+from id_codec import FORMAT_BINARY, parse_binary
+
+
+@pytest.fixture
+def server_url():
+    encodings = {
+        'model-a': EncodeResult(array('I', range(100000))),
+        'model-b': EncodeResult(array('I', [151643, 0, 7])),
+        'model-c': EncodeResult(array('I')),
+    }
+    test_app = Flask(__name__)
+
+    @test_app.route('/ids')
+    def ids():
+        response_data = {
+            'success': True,
+            'results': [{'model': model_key, 'token_count': encoding.count}
+                        for model_key, encoding in encodings.items()]
+        }
+        return ids_response(response_data, encodings, FORMAT_BINARY)
+
+    server = make_server('127.0.0.1', 0, test_app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def test_binary_response_through_real_server(server_url):
+    with urllib.request.urlopen(f'{server_url}/ids', timeout=10) as response:
+        assert response.headers['Content-Type'] == 'application/octet-stream'
+        body = response.read()
+
+    header, id_arrays = parse_binary(body)
+    assert [result['model'] for result in header['results']] == ['model-a', 'model-b', 'model-c']
+    assert id_arrays[0] == array('I', range(100000))
+    assert id_arrays[1] == array('I', [151643, 0, 7])
+    assert len(id_arrays[2]) == 0
@@ -0,0 +1,111 @@
+"""/api/calculate：计数、分词预览与直接编码一致，流式响应的事件顺序"""
+
+import json
+
+import pytest
+
+from tokenizer_backends import TokenizersBackend
+
+
+TEXT = 'Hello world! 你好，世界。\ndef f(x):\n    return x * 2\n'
+
+
+@pytest.fixture
+def encode_calls(monkeypatch):
+    """统计每个tokenizer实例的编码次数（encode与encode_batch）"""
+    calls = []
+    original_encode = TokenizersBackend.encode
+    original_encode_batch = TokenizersBackend.encode_batch
+
+    def encode(self, text, return_offsets=False):
+        calls.append(text)
+        return original_encode(self, text, return_offsets)
+
+    def encode_batch(self, texts, return_offsets=False):
+        calls.extend(texts)
+        return original_encode_batch(self, texts, return_offsets)
+
+    monkeypatch.setattr(TokenizersBackend, 'encode', encode)
+    monkeypatch.setattr(TokenizersBackend, 'encode_batch', encode_batch)
+    return calls
+
+
+def test_counts_match_direct_encoding(client, calculator):
+    response = client.post('/api/calculate', json={'text': TEXT})
+    data = response.get_json()
+    assert response.status_code == 200 and data['success']
+    assert data['text_length'] == len(TEXT)
+    counts = {item['model']: item['token_count'] for item in data['results']}
+    assert counts == {model_key: len(calculator.tokenizers[model_key].encode(TEXT)[0])
+                      for model_key in calculator.models}
+    assert data['tokens_id']
+
+
+def test_single_encode_per_model_with_token_preview(client, calculator, encode_calls):
+    response = client.post('/api/calculate', data={'text': TEXT, 'models': ['bpe-chatml'], 'include_tokens': 'true'})
+    data = response.get_json()
+    assert data['success']
+    # 计数、比率和分词预览复用同一次编码
+    assert encode_calls == [TEXT]
+    item = data['results'][0]
+    ids = calculator.tokenizers['bpe-chatml'].encode(TEXT)[0]
+    assert item['token_count'] == len(ids) == item['preview_count']
+    assert item['token_preview'] == [calculator.tokenizers['bpe-chatml'].decode_one(i) for i in ids]
+
+
+def test_selected_models_and_errors(client):
+    data = client.post('/api/calculate', json={'text': TEXT, 'models': ['bpe-small']}).get_json()
+    assert [item['model'] for item in data['results']] == ['bpe-small']
+
+    response = client.post('/api/calculate', json={'text': TEXT, 'models': ['no-such-model']})
+    assert response.status_code == 400
+    response = client.post('/api/calculate', json={'text': ''})
+    assert response.status_code == 400
+
+
+def _ndjson_events(response):
+    return [(event.pop('type'), event) for event in map(json.loads, response.get_data(as_text=True).splitlines())]
+
+
+def _sse_events(response):
+    events = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        if not block:
+            continue
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+@pytest.mark.parametrize('request_options, parse', [
+    ({'data': {'text': TEXT, 'stream': 'ndjson'}}, _ndjson_events),
+    ({'json': {'text': TEXT, 'stream': 'sse'}}, _sse_events),
+    ({'json': {'text': TEXT}, 'headers': {'Accept': 'application/x-ndjson'}}, _ndjson_events),
+    ({'json': {'text': TEXT}, 'headers': {'Accept': 'text/event-stream'}}, _sse_events),
+])
+def test_stream_event_order(client, calculator, request_options, parse):
+    response = client.post('/api/calculate', **request_options)
+    assert response.headers['Cache-Control'] == 'no-cache'
+    events = parse(response)
+    names = [name for name, _ in events]
+    # start，然后每个模型一条result，最后done
+    assert names == ['start'] + ['result'] * len(calculator.models) + ['done']
+    start, results, done = events[0][1], [payload for _, payload in events[1:-1]], events[-1][1]
+    assert start['text_length'] == len(TEXT) and start['models'] == sorted(calculator.models)
+    assert sorted(item['model'] for item in results) == sorted(calculator.models)
+    for item in results:
+        assert item['token_count'] == len(calculator.tokenizers[item['model']].encode(TEXT)[0])
+    assert done['success'] and done['tokens_id']
+    page = client.get(f"/api/tokens?id={done['tokens_id']}&model=bpe-chatml").get_json()
+    assert page['total_tokens'] == next(item['token_count'] for item in results if item['model'] == 'bpe-chatml')
+
+
+def test_stream_reports_failed_model(client, calculator, monkeypatch):
+    def fail(text, return_offsets=False):
+        raise RuntimeError('encode failed')
+
+    monkeypatch.setattr(calculator.tokenizers['bpe-small'], 'encode', fail)
+    events = _ndjson_events(client.post('/api/calculate', data={'text': TEXT, 'stream': 'ndjson'}))
+    assert [name for name, _ in events][0] == 'start' and events[-1][0] == 'done'
+    middle = {payload['model']: name for name, payload in events[1:-1]}
+    assert middle == {'bpe-chatml': 'result', 'bpe-small': 'error'}
@@ -0,0 +1,65 @@
+"""/api/calculate_batch：JSON与NDJSON响应的每段计数、汇总行与直接编码一致"""
+
+import json
+
+import pytest
+
+from calculate_tokens import BATCH_SLICE_TEXTS
+
+
+# 超过一组的文本数，覆盖分组编码；包含空文本和重复文本
+TEXTS = [f'第{i}段 text number {i}\n' * (i % 5) for i in range(BATCH_SLICE_TEXTS + 30)]
+
+
+def _expected(calculator, models):
+    return [{m: len(calculator.tokenizers[m].encode(text)[0]) for m in models} for text in TEXTS]
+
+
+def test_json_results(client, calculator):
+    response = client.post('/api/calculate_batch', json={'texts': TEXTS})
+    data = response.get_json()
+    assert response.status_code == 200 and data['success']
+    assert data['models'] == calculator.models
+    assert [item['index'] for item in data['results']] == list(range(len(TEXTS)))
+    assert [item['chars'] for item in data['results']] == [len(text) for text in TEXTS]
+    assert [item['tokens'] for item in data['results']] == _expected(calculator, calculator.models)
+
+
+@pytest.mark.parametrize('request_options', [
+    {'json': {'texts': TEXTS, 'models': ['bpe-small'], 'stream': True}},
+    {'json': {'texts': TEXTS, 'models': ['bpe-small']}, 'headers': {'Accept': 'application/x-ndjson'}},
+])
+def test_ndjson_rows_and_summary(client, calculator, request_options):
+    response = client.post('/api/calculate_batch', **request_options)
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    rows, summary = lines[:-1], lines[-1]['summary']
+    expected = _expected(calculator, ['bpe-small'])
+    assert [row['index'] for row in rows] == list(range(len(TEXTS)))
+    assert [row['tokens'] for row in rows] == expected
+    assert summary == {'texts': len(TEXTS), 'tokens': {'bpe-small': sum(item['bpe-small'] for item in expected)}}
+
+
+def test_failed_model_marks_summary(client, calculator, monkeypatch):
+    def fail(texts, return_offsets=False):
+        raise RuntimeError('encode failed')
+
+    monkeypatch.setattr(calculator.tokenizers['bpe-small'], 'encode_batch', fail)
+    monkeypatch.setattr(calculator.tokenizers['bpe-small'], 'encode', lambda text, return_offsets=False: fail([text]))
+    response = client.post('/api/calculate_batch', json={'texts': TEXTS[:3], 'stream': True})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert all(row['tokens']['bpe-small'] == -1 for row in lines[:-1])
+    assert lines[-1]['summary']['tokens']['bpe-small'] == -1
+    assert lines[-1]['summary']['tokens']['bpe-chatml'] > 0
+
+
+@pytest.mark.parametrize('body, status', [
+    ({}, 400),
+    ({'texts': 'not a list'}, 400),
+    ({'texts': ['ok', 1]}, 400),
+    ({'texts': []}, 400),
+    ({'texts': ['ok'], 'models': ['no-such-model']}, 400),
+])
+def test_invalid_requests(client, body, status):
+    response = client.post('/api/calculate_batch', json=body)
+    assert response.status_code == status and not response.get_json()['success']
@@ -0,0 +1,43 @@
+"""TokenCalculator：多模型并行编码与串行结果一致"""
+
+import pytest
+
+
+TEXTS = [
+    'The quick brown fox jumps over the lazy dog.',
+    '大语言模型按token计费，同一段中文在不同tokenizer下的token数量可能相差很大。' * 20,
+    'for (let i = 0; i < n; i++) {\n    sum += i;\n}\n' * 50,
+]
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_parallel_matches_serial(make_calculator, text):
+    serial = make_calculator(workers=1)
+    parallel = make_calculator(workers=4)
+    expected = {model_key: len(serial.tokenizers[model_key].encode(text)[0]) for model_key in serial.models}
+    assert serial.calculate_tokens(text) == expected
+    assert parallel.calculate_tokens(text) == expected
+
+    encodings = parallel.encode_all(text)
+    assert list(encodings) == parallel.models
+    assert all(encodings[m].ids == serial.encode_all(text)[m].ids for m in parallel.models)
+
+
+def test_iter_encode_all_yields_each_model_once(make_calculator):
+    calculator = make_calculator(workers=4)
+    timings = {}
+    yielded = [model_key for model_key, _ in calculator.iter_encode_all(TEXTS[1], timings=timings)]
+    assert sorted(yielded) == sorted(calculator.models)
+    assert set(timings) == set(calculator.models)
+
+
+def test_failing_model_does_not_affect_others(make_calculator, monkeypatch):
+    calculator = make_calculator(workers=4)
+
+    def fail(text, return_offsets=False):
+        raise RuntimeError('encode failed')
+
+    monkeypatch.setattr(calculator.tokenizers['bpe-small'], 'encode', fail)
+    results = calculator.calculate_tokens(TEXTS[0])
+    assert results['bpe-small'] == -1
+    assert results['bpe-chatml'] == len(calculator.tokenizers['bpe-chatml'].encode(TEXTS[0])[0])
@@ -0,0 +1,87 @@
+"""对话计数：按模型的chat template渲染后计数，前缀缓存按模板区分"""
+
+import pytest
+
+from chat_template import render_chat
+
+
+CHATML_TEMPLATE = (
+    "{% for message in messages %}{{'<|im_start|>' + message['role'] + '\\n' + message['content'] + '<|im_end|>' + '\\n'}}"
+    "{% endfor %}{% if add_generation_prompt %}{{ '<|im_start|>assistant\\n' }}{% endif %}"
+)
+# 与CHATML_TEMPLATE只差在没有system消息时补上默认的system消息
+DEFAULT_SYSTEM_TEMPLATE = (
+    "{% if messages[0]['role'] != 'system' %}{{ '<|im_start|>system\\nYou are a helpful assistant.<|im_end|>\\n' }}"
+    "{% endif %}" + CHATML_TEMPLATE
+)
+THINKING_TEMPLATE = CHATML_TEMPLATE.replace("'<|im_start|>assistant\\n'", "'<|im_start|>assistant\\n<think>\\n'")
+
+MESSAGES = [
+    {'role': 'user', 'content': '你好，帮我数一下token。'},
+    {'role': 'assistant', 'content': 'Sure, 请把文本发给我。'},
+    {'role': 'user', 'content': '模板不同，数量也应该不同。'},
+]
+
+
+@pytest.fixture
+def two_templates(make_calculator, copy_tokenizer):
+    """tokenizer.json相同、chat template不同的两个模型"""
+    copy_tokenizer('plain', chat_template=CHATML_TEMPLATE)
+    root = copy_tokenizer('default-system', chat_template=DEFAULT_SYSTEM_TEMPLATE)
+    return make_calculator(tokenizers_dir=str(root))
+
+
+def _full_count(calculator, model_key, messages):
+    tokenizer = calculator.get_tokenizer(model_key)
+    rendered = render_chat(tokenizer.chat_template(), messages, True, tokenizer.special_tokens())
+    return calculator.encode(rendered, model_key, use_cache=False).count
+
+
+def test_count_chat_matches_full_encode(calculator):
+    for end in range(1, len(MESSAGES) + 1):
+        result = calculator.count_chat(MESSAGES[:end], 'bpe-chatml')
+        assert result['token_count'] == _full_count(calculator, 'bpe-chatml', MESSAGES[:end])
+    # 追加消息时复用之前对话的前缀，只编码其后的文本
+    assert result['cached_tokens'] > 0 and result['encoded_chars'] < result['rendered_chars']
+
+
+def test_templates_sharing_tokenizer_json_count_differently(two_templates):
+    calculator = two_templates
+    assert calculator.tokenizers['plain'] is not calculator.tokenizers['default-system']
+    results = calculator.count_chat_all(MESSAGES)
+    assert results['plain']['token_count'] == _full_count(calculator, 'plain', MESSAGES)
+    assert results['default-system']['token_count'] == _full_count(calculator, 'default-system', MESSAGES)
+    assert results['plain']['token_count'] < results['default-system']['token_count']
+
+    # 前缀缓存已经预热后，追加消息的计数仍按各自的模板
+    longer = MESSAGES + [{'role': 'assistant', 'content': '好的。'}]
+    results = calculator.count_chat_all(longer)
+    assert results['plain']['cached_tokens'] > 0 and results['default-system']['cached_tokens'] > 0
+    assert results['plain']['token_count'] == _full_count(calculator, 'plain', longer)
+    assert results['default-system']['token_count'] == _full_count(calculator, 'default-system', longer)
+    assert results['plain']['token_count'] < results['default-system']['token_count']
+
+
+def test_prefix_cache_keyed_by_template(make_calculator, copy_tokenizer, monkeypatch):
+    copy_tokenizer('plain', chat_template=CHATML_TEMPLATE)
+    root = copy_tokenizer('thinking', chat_template=THINKING_TEMPLATE)
+    calculator = make_calculator(tokenizers_dir=str(root))
+    # 即使两个模型的指纹相同，模板不同的对话也不复用彼此的前缀
+    monkeypatch.setitem(calculator.fingerprints, 'thinking', calculator.fingerprints['plain'])
+    assert calculator.count_chat(MESSAGES, 'plain')['cached_tokens'] == 0
+    result = calculator.count_chat(MESSAGES + [{'role': 'assistant', 'content': '好的。'}], 'thinking')
+    assert result['cached_tokens'] == 0
+    assert calculator.count_chat(MESSAGES, 'thinking')['token_count'] == _full_count(calculator, 'thinking', MESSAGES)
+    assert (calculator.count_chat(MESSAGES, 'thinking')['token_count']
+            > calculator.count_chat(MESSAGES, 'plain')['token_count'])
+
+
+def test_calculate_chat_api(client, calculator):
+    response = client.post('/api/calculate_chat', json={'messages': MESSAGES, 'models': ['bpe-chatml']})
+    data = response.get_json()
+    assert response.status_code == 200 and data['success']
+    assert [item['model'] for item in data['results']] == ['bpe-chatml']
+    assert data['results'][0]['token_count'] == _full_count(calculator, 'bpe-chatml', MESSAGES)
+
+    assert client.post('/api/calculate_chat', json={'messages': []}).status_code == 400
+    assert client.post('/api/calculate_chat', json={'messages': [{'content': 'x'}]}).status_code == 400
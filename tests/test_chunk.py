@@ -0,0 +1,140 @@
+"""按token数分块：每块不超过max_tokens，块首尾相接还原原文，重叠、对齐换行/句末与流式返回"""
+
+import io
+import json
+import random
+
+import pytest
+
+
+def _make_text(seed=0, lines=60):
+    rng = random.Random(seed)
+    words = ['分块', '测试', 'chunk', 'token', 'boundary', '🍜', '𠮷野家', '，', ' ', 'naïve', '123']
+    ends = ['。', '！', '.', '?', '；', '']
+    return ''.join(
+        ''.join(rng.choice(words) for _ in range(rng.randint(3, 25))) + rng.choice(ends) + '\n'
+        for _ in range(lines)
+    )
+
+
+TEXT = _make_text()
+
+
+def _post(client, **params):
+    params.setdefault('text', TEXT)
+    params.setdefault('model', 'bpe-chatml')
+    response = client.post('/api/chunk', json=params)
+    return response.status_code, response.get_json()
+
+
+@pytest.mark.parametrize('model_key', ['bpe-chatml', 'bpe-small'])
+@pytest.mark.parametrize('max_tokens', [1, 7, 64, 100000])
+def test_chunks_concatenate_to_input(client, calculator, model_key, max_tokens):
+    status, data = _post(client, model=model_key, max_tokens=max_tokens)
+    assert status == 200 and data['success'] and data['chars'] == len(TEXT)
+    chunks = data['chunks']
+    assert data['chunk_count'] == len(chunks) and [chunk['index'] for chunk in chunks] == list(range(len(chunks)))
+    assert all(0 < chunk['token_count'] <= max_tokens for chunk in chunks)
+    assert ''.join(chunk['text'] for chunk in chunks) == TEXT
+    assert chunks[0]['start'] == 0 and chunks[-1]['end'] == len(TEXT)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk['start'] == previous['end']
+        assert chunk['token_start'] == previous['token_start'] + previous['token_count']
+    # overlap为0时各块token数之和等于整体编码的token数
+    assert sum(chunk['token_count'] for chunk in chunks) == calculator.calculate_tokens(TEXT)[model_key]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_strict_chunks_fit_when_encoded_alone(client, calculator, seed):
+    text = _make_text(seed, lines=20)
+    status, data = _post(client, text=text, max_tokens=9, strict=True)
+    assert status == 200
+    chunks = data['chunks']
+    assert ''.join(chunk['text'] for chunk in chunks) == text
+    for chunk in chunks:
+        assert calculator.encode(chunk['text'], 'bpe-chatml', use_cache=False).count <= 9
+
+
+def test_overlap(client):
+    status, data = _post(client, max_tokens=20, overlap=5)
+    assert status == 200
+    chunks = data['chunks']
+    assert all(chunk['token_count'] <= 20 for chunk in chunks)
+    assert chunks[0]['start'] == 0 and chunks[-1]['end'] == len(TEXT)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # 下一块从上一块的末尾之前开始，向前推进至少一个token，不留空隙
+        assert previous['token_start'] < chunk['token_start'] <= previous['token_start'] + previous['token_count']
+        assert previous['start'] < chunk['start'] <= previous['end']
+        assert chunk['text'] == TEXT[chunk['start']:chunk['end']]
+
+
+def _ends_at_snap_point(text, snap):
+    stripped = text.rstrip(' \t\r')
+    if stripped.endswith('\n'):
+        return True
+    return snap == 'sentence' and stripped[-1:] in '。！？；….!?;'
+
+
+@pytest.mark.parametrize('snap', ['newline', 'sentence'])
+def test_snap(client, snap):
+    # 每行远短于半块，除最后一块外都能在换行或句末处切分
+    text = '第一句。Second sentence! 第三句？\n' * 40
+    status, data = _post(client, text=text, max_tokens=40, snap=snap)
+    assert status == 200 and data['snap'] == snap
+    chunks = data['chunks']
+    assert ''.join(chunk['text'] for chunk in chunks) == text
+    assert all(chunk['token_count'] <= 40 for chunk in chunks)
+    assert all(_ends_at_snap_point(chunk['text'], snap) for chunk in chunks)
+    if snap == 'newline':
+        assert all(chunk['text'].endswith('\n') for chunk in chunks)
+    else:
+        assert not all(chunk['text'].endswith('\n') for chunk in chunks)
+
+
+def test_snap_falls_back_without_snap_points(client):
+    text = '没有换行也没有句末标点' * 50
+    status, data = _post(client, text=text, max_tokens=16, snap='newline')
+    assert status == 200
+    assert ''.join(chunk['text'] for chunk in data['chunks']) == text
+    assert all(chunk['token_count'] <= 16 for chunk in data['chunks'])
+
+
+def test_ndjson_stream(client):
+    _, expected = _post(client, max_tokens=32)
+    for request in [
+        {'json': {'text': TEXT, 'model': 'bpe-chatml', 'max_tokens': 32, 'stream': True}},
+        {'json': {'text': TEXT, 'model': 'bpe-chatml', 'max_tokens': 32},
+         'headers': {'Accept': 'application/x-ndjson'}},
+    ]:
+        response = client.post('/api/chunk', **request)
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert lines[:-1] == expected['chunks']
+        assert lines[-1] == {'summary': {'model': 'bpe-chatml', 'chars': len(TEXT), 'chunks': len(expected['chunks'])}}
+
+
+def test_without_text_and_form_upload(client):
+    status, data = _post(client, max_tokens=50, include_text=False)
+    assert status == 200 and all('text' not in chunk for chunk in data['chunks'])
+
+    response = client.post('/api/chunk', data={
+        'file': (io.BytesIO(TEXT.encode('gbk', 'ignore')), 'upload.txt'), 'model': 'bpe-small', 'max_tokens': '50',
+    }, content_type='multipart/form-data')
+    data = response.get_json()
+    assert response.status_code == 200 and data['model'] == 'bpe-small'
+    assert ''.join(chunk['text'] for chunk in data['chunks']) == TEXT.encode('gbk', 'ignore').decode('gbk')
+
+
+@pytest.mark.parametrize('params', [
+    {'max_tokens': 0},
+    {'max_tokens': 'many'},
+    {'max_tokens': 10, 'overlap': 10},
+    {'max_tokens': 10, 'overlap': -1},
+    {'max_tokens': 10, 'snap': 'paragraph'},
+    {'max_tokens': 10, 'model': 'no-such-model'},
+    {'max_tokens': 10, 'model': ''},
+    {'max_tokens': 10, 'text': ''},
+])
+def test_invalid_requests(client, params):
+    status, data = _post(client, **params)
+    assert status == 400 and not data['success']
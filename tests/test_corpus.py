@@ -0,0 +1,61 @@
+"""语料模式：文件编码回退（UTF-8、GBK、无法解码）与JSONL/汇总输出"""
+
+import io
+import json
+
+from corpus import collect_files, run_corpus
+
+
+TEXTS = {
+    'a.md': '# 标题\n\nThe quick brown fox.\n',
+    'sub/b.txt': 'def f(x):\n    return x\n',
+}
+GBK_TEXT = '这是GBK编码的中文文件。\n'
+
+
+def _write_corpus(root):
+    for name, text in TEXTS.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding='utf-8')
+    (root / 'c.txt').write_bytes(GBK_TEXT.encode('gbk'))
+    # 0xFF既不是合法的UTF-8也不是合法的GBK首字节
+    (root / 'd.bin').write_bytes(b'\xff\xfe\xff' * 10)
+
+
+def test_run_corpus_writes_rows_and_summary(tmp_path, tokenizers_dir, calculator):
+    root = tmp_path / 'corpus'
+    _write_corpus(root)
+    files = collect_files(str(root), None)
+    assert [p.relative_to(root).as_posix() for p in files] == ['a.md', 'c.txt', 'd.bin', 'sub/b.txt']
+
+    output = io.StringIO()
+    summary = run_corpus(files, output, local_mode=True, tokenizers_dir=str(tokenizers_dir), processes=1)
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    rows, last = lines[:-1], lines[-1]
+    assert last == {'summary': summary}
+    # 行顺序与输入文件顺序一致
+    assert [row['path'] for row in rows] == [str(p) for p in files]
+
+    expected_texts = {'a.md': TEXTS['a.md'], 'c.txt': GBK_TEXT, 'sub/b.txt': TEXTS['sub/b.txt']}
+    by_name = {p.relative_to(root).as_posix(): row for p, row in zip(files, rows)}
+    for name, text in expected_texts.items():
+        row = by_name[name]
+        assert 'error' not in row
+        assert row['chars'] == len(text)
+        assert row['tokens'] == calculator.calculate_tokens(text)
+    assert by_name['c.txt']['bytes'] == len(GBK_TEXT.encode('gbk'))
+    assert 'error' in by_name['d.bin'] and by_name['d.bin']['bytes'] == 30
+
+    assert summary['files'] == 4 and summary['errors'] == 1 and summary['processes'] == 1
+    assert summary['bytes'] == sum(row['bytes'] for row in rows)
+    assert summary['chars'] == sum(len(text) for text in expected_texts.values())
+    assert summary['tokens'] == {model_key: sum(calculator.calculate_tokens(text)[model_key]
+                                                for text in expected_texts.values())
+                                 for model_key in calculator.models}
+
+
+def test_collect_files_with_pattern(tmp_path):
+    _write_corpus(tmp_path)
+    files = collect_files(str(tmp_path), '*.txt')
+    assert [p.name for p in files] == ['c.txt', 'b.txt']
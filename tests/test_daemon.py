@@ -0,0 +1,108 @@
+"""守护进程：Unix域套接字上的请求协议、结果与进程内计算一致，以及不可用时的回退"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+from token_daemon import DaemonClient, DaemonError, DaemonUnavailable, TokenDaemon, daemon_supported
+
+
+pytestmark = pytest.mark.skipif(not daemon_supported(), reason='当前平台不支持Unix域套接字')
+
+TEXT = '守护进程 daemon 计数\n' * 50
+
+
+@pytest.fixture
+def socket_path():
+    # Unix域套接字路径有长度限制，不使用pytest的tmp_path
+    directory = tempfile.mkdtemp(prefix='td-')
+    yield os.path.join(directory, 'daemon.sock')
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.fixture
+def daemon(calculator, socket_path):
+    """在后台线程中运行的守护进程（不安装信号处理，测试结束时关闭）"""
+    server = TokenDaemon(socket_path, calculator)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, thread
+    server.shutdown()
+    server.server_close()
+    thread.join(5)
+
+
+def test_ping(daemon, socket_path, calculator):
+    client = DaemonClient(socket_path)
+    assert client.available()
+    status = client.ping()
+    assert status['pid'] == os.getpid() and status['backend'] == calculator.backend
+    assert status['models'] == calculator.usable_models()
+
+
+def test_calculate_matches_in_process(daemon, socket_path, calculator):
+    assert DaemonClient(socket_path).calculate_tokens(TEXT) == calculator.calculate_tokens(TEXT)
+    client = DaemonClient(socket_path, models=['bpe-small'])
+    assert client.calculate_tokens(TEXT) == {'bpe-small': calculator.calculate_tokens(TEXT)['bpe-small']}
+
+
+def test_stream_matches_full_count(daemon, socket_path, calculator):
+    chunks = [TEXT[i:i + 97] for i in range(0, len(TEXT), 97)]
+    results, chars = DaemonClient(socket_path).calculate_tokens_stream(iter(chunks))
+    assert chars == len(TEXT)
+    assert results == calculator.calculate_tokens_stream(iter(chunks))[0]
+
+
+@pytest.mark.parametrize('options', [
+    {'backend': 'no-such-backend'},
+    {'models': ['no-such-model']},
+], ids=['backend', 'models'])
+def test_unsupported_request(daemon, socket_path, options):
+    client = DaemonClient(socket_path, **options)
+    with pytest.raises(DaemonUnavailable):
+        client.calculate_tokens(TEXT)
+
+    # 流式计数先确认守护进程支持本次请求，此时文本块还没有被读取，调用方可以改为在进程内计算
+    consumed = []
+
+    def chunks():
+        consumed.append(True)
+        yield TEXT
+
+    with pytest.raises(DaemonUnavailable):
+        client.calculate_tokens_stream(chunks())
+    assert consumed == []
+
+
+def test_auto_backend_accepts_any_daemon(daemon, socket_path, calculator):
+    assert DaemonClient(socket_path, backend='auto').ping()['backend'] == calculator.backend
+    assert DaemonClient(socket_path, backend=calculator.backend).ping()['ok']
+
+
+def test_unknown_op(daemon, socket_path):
+    with pytest.raises(DaemonError, match='未知的操作'):
+        DaemonClient(socket_path)._request({'op': 'no-such-op'})
+
+
+def test_no_daemon(socket_path):
+    client = DaemonClient(socket_path)
+    assert not client.available()
+    with pytest.raises(DaemonUnavailable):
+        client.calculate_tokens(TEXT)
+
+    # 残留的套接字文件：文件存在但没有进程在监听
+    server = TokenDaemon(socket_path, None)
+    server.server_close()
+    assert client.available()
+    with pytest.raises(DaemonUnavailable):
+        client.ping()
+
+
+def test_shutdown(daemon, socket_path):
+    _, thread = daemon
+    DaemonClient(socket_path).shutdown()
+    thread.join(5)
+    assert not thread.is_alive()
@@ -0,0 +1,94 @@
+"""词表显示表：查表结果与逐个token调用decode一致（中文、英文、代码样本）
+
+总是使用tests/fixtures/tokenizers中的小型tokenizer；另外检查环境变量TOKENIZERS_DIR
+（未设置时为项目下的tokenizers/）中的真实模型，目录不存在时只跳过这部分。
+"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+from calculate_tokens import VocabDisplayTable
+from tokenizer_backends import BACKEND_TOKENIZERS, BACKEND_TRANSFORMERS, is_available, load_backend
+
+
+FIXTURE_DIR = Path(__file__).resolve().parent / 'fixtures' / 'tokenizers'
+TOKENIZERS_DIR = Path(os.environ.get('TOKENIZERS_DIR') or Path(__file__).resolve().parent.parent / 'tokenizers')
+
+SAMPLES = {
+    'chinese': '大语言模型按token计费，同一段中文在不同tokenizer下的token数量可能相差很大。𠮷野家🍜、全角标点「」——还有繁體字。',
+    'english': 'The quick brown fox jumps over the lazy dog. Tokenizers split words like "unbelievably" into sub-word '
+               "pieces , don't they ?",
+    'code': 'def fib(n: int) -> int:\n    """Return the n-th Fibonacci number."""\n'
+            '    return n if n < 2 else fib(n - 1) + fib(n - 2)\n\n\tprint({"k": [1, 2.5e-3]})  # 注释\r\n',
+}
+
+
+def _model_dirs(root: Path):
+    if not root.is_dir():
+        return []
+    return sorted(item for item in root.iterdir()
+                  if item.is_dir() and not item.name.startswith('.')
+                  and ((item / 'tokenizer.json').exists() or (item / 'tokenizer_config.json').exists()))
+
+
+MODEL_DIRS = _model_dirs(FIXTURE_DIR) + _model_dirs(TOKENIZERS_DIR)
+
+
+def _load(model_dir: Path, backend: str):
+    if not is_available(backend):
+        pytest.skip(f'未安装{backend}')
+    if backend == BACKEND_TOKENIZERS and not (model_dir / 'tokenizer.json').exists():
+        pytest.skip('没有tokenizer.json')
+    return load_backend(str(model_dir), local=True, backend=backend)
+
+
+@pytest.mark.parametrize('backend', [BACKEND_TOKENIZERS, BACKEND_TRANSFORMERS])
+@pytest.mark.parametrize('model_dir', MODEL_DIRS, ids=[item.name for item in MODEL_DIRS])
+def test_lookup_matches_decode_one(model_dir, backend):
+    tokenizer = _load(model_dir, backend)
+    table = VocabDisplayTable.build(tokenizer)
+    assert len(table) == len(tokenizer)
+
+    for name, text in SAMPLES.items():
+        token_ids, _ = tokenizer.encode(text)
+        assert token_ids, name
+        expected = [tokenizer.decode_one(token_id) for token_id in token_ids]
+        assert table.lookup(token_ids) == expected, name
+        assert [table[token_id] for token_id in token_ids] == expected, name
+
+    # 词表两端的ID（通常是特殊token与最后添加的token）
+    edge_ids = [0, len(tokenizer) - 1]
+    assert table.lookup(edge_ids) == [tokenizer.decode_one(token_id) for token_id in edge_ids]
+
+
+@pytest.mark.skipif(not is_available(BACKEND_TRANSFORMERS), reason='未安装transformers')
+def test_transformers_cleanup_falls_back_to_per_id_decode():
+    # bpe-small开启了clean_up_tokenization_spaces，逐个decode会把" ,"清理为","
+    tokenizer = _load(FIXTURE_DIR / 'bpe-small', BACKEND_TRANSFORMERS)
+    assert not tokenizer._plain_decode()
+    # 较新的transformers默认跳过BPE的清理，强制开启以便出现与Rust端解码不同的ID
+    tokenizer.tokenizer.clean_up_tokenization_spaces_for_bpe_even_though_it_will_corrupt_output = True
+    raw = tokenizer.tokenizer.backend_tokenizer.decode_batch([[i] for i in range(len(tokenizer))],
+                                                             skip_special_tokens=False)
+    expected = [tokenizer.decode_one(i) for i in range(len(tokenizer))]
+    assert raw != expected
+
+    table = VocabDisplayTable.build(tokenizer)
+    assert table.lookup(list(range(len(tokenizer)))) == expected
+
+
+@pytest.mark.skipif(not is_available(BACKEND_TRANSFORMERS), reason='未安装transformers')
+def test_transformers_plain_decode_uses_backend():
+    tokenizer = _load(FIXTURE_DIR / 'bpe-chatml', BACKEND_TRANSFORMERS)
+    assert tokenizer._plain_decode()
+
+    class CustomDecode(type(tokenizer.tokenizer)):
+        def _decode(self, *args, **kwargs):
+            return super()._decode(*args, **kwargs).upper()
+
+    tokenizer.tokenizer.__class__ = CustomDecode
+    assert not tokenizer._plain_decode()
+    table = VocabDisplayTable.build(tokenizer)
+    assert table.lookup(list(range(len(tokenizer)))) == [tokenizer.decode_one(i) for i in range(len(tokenizer))]
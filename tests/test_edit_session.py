@@ -0,0 +1,168 @@
+"""增量编码会话：随机编辑后的token ID和数量与整体编码一致，以及/api/session的版本冲突与过期"""
+
+import functools
+import random
+import types
+
+import pytest
+
+import edit_session
+import token_store as token_store_module
+from edit_session import EditError, EditSession, VersionConflict
+
+
+# 中文、码点超出BMP的字符（UTF-16中为代理对）、英文单词、空格和换行
+PIECES = ['编码', '会话', '𠮷', '🍜', '👨‍👩‍👧', 'token', 'edit', ' ', '  ', '\n', '\n\n', '，', '。', 'x=1;', '\t']
+
+
+def _random_text(rng, pieces):
+    return ''.join(rng.choice(PIECES) for _ in range(pieces))
+
+
+@pytest.fixture
+def small_segments(monkeypatch):
+    """把片段缩小到32个字符，少量文本就能覆盖跨片段的编辑"""
+    monkeypatch.setattr(edit_session, 'split_segments',
+                        functools.partial(edit_session.split_segments, segment_chars=32))
+
+
+def _assert_matches_full_encode(session, calculator, text):
+    assert session.text == text
+    # 片段边界不必与重新切分的结果相同，但必须从0开始、严格递增
+    assert session.starts == sorted(set(session.starts)) and session.starts[:1] == ([0] if text else [])
+    assert all(0 <= start < len(text) for start in session.starts)
+    encodings = session.encodings()
+    for model_key in calculator.models:
+        full = calculator.encode(text, model_key, use_cache=False)
+        assert list(encodings[model_key].ids) == list(full.ids)
+        assert session.counts[model_key] == full.count
+
+
+def _random_edit(rng, starts, text):
+    if starts and rng.random() < 0.3:
+        # 在片段边界附近编辑
+        offset = min(len(text), max(0, rng.choice(starts) + rng.randint(-2, 2)))
+    else:
+        offset = rng.randint(0, len(text))
+    kind = rng.choice(['insert', 'delete', 'replace'])
+    delete = rng.randint(1, min(40, len(text) - offset)) if kind != 'insert' and offset < len(text) else 0
+    insert = _random_text(rng, rng.randint(1, 8)) if kind != 'delete' else ''
+    return {'offset': offset, 'delete': delete, 'insert': insert}
+
+
+def _apply(text, edit):
+    return text[:edit['offset']] + edit['insert'] + text[edit['offset'] + edit['delete']:]
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_random_edits_match_full_encode(calculator, small_segments, seed):
+    rng = random.Random(seed)
+    text = _random_text(rng, 150)
+    session = EditSession(calculator, text, calculator.models)
+    _assert_matches_full_encode(session, calculator, text)
+    for version in range(1, 61):
+        # 偶尔一次提交多项编辑，每项的位置基于前一项执行后的文本
+        edits = []
+        for _ in range(rng.choice([1, 1, 1, 3])):
+            # 片段边界只对第一项有意义
+            edit = _random_edit(rng, [] if edits else session.starts, text)
+            edits.append(edit)
+            text = _apply(text, edit)
+        assert session.edit(edits, version - 1) == version
+        _assert_matches_full_encode(session, calculator, text)
+
+
+def test_edits_without_safe_split_points(calculator, small_segments):
+    # 没有换行和空格时片段不会被硬切分，而是变长
+    text = '长段中文没有任何空白字符𠮷🍜' * 20
+    session = EditSession(calculator, text, calculator.models)
+    assert session.starts == [0]
+    for edit in [{'offset': 100, 'delete': 0, 'insert': '\n换行'}, {'offset': 50, 'delete': 3, 'insert': ' '},
+                 {'offset': 0, 'delete': 60, 'insert': ''}, {'offset': 0, 'delete': 0, 'insert': '开头\n'}]:
+        text = _apply(text, edit)
+        session.edit([edit])
+        _assert_matches_full_encode(session, calculator, text)
+
+
+def test_edit_to_and_from_empty_text(calculator, small_segments):
+    session = EditSession(calculator, '', calculator.models)
+    _assert_matches_full_encode(session, calculator, '')
+    text = 'from empty\n文本'
+    session.edit([{'offset': 0, 'insert': text}])
+    _assert_matches_full_encode(session, calculator, text)
+    session.edit([{'offset': 0, 'delete': len(text)}])
+    _assert_matches_full_encode(session, calculator, '')
+
+
+def test_invalid_edits_leave_session_unchanged(calculator):
+    session = EditSession(calculator, 'hello 世界', calculator.models)
+    counts = dict(session.counts)
+    with pytest.raises(VersionConflict):
+        session.edit([{'offset': 0, 'insert': 'x'}], version=3)
+    # 第一项合法、第二项超出范围时整组都不执行
+    with pytest.raises(EditError):
+        session.edit([{'offset': 0, 'insert': 'x'}, {'offset': 20, 'delete': 1}])
+    with pytest.raises(EditError):
+        session.edit([{'offset': 0, 'insert': 1}])
+    assert session.text == 'hello 世界' and session.version == 0 and session.counts == counts
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """会话暂存区的时钟（SessionStore沿用TokenStore的过期逻辑）"""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(token_store_module, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def _counts(data):
+    return {item['model']: item['token_count'] for item in data['results']}
+
+
+def test_session_api(client, calculator):
+    text = '第一行\nsecond line'
+    response = client.post('/api/session', json={'text': text})
+    data = response.get_json()
+    assert response.status_code == 200 and data['version'] == 0
+    assert _counts(data) == calculator.calculate_tokens(text)
+    session_id = data['session_id']
+
+    edit = {'offset': 3, 'delete': 1, 'insert': '🍜 '}
+    response = client.post(f'/api/session/{session_id}/edit', json={'version': 0, 'edits': [edit]})
+    data = response.get_json()
+    assert response.status_code == 200 and data['version'] == 1
+    assert _counts(data) == calculator.calculate_tokens(_apply(text, edit))
+
+
+def test_session_api_version_conflict(client):
+    session_id = client.post('/api/session', json={'text': 'abc'}).get_json()['session_id']
+    edits = [{'offset': 0, 'insert': 'x'}]
+    assert client.post(f'/api/session/{session_id}/edit', json={'version': 0, 'edits': edits}).status_code == 200
+    response = client.post(f'/api/session/{session_id}/edit', json={'version': 0, 'edits': edits})
+    data = response.get_json()
+    assert response.status_code == 409 and not data['success'] and data['version'] == 1
+    # 冲突的编辑没有执行
+    assert client.post(f'/api/session/{session_id}/edit', json={'version': 1, 'edits': []}).get_json()['text_length'] == 4
+
+
+def test_session_api_unknown_and_expired(client, clock):
+    edits = [{'offset': 0, 'insert': 'x'}]
+    assert client.post('/api/session/no-such-session/edit', json={'edits': edits}).status_code == 404
+
+    session_id = client.post('/api/session', json={'text': 'abc'}).get_json()['session_id']
+    clock.now += 500
+    assert client.post(f'/api/session/{session_id}/edit', json={'edits': edits}).status_code == 200
+    # 按最后一次访问计算过期时间（测试客户端的会话TTL为600秒）
+    clock.now += 601
+    response = client.post(f'/api/session/{session_id}/edit', json={'edits': edits})
+    assert response.status_code == 404 and not response.get_json()['success']
+
+
+@pytest.mark.parametrize('body', [
+    {'edits': 'x'},
+    {'edits': [{'offset': 0}], 'version': '1'},
+    {'edits': [{'offset': 99, 'delete': 1}]},
+])
+def test_session_api_invalid_edits(client, body):
+    session_id = client.post('/api/session', json={'text': 'abc'}).get_json()['session_id']
+    assert client.post(f'/api/session/{session_id}/edit', json=body).status_code == 400
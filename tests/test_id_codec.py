@@ -0,0 +1,86 @@
+"""token ID紧凑格式：base64/binary/msgpack往返，以及/api/calculate的Accept协商"""
+
+import base64
+from array import array
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+
+import id_codec
+from id_codec import (FORMAT_BINARY, FORMAT_JSON, FORMAT_MSGPACK, IDS_ENCODING_BASE64, decode_ids, ids_base64,
+                      iter_binary, negotiate, parse_binary)
+
+
+TEXT = 'compact ids 紧凑格式 🍜\n' * 10
+IDS = array('I', [0, 1, 255, 256, 65535, 65536, 2 ** 32 - 1])
+
+
+def test_base64_round_trip():
+    assert decode_ids(base64.b64decode(ids_base64(IDS))) == IDS
+    assert ids_base64(array('I')) == ''
+
+
+def test_binary_round_trip():
+    header = {'success': True, 'results': [{'model': 'a'}, {'model': 'empty'}, {'model': 'b'}]}
+    id_arrays = [IDS, None, array('I', [7, 8])]
+    data = b''.join(iter_binary(header, header['results'], id_arrays))
+    parsed_header, parsed_ids = parse_binary(data)
+    assert [item['ids_count'] for item in parsed_header['results']] == [len(IDS), 0, 2]
+    assert parsed_ids == [IDS, array('I'), array('I', [7, 8])]
+
+
+@pytest.mark.parametrize('accept, expected', [
+    (None, FORMAT_JSON),
+    ([('application/json', 1)], FORMAT_JSON),
+    ([('application/octet-stream', 1)], FORMAT_BINARY),
+    ([('application/json', 0.5), ('application/octet-stream', 1)], FORMAT_BINARY),
+    ([('text/html', 1)], FORMAT_JSON),
+])
+def test_negotiate(accept, expected):
+    assert negotiate(MIMEAccept(accept)) == expected
+
+
+def test_negotiate_msgpack_only_when_installed(monkeypatch):
+    accept = MIMEAccept([('application/msgpack', 1), ('application/json', 0.5)])
+    monkeypatch.setattr(id_codec, 'msgpack_available', lambda: False)
+    assert negotiate(accept) == FORMAT_JSON
+    monkeypatch.setattr(id_codec, 'msgpack_available', lambda: True)
+    assert negotiate(accept) == FORMAT_MSGPACK
+
+
+def _expected_ids(calculator):
+    return {model_key: calculator.encode(TEXT, model_key).ids for model_key in calculator.models}
+
+
+def test_calculate_json_ids(client, calculator):
+    response = client.post('/api/calculate', json={'text': TEXT})
+    assert 'ids' not in response.get_json()['results'][0]
+
+    response = client.post('/api/calculate', json={'text': TEXT, 'include_ids': True})
+    data = response.get_json()
+    assert data['ids_encoding'] == IDS_ENCODING_BASE64 and 'Accept' in response.headers['Vary']
+    expected = _expected_ids(calculator)
+    for item in data['results']:
+        assert decode_ids(base64.b64decode(item['ids'])) == expected[item['model']]
+        assert item['token_count'] == len(expected[item['model']])
+
+
+def test_calculate_binary_ids(client, calculator):
+    response = client.post('/api/calculate', json={'text': TEXT}, headers={'Accept': 'application/octet-stream'})
+    assert response.status_code == 200 and response.mimetype == 'application/octet-stream'
+    header, id_arrays = parse_binary(response.get_data())
+    assert header['success'] and header['text_length'] == len(TEXT)
+    expected = _expected_ids(calculator)
+    assert {item['model']: ids for item, ids in zip(header['results'], id_arrays)} == expected
+
+
+def test_calculate_msgpack_ids(client, calculator):
+    msgpack = pytest.importorskip('msgpack')
+    response = client.post('/api/calculate', json={'text': TEXT}, headers={'Accept': 'application/msgpack'})
+    assert response.mimetype == 'application/msgpack'
+    data = msgpack.unpackb(response.get_data(), raw=False)
+    expected = _expected_ids(calculator)
+    assert {item['model']: decode_ids(item['ids']) for item in data['results']} == expected
+    # JSON部分与普通响应相同
+    plain = client.post('/api/calculate', json={'text': TEXT}).get_json()
+    assert [item['token_count'] for item in data['results']] == [item['token_count'] for item in plain['results']]
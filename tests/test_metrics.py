@@ -0,0 +1,117 @@
+"""运行指标：按线程分片的计数器/直方图汇总（含已退出线程的合并），以及编码耗时的口径"""
+
+import threading
+import time
+
+import pytest
+
+import metrics
+from metrics import ENCODE_SECONDS, Counter, Histogram, MetricsRegistry
+
+
+def _run_threads(indexes, target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in indexes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_counter_merges_shards_across_threads(monkeypatch):
+    monkeypatch.setattr(metrics, 'COMPACT_EVERY', 4)
+    counter = Counter('test_total', 'test', ('model',))
+
+    def work(i):
+        for _ in range(100):
+            counter.inc(1, 'a')
+        counter.inc(i, 'b')
+
+    # 分两批运行，第二批新建分片时第一批线程已经退出，其分片被合并
+    _run_threads(range(4), work)
+    _run_threads(range(4, 10), work)
+    assert len(counter._shards) < 10 and counter._retired
+    counter.inc(5, 'a')
+    assert counter._snapshot() == {('a',): 1005, ('b',): 45}
+    # 导出时合并剩下的退出线程，只保留当前线程的分片，再次导出结果不变
+    assert [thread for thread, _ in counter._shards] == [threading.current_thread()]
+    assert counter._snapshot() == {('a',): 1005, ('b',): 45}
+    assert counter.render() == ['test_total{model="a"} 1005', 'test_total{model="b"} 45']
+
+
+def test_histogram_merges_buckets_sum_and_count(monkeypatch):
+    monkeypatch.setattr(metrics, 'COMPACT_EVERY', 3)
+    histogram = Histogram('test_seconds', 'test', (0.1, 1.0))
+    values = [0.05, 0.1, 0.5, 2.0]
+
+    def work(i):
+        for value in values:
+            histogram.observe(value)
+
+    _run_threads(range(4), work)
+    _run_threads(range(4, 8), work)
+    histogram.observe(0.5)
+    entry = histogram._snapshot()[()]
+    # 各桶计数（le=0.1、le=1、+Inf）、总和、样本数
+    assert entry[:3] == [16, 9, 8] and entry[-1] == 33
+    assert entry[-2] == pytest.approx(8 * sum(values) + 0.5)
+    lines = histogram.render()
+    assert lines[:3] == [
+        'test_seconds_bucket{le="0.1"} 16',
+        'test_seconds_bucket{le="1"} 25',
+        'test_seconds_bucket{le="+Inf"} 33',
+    ]
+    assert lines[3].startswith('test_seconds_sum ') and lines[4] == 'test_seconds_count 33'
+
+
+def test_registry_render_format():
+    registry = MetricsRegistry()
+    counter = registry.counter('requests_total', '请求数', ('endpoint',))
+    assert registry.counter('requests_total', '重复注册返回同一个指标') is counter
+    counter.inc(2, 'a"b')
+    registry.gauge('loaded', '已加载', function=lambda: {(): 3})
+    assert registry.render().splitlines() == [
+        '# HELP requests_total 请求数',
+        '# TYPE requests_total counter',
+        'requests_total{endpoint="a\\"b"} 2',
+        '# HELP loaded 已加载',
+        '# TYPE loaded gauge',
+        'loaded 3',
+    ]
+
+
+def _encode_samples(model_key):
+    entry = ENCODE_SECONDS._snapshot().get((model_key,))
+    return (entry[-1], entry[-2]) if entry else (0, 0.0)
+
+
+@pytest.mark.parametrize('batch_window_ms', [0, 5])
+def test_encode_seconds_one_sample_per_tokenizer_call(make_calculator, batch_window_ms):
+    calculator = make_calculator(batch_window_ms=batch_window_ms)
+    count, _ = _encode_samples('bpe-small')
+    calculator.encode('hello world', 'bpe-small')
+    assert _encode_samples('bpe-small')[0] == count + 1
+    calculator.encode_batch(['a', 'b', 'c'], 'bpe-small')
+    assert _encode_samples('bpe-small')[0] == count + 2
+
+
+@pytest.mark.parametrize('batch_window_ms', [0, 5])
+def test_encode_seconds_excludes_pool_wait(make_calculator, batch_window_ms):
+    calculator = make_calculator(pool_size=1, batch_window_ms=batch_window_ms)
+    pool = calculator.get_pool('bpe-chatml')
+    held = threading.Event()
+
+    def hold():
+        with pool.checkout():
+            held.set()
+            time.sleep(0.2)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait(5)
+    count, total = _encode_samples('bpe-chatml')
+    start = time.perf_counter()
+    calculator.encode('waiting for the only tokenizer instance', 'bpe-chatml')
+    assert time.perf_counter() - start >= 0.15
+    holder.join()
+    new_count, new_total = _encode_samples('bpe-chatml')
+    assert new_count == count + 1 and new_total - total < 0.1
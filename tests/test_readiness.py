@@ -0,0 +1,89 @@
+"""服务就绪状态：加载中/失败时快速返回503 + Retry-After，加载完成后区分healthy与degraded"""
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def app_state(monkeypatch):
+    """后台加载尚未完成的服务状态（不启动加载线程），返回_load_state"""
+    monkeypatch.setattr(app_module, '_calculator', None)
+    monkeypatch.setattr(app_module, '_loader_thread', object())
+    for key, value in {'status': 'loading', 'started_at': None, 'load_seconds': None, 'error': None}.items():
+        monkeypatch.setitem(app_module._load_state, key, value)
+    return app_module._load_state
+
+
+def test_loading_returns_503_with_retry_after(app_state):
+    client = app_module.app.test_client()
+    response = client.get('/api/health')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app_module.RETRY_AFTER_SECONDS)
+    data = response.get_json()
+    assert data['status'] == 'loading' and '加载' in data['message']
+    assert data['readiness']['model_load_seconds'] == {}
+
+    # 其他接口同样快速返回，错误信息在error字段
+    response = client.post('/api/calculate', json={'text': 'hello'})
+    assert response.status_code == 503 and response.headers['Retry-After']
+    assert response.get_json()['error']
+
+
+def test_load_error_returns_503(app_state):
+    app_state.update(status='error', error='boom')
+    response = app_module.app.test_client().get('/api/health')
+    assert response.status_code == 503 and response.headers['Retry-After']
+    data = response.get_json()
+    assert data['status'] == 'error' and 'boom' in data['message']
+
+
+def test_ready_is_healthy_or_degraded(client, calculator, monkeypatch):
+    data = client.get('/api/health').get_json()
+    assert data['status'] == 'healthy' and data['missing_models'] == []
+    assert data['loaded_models'] == calculator.models
+
+    monkeypatch.setitem(calculator.load_errors, 'broken', '无法加载')
+    response = client.get('/api/health')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'degraded'
+    assert response.get_json()['missing_models'] == ['broken']
+
+
+def _warm_up(monkeypatch, make_calculator, **options):
+    monkeypatch.setattr(app_module, '_create_calculator', lambda: make_calculator(lazy=True, **options))
+    monkeypatch.setitem(app_module.app.config, 'TOKENIZER_PRELOAD', True)
+    app_module._warm_up()
+    return app_module._calculator
+
+
+def test_warm_up_preloads_shared_tokenizer_once(app_state, monkeypatch, make_calculator, copy_tokenizer):
+    copy_tokenizer('model-a')
+    root = copy_tokenizer('model-b')
+    calculator = _warm_up(monkeypatch, make_calculator, tokenizers_dir=str(root))
+    assert app_state['status'] == 'ready' and app_state['load_seconds'] is not None
+    assert calculator.registry_stats()['loaded_instances'] == 1
+    assert set(app_module.readiness_info()['model_load_seconds']) == {'model-a', 'model-b'}
+    assert app_module.app.test_client().get('/api/health').get_json()['status'] == 'healthy'
+
+
+def test_warm_up_with_broken_tokenizer_is_degraded(app_state, monkeypatch, make_calculator, copy_tokenizer):
+    copy_tokenizer('model-a')
+    root = copy_tokenizer('broken')
+    (root / 'broken' / 'tokenizer.json').write_text('not a tokenizer', encoding='utf-8')
+    calculator = _warm_up(monkeypatch, make_calculator, tokenizers_dir=str(root))
+    assert app_state['status'] == 'degraded'
+    assert list(calculator.load_errors) == ['broken'] and calculator.usable_models() == ['model-a']
+    data = app_module.app.test_client().get('/api/health').get_json()
+    assert data['status'] == 'degraded' and data['missing_models'] == ['broken']
+
+
+def test_warm_up_failure_is_error(app_state, monkeypatch):
+    def fail():
+        raise SystemExit('缺少tokenizers库')
+
+    monkeypatch.setattr(app_module, '_create_calculator', fail)
+    app_module._warm_up()
+    assert app_state['status'] == 'error' and app_state['error'] == '缺少tokenizers库'
+    response = app_module.app.test_client().get('/api/health')
+    assert response.status_code == 503 and '缺少tokenizers库' in response.get_json()['message']
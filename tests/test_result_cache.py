@@ -0,0 +1,69 @@
+"""ResultCache：LRU顺序与字节预算淘汰，以及TokenCalculator中的缓存命中"""
+
+from result_cache import ENTRY_OVERHEAD_BYTES, ResultCache, text_digest
+
+
+def test_get_put_and_stats():
+    cache = ResultCache(10 * 1024)
+    assert cache.get('a') is None
+    cache.put('a', 'value-a', 100)
+    assert cache.get('a') == 'value-a'
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 1, 1)
+    assert stats['bytes'] == 100 + ENTRY_OVERHEAD_BYTES
+    assert stats['hit_rate'] == 0.5
+
+
+def test_evicts_least_recently_used_within_byte_budget():
+    entry = 100 + ENTRY_OVERHEAD_BYTES
+    cache = ResultCache(2 * entry)
+    cache.put('a', 1, 100)
+    cache.put('b', 2, 100)
+    # 读取a后，b成为最久未使用的条目
+    assert cache.get('a') == 1
+    cache.put('c', 3, 100)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.evictions == 1
+    assert cache.current_bytes == 2 * entry <= cache.max_bytes
+
+    # 一个大条目淘汰多个小条目
+    cache.put('big', 4, 2 * entry - ENTRY_OVERHEAD_BYTES - 1)
+    assert cache.get('a') is None and cache.get('c') is None
+    assert cache.current_bytes <= cache.max_bytes
+
+
+def test_oversized_value_is_not_cached_and_replace_updates_size():
+    cache = ResultCache(1000)
+    cache.put('huge', 'x', 1000)
+    assert cache.get('huge') is None and cache.current_bytes == 0
+
+    cache.put('k', 'small', 10)
+    cache.put('k', 'larger', 200)
+    assert cache.get('k') == 'larger'
+    assert cache.current_bytes == 200 + ENTRY_OVERHEAD_BYTES
+    cache.clear()
+    assert cache.stats()['entries'] == 0 and cache.current_bytes == 0
+
+
+def test_text_digest_distinguishes_texts():
+    assert text_digest('abc') == text_digest('abc')
+    assert text_digest('abc') != text_digest('abd')
+    # 孤立的代理字符也能计算摘要
+    assert text_digest('\ud800')
+
+
+def test_calculator_reuses_cached_encodings(make_calculator):
+    calculator = make_calculator(cache_bytes=1024 * 1024)
+    text = '缓存命中时不再编码 cached text'
+    first = calculator.encode(text, 'bpe-chatml')
+    assert calculator.encode(text, 'bpe-chatml') is first
+    # 需要偏移时不能使用不带偏移的缓存结果
+    with_offsets = calculator.encode(text, 'bpe-chatml', return_offsets=True)
+    assert with_offsets is not first and with_offsets.offsets is not None
+    assert with_offsets.ids == first.ids
+    # use_cache=False不读缓存
+    assert calculator.encode(text, 'bpe-chatml', use_cache=False) is not with_offsets
+    # 不同tokenizer的结果分开缓存
+    assert calculator.encode(text, 'bpe-small').ids != first.ids
+    assert calculator.cache.stats()['hits'] >= 1
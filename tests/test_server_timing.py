@@ -0,0 +1,75 @@
+"""请求耗时：Server-Timing响应头、timings字段、慢请求日志与/metrics"""
+
+import re
+
+from metrics import RequestTimings
+
+
+TEXT = 'Server-Timing 请求耗时 breakdown\n' * 10
+
+
+def _server_timing(header):
+    """解析Server-Timing头为 名称 -> (毫秒, desc)"""
+    entries = {}
+    for entry in header.split(', '):
+        name, *params = entry.split(';')
+        fields = dict(param.split('=', 1) for param in params)
+        entries[name] = (float(fields['dur']), fields.get('desc'))
+    return entries
+
+
+def test_request_timings_format():
+    timings = RequestTimings()
+    timings.lap('read body')
+    timings.lap('encode')
+    timings.add_models({'org/model:v1': 0.0125})
+    entries = _server_timing(timings.server_timing())
+    # 名称中不允许的字符替换为下划线，模型名放在desc中
+    assert list(entries) == ['read_body', 'encode', 'model-org_model_v1', 'total']
+    assert entries['model-org_model_v1'] == (12.5, '"org/model:v1"')
+    breakdown = timings.as_dict()
+    assert list(breakdown['phases_ms']) == ['read body', 'encode']
+    assert breakdown['models_ms'] == {'org/model:v1': 12.5}
+    assert breakdown['total_ms'] >= sum(breakdown['phases_ms'].values())
+
+
+def test_calculate_server_timing_header(client, calculator):
+    response = client.post('/api/calculate', json={'text': TEXT, 'timings': True})
+    entries = _server_timing(response.headers['Server-Timing'])
+    phases = [name for name in entries if not name.startswith('model-') and name != 'total']
+    assert phases == ['upload', 'decode', 'prepare', 'encode', 'store', 'results', 'serialize']
+    assert {name for name in entries if name.startswith('model-')} == {f'model-{m}' for m in calculator.models}
+    assert entries['total'][0] >= sum(entries[name][0] for name in phases)
+
+    # 响应中的timings不含序列化本身（JSON响应的键已排序）
+    timings = response.get_json()['timings']
+    assert sorted(timings['phases_ms']) == sorted(phases[:-1])
+    assert set(timings['models_ms']) == set(calculator.models)
+
+
+def test_every_response_has_server_timing(client):
+    assert 'total;dur=' in client.get('/api/health').headers['Server-Timing']
+    response = client.post('/api/calculate', json={'text': ''})
+    assert response.status_code == 400 and 'total;dur=' in response.headers['Server-Timing']
+
+
+def test_slow_request_log(client, capsys, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setitem(app_module.app.config, 'SLOW_REQUEST_MS', 1e-6)
+    client.post('/api/calculate', json={'text': TEXT})
+    out = capsys.readouterr().out
+    assert re.search(r'\[慢请求\] POST /api/calculate 200 [\d.]+ms 请求体=\d+字节 chars=' + str(len(TEXT)), out)
+
+    monkeypatch.setitem(app_module.app.config, 'SLOW_REQUEST_MS', 0)
+    client.post('/api/calculate', json={'text': TEXT})
+    assert '[慢请求]' not in capsys.readouterr().out
+
+
+def test_metrics_record_requests(client):
+    client.post('/api/calculate', json={'text': TEXT})
+    body = client.get('/metrics').get_data(as_text=True)
+    assert re.search(r'http_request_duration_seconds_count\{endpoint="/api/calculate",status="200"\} [1-9]', body)
+    assert re.search(r'http_request_bytes_count\{endpoint="/api/calculate"\} [1-9]', body)
+    assert re.search(r'token_encode_seconds_count\{model="bpe-chatml"\} [1-9]', body)
+    assert 'tokenizer_estimated_bytes{model="bpe-chatml"}' in body
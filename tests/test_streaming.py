@@ -0,0 +1,68 @@
+"""流式计数：iter_text_chunks分块后的总数与整体编码一致"""
+
+import io
+import random
+
+import pytest
+
+import calculate_tokens
+from calculate_tokens import iter_text_chunks
+
+
+def _ascii_text(rng: random.Random) -> str:
+    words = ['token', 'stream', 'chunk', 'split', 'the', 'a', 'count', 'encode', '42', 'x=1;', '(f)', "don't"]
+    lines = []
+    for _ in range(400):
+        indent = ' ' * rng.choice([0, 0, 2, 4])
+        lines.append(indent + ' '.join(rng.choice(words) for _ in range(rng.randint(1, 15))))
+    return '\n'.join(lines) + '\n'
+
+
+def _cjk_text(rng: random.Random, newline_every: int) -> str:
+    """不含空格的中文，每newline_every个字符左右换行一次（0表示不换行）"""
+    chars = [chr(rng.randint(0x4e00, 0x4fff)) if rng.random() < 0.9 else rng.choice('，。、「」') for _ in range(12000)]
+    if newline_every:
+        for pos in range(newline_every, len(chars), newline_every):
+            chars[pos] = '\n'
+    return ''.join(chars)
+
+
+@pytest.fixture
+def small_buffers(monkeypatch):
+    """缩小搜索窗口和缓冲区上限，用几万字符的文本覆盖多次切分"""
+    monkeypatch.setattr(calculate_tokens, 'SAFE_SPLIT_WINDOW', 200)
+    monkeypatch.setattr(calculate_tokens, 'MAX_CARRY_CHARS', 4000)
+
+
+def _stream_total(calculator, text, model_key, chunk_size=1000):
+    chunks = list(iter_text_chunks(io.StringIO(text), chunk_size))
+    assert ''.join(chunks) == text
+    totals, char_count = calculator.calculate_tokens_stream(chunks, [model_key])
+    assert char_count == len(text)
+    return totals[model_key], chunks
+
+
+@pytest.mark.parametrize('model_key', ['bpe-chatml', 'bpe-small'])
+def test_ascii_stream_matches_full_encode(calculator, small_buffers, model_key):
+    text = _ascii_text(random.Random(1))
+    total, chunks = _stream_total(calculator, text, model_key)
+    assert len(chunks) > 10
+    assert total == calculator.encode(text, model_key).count
+
+
+@pytest.mark.parametrize('model_key', ['bpe-chatml', 'bpe-small'])
+def test_cjk_without_spaces_splits_at_newlines(calculator, small_buffers, model_key):
+    # 换行间隔大于搜索窗口，只能在缓冲区满时搜索整个缓冲区找到
+    text = _cjk_text(random.Random(2), newline_every=1500)
+    total, chunks = _stream_total(calculator, text, model_key)
+    assert all(chunk.endswith('\n') for chunk in chunks[:-1])
+    assert total == calculator.encode(text, model_key).count
+
+
+@pytest.mark.parametrize('model_key', ['bpe-chatml', 'bpe-small'])
+def test_hard_split_error_is_small(calculator, small_buffers, model_key):
+    text = _cjk_text(random.Random(3), newline_every=0)
+    total, chunks = _stream_total(calculator, text, model_key)
+    hard_splits = len(chunks) - 1
+    assert hard_splits == len(text) // 4000 - (len(text) % 4000 == 0)
+    assert abs(total - calculator.encode(text, model_key).count) <= 2 * hard_splits
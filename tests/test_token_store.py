@@ -0,0 +1,96 @@
+"""编码结果暂存区：TTL过期、字节预算淘汰，以及/api/tokens分页读取"""
+
+import types
+
+import pytest
+
+import token_store as token_store_module
+from token_store import ENTRY_OVERHEAD_BYTES, TokenStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(token_store_module, 'time', types.SimpleNamespace(monotonic=fake.monotonic))
+    return fake
+
+
+def _encoding(nbytes):
+    return types.SimpleNamespace(nbytes=nbytes)
+
+
+def test_entries_expire_after_last_access(clock):
+    store = TokenStore(ttl_seconds=60, max_bytes=1 << 20)
+    handle = store.put({'m': _encoding(100)})
+    clock.now += 50
+    assert store.get(handle) is not None
+    # 读取后重新计时
+    clock.now += 50
+    assert store.get(handle) is not None
+    clock.now += 61
+    assert store.get(handle) is None
+    stats = store.stats()
+    assert (stats['entries'], stats['bytes'], stats['expirations']) == (0, 0, 1)
+
+
+def test_byte_budget_evicts_least_recently_used(clock):
+    entry = 1000 + ENTRY_OVERHEAD_BYTES
+    store = TokenStore(ttl_seconds=60, max_bytes=2 * entry)
+    first = store.put({'m': _encoding(1000)})
+    second = store.put({'m': _encoding(1000)})
+    assert store.get(first) is not None
+    third = store.put({'m': _encoding(1000)})
+    assert store.get(second) is None
+    assert store.get(first) is not None and store.get(third) is not None
+    assert store.evictions == 1 and store.current_bytes == 2 * entry
+
+    # 共享的编码结果只计算一次；超过整个预算的结果不暂存
+    shared = _encoding(1000)
+    assert store._size_of({'a': shared, 'b': shared, 'c': None}) == entry
+    assert store.put({'m': _encoding(2 * entry)}) is None
+
+    # 原地修改后变大，淘汰其他条目而不是自己
+    store.resize(third, {'m': _encoding(1500)})
+    assert store.get(third) is not None and store.get(first) is None
+    assert store.current_bytes == 1500 + ENTRY_OVERHEAD_BYTES
+
+
+TEXT = 'paging through tokens 分页读取token ' * 20
+
+
+def test_api_tokens_pages(client, calculator):
+    data = client.post('/api/calculate', json={'text': TEXT}).get_json()
+    handle = data['tokens_id']
+    ids = calculator.encode(TEXT, 'bpe-chatml').ids.tolist()
+    pages = []
+    offset = 0
+    while offset < len(ids):
+        page = client.get(f'/api/tokens?id={handle}&model=bpe-chatml&offset={offset}&limit=7').get_json()
+        assert page['success'] and page['total_tokens'] == len(ids) and page['offset'] == offset
+        assert page['tokens'] == [calculator.tokenizers['bpe-chatml'].decode_one(i) for i in page['ids']]
+        pages.append(page['ids'])
+        offset += 7
+    assert sum(pages, []) == ids and all(len(page) == 7 for page in pages[:-1])
+
+    past_end = client.get(f'/api/tokens?id={handle}&model=bpe-chatml&offset={len(ids)}').get_json()
+    assert past_end['ids'] == [] and past_end['tokens'] == []
+    assert client.get(f'/api/tokens?id={handle}&model=bpe-chatml&offset=-1').status_code == 400
+    assert client.get(f'/api/tokens?id={handle}&model=bpe-chatml&limit=x').status_code == 400
+    assert client.get(f'/api/tokens?id={handle}&model=no-such-model').status_code == 404
+
+
+def test_api_tokens_404_after_expiry(client, clock):
+    handle = client.post('/api/calculate', json={'text': TEXT}).get_json()['tokens_id']
+    assert client.get(f'/api/tokens?id={handle}&model=bpe-small').status_code == 200
+    clock.now += 601
+    response = client.get(f'/api/tokens?id={handle}&model=bpe-small')
+    assert response.status_code == 404 and not response.get_json()['success']
+    assert client.get('/api/tokens?id=unknown&model=bpe-small').status_code == 404
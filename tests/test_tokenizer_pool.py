@@ -0,0 +1,155 @@
+"""tokenizer实例池：多线程并发编码的结果与单线程一致，实例不会被同时借出，实例数不超过上限"""
+
+import random
+import threading
+import time
+
+import pytest
+
+from tokenizer_backends import BACKEND_TOKENIZERS, BACKEND_TRANSFORMERS, is_available, load_backend
+from tokenizer_pool import TokenizerPool
+
+
+THREADS = 12
+ROUNDS = 20
+
+
+def _texts():
+    rng = random.Random(0)
+    words = ['并发', '编码', 'thread', 'pool', 'tokenizer', '🍜', 'x = 1;', '\n']
+    return [''.join(rng.choice(words) for _ in range(rng.randint(1, 200))) for _ in range(32)]
+
+
+class UsageTracker:
+    """包装后端的encode/encode_batch，记录同时在用的实例"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_use = set()
+        self.max_concurrent = 0
+        self.shared_use = 0
+
+    def wrap(self, monkeypatch, backend_class):
+        tracker = self
+
+        def tracked(original):
+            def call(self, *args, **kwargs):
+                with tracker.lock:
+                    if id(self) in tracker.in_use:
+                        tracker.shared_use += 1
+                    tracker.in_use.add(id(self))
+                    tracker.max_concurrent = max(tracker.max_concurrent, len(tracker.in_use))
+                try:
+                    # 让出CPU，增加线程交错的机会
+                    time.sleep(0.0005)
+                    return original(self, *args, **kwargs)
+                finally:
+                    with tracker.lock:
+                        tracker.in_use.discard(id(self))
+            return call
+
+        monkeypatch.setattr(backend_class, 'encode', tracked(backend_class.encode))
+        monkeypatch.setattr(backend_class, 'encode_batch', tracked(backend_class.encode_batch))
+
+
+def _run_concurrently(work):
+    errors = []
+    barrier = threading.Barrier(THREADS)
+
+    def run(index):
+        try:
+            barrier.wait()
+            work(index)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    assert not any(thread.is_alive() for thread in threads)
+    return errors
+
+
+@pytest.mark.parametrize('backend', [BACKEND_TOKENIZERS, BACKEND_TRANSFORMERS])
+@pytest.mark.parametrize('batch_window_ms', [0, 2])
+def test_concurrent_encode_matches_serial(make_calculator, monkeypatch, backend, batch_window_ms):
+    if not is_available(backend):
+        pytest.skip(f'未安装{backend}')
+    calculator = make_calculator(backend=backend, pool_size=3, batch_window_ms=batch_window_ms)
+    texts = _texts()
+    expected = {m: [calculator.encode(text, m, use_cache=False).ids for text in texts] for m in calculator.models}
+
+    tracker = UsageTracker()
+    tracker.wrap(monkeypatch, type(calculator.tokenizers['bpe-chatml']))
+    mismatches = []
+
+    def work(index):
+        rng = random.Random(index)
+        for _ in range(ROUNDS):
+            model_key = rng.choice(calculator.models)
+            if rng.random() < 0.2:
+                batch = rng.sample(range(len(texts)), 4)
+                results = calculator.encode_batch([texts[i] for i in batch], model_key, use_cache=False)
+                pairs = zip(batch, results)
+            else:
+                i = rng.randrange(len(texts))
+                pairs = [(i, calculator.encode(texts[i], model_key, use_cache=False))]
+            for i, result in pairs:
+                if result.ids != expected[model_key][i]:
+                    mismatches.append((model_key, i))
+
+    assert _run_concurrently(work) == []
+    assert mismatches == []
+    assert tracker.shared_use == 0
+    for model_key in calculator.models:
+        pool = calculator.pools[model_key]
+        assert pool.size <= pool.max_size == 3 and pool.stats()['idle'] == pool.size
+    # 两个模型各自的实例池，同时在用的实例不超过两个池的上限之和
+    assert tracker.max_concurrent <= 2 * 3
+
+
+def test_pool_bound_with_slow_tokenizer(tokenizers_dir):
+    pool = TokenizerPool(load_backend(str(tokenizers_dir / 'bpe-small'), local=True), max_size=2)
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def work(index):
+        for _ in range(5):
+            with pool.checkout() as tokenizer:
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active[1], active[0])
+                tokenizer.encode('slow')
+                time.sleep(0.002)
+                with lock:
+                    active[0] -= 1
+
+    assert _run_concurrently(work) == []
+    assert active[1] == 2 and pool.size == 2
+    stats = pool.stats()
+    assert stats['checkouts'] == THREADS * 5 and stats['waits'] > 0 and stats['idle'] == 2
+
+
+def test_clone_failure_falls_back_to_waiting(tokenizers_dir, monkeypatch):
+    prototype = load_backend(str(tokenizers_dir / 'bpe-small'), local=True)
+
+    def fail():
+        raise RuntimeError('clone failed')
+
+    monkeypatch.setattr(prototype, 'clone', fail)
+    pool = TokenizerPool(prototype, max_size=4)
+    expected = prototype.encode('clone failure')[0]
+    results = []
+
+    def work(index):
+        for _ in range(3):
+            with pool.checkout() as tokenizer:
+                assert tokenizer is prototype
+                results.append(tokenizer.encode('clone failure')[0])
+                time.sleep(0.001)
+
+    assert _run_concurrently(work) == []
+    assert results == [expected] * THREADS * 3
+    assert pool.size == 1 and pool.max_size == 1 and pool.stats()['clone_errors'] >= 1
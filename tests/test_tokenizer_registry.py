@@ -0,0 +1,110 @@
+"""tokenizer注册表：按指纹去重共享实例，延迟加载与内存预算下的淘汰"""
+
+import pytest
+
+import calculate_tokens
+from tokenizer_backends import BACKEND_TOKENIZERS
+
+
+OTHER_TEMPLATE = "{% for message in messages %}{{ message['role'] + ': ' + message['content'] + '\\n' }}{% endfor %}"
+
+
+def test_identical_local_tokenizers_share_instance(make_calculator, copy_tokenizer):
+    copy_tokenizer('model-a')
+    copy_tokenizer('model-b')
+    root = copy_tokenizer('model-c', chat_template=OTHER_TEMPLATE)
+    calculator = make_calculator(tokenizers_dir=str(root))
+    assert calculator.models == ['model-a', 'model-b', 'model-c']
+    assert calculator.tokenizers['model-a'] is calculator.tokenizers['model-b']
+    assert calculator.pools['model-a'] is calculator.pools['model-b']
+    # tokenizer.json相同但chat template不同，不能共享
+    assert calculator.tokenizers['model-c'] is not calculator.tokenizers['model-a']
+    assert calculator.fingerprints['model-c'] != calculator.fingerprints['model-a']
+    assert calculator.registry_stats()['loaded_instances'] == 2
+
+
+@pytest.fixture
+def hub(monkeypatch, copy_tokenizer):
+    """在线模式：MODELS指向假的Hub仓库，hf_hub_download从临时目录返回文件"""
+    import huggingface_hub
+    from huggingface_hub.utils import LocalEntryNotFoundError
+
+    copy_tokenizer('same-a')
+    copy_tokenizer('same-b')
+    copy_tokenizer('other-template', chat_template=OTHER_TEMPLATE)
+    copy_tokenizer('other-eos', eos_token='<|endoftext|>')
+    root = copy_tokenizer('other-settings', clean_up_tokenization_spaces=True)
+    models = {name: f'org/{name}' for name in ['same-a', 'same-b', 'other-template', 'other-eos', 'other-settings']}
+
+    def hf_hub_download(repo_id, filename, **kwargs):
+        path = root / repo_id.split('/', 1)[1] / filename
+        if not path.exists():
+            raise LocalEntryNotFoundError(f'{repo_id}/{filename}')
+        return str(path)
+
+    monkeypatch.setattr(calculate_tokens, 'MODELS', models)
+    monkeypatch.setattr(huggingface_hub, 'hf_hub_download', hf_hub_download)
+    return models
+
+
+def test_online_fingerprint_includes_config_template_and_special_tokens(make_calculator, hub):
+    calculator = make_calculator(local_mode=False, backend=BACKEND_TOKENIZERS)
+    assert calculator.models == list(hub)
+    fingerprints = calculator.fingerprints
+    assert fingerprints['same-a'] == fingerprints['same-b']
+    assert calculator.tokenizers['same-a'] is calculator.tokenizers['same-b']
+    # 只有tokenizer.json相同时不共享
+    others = [fingerprints[name] for name in ['same-a', 'other-template', 'other-eos', 'other-settings']]
+    assert len(set(others)) == 4
+    assert calculator.tokenizers['other-template'].chat_template() == OTHER_TEMPLATE
+    assert calculator.tokenizers['other-eos'].special_tokens()['eos_token'] == '<|endoftext|>'
+
+
+@pytest.fixture
+def load_calls(monkeypatch):
+    """记录实际加载tokenizer的目录"""
+    calls = []
+    original = calculate_tokens.load_backend
+
+    def load_backend(source, local, backend):
+        calls.append(source.rsplit('/', 1)[-1])
+        return original(source, local, backend)
+
+    monkeypatch.setattr(calculate_tokens, 'load_backend', load_backend)
+    return calls
+
+
+def test_lazy_loading_loads_on_first_use(make_calculator, copy_tokenizer, load_calls):
+    copy_tokenizer('model-a')
+    copy_tokenizer('model-b')
+    root = copy_tokenizer('model-c', source='bpe-small')
+    calculator = make_calculator(tokenizers_dir=str(root), lazy=True)
+    assert load_calls == [] and calculator.registry_stats()['loaded_models'] == []
+
+    assert calculator.encode('hello', 'model-c').count > 0
+    assert load_calls == ['model-c'] and calculator.registry_stats()['loaded_models'] == ['model-c']
+
+    # 共享tokenizer的模型只加载一次（并行preload也一样）
+    calculator.preload(['model-a', 'model-b'])
+    assert len(load_calls) == 2
+    assert calculator.tokenizers['model-a'] is calculator.tokenizers['model-b']
+
+
+def test_memory_budget_evicts_least_recently_used(make_calculator, load_calls):
+    sizes = make_calculator(pool_size=1).tokenizer_bytes()
+    del load_calls[:]
+    # 预算只够同时保留一个实例
+    calculator = make_calculator(lazy=True, pool_size=1, memory_budget=max(sizes.values()) + 1)
+    text = 'memory budget 内存预算'
+    expected = {}
+    for model_key in ['bpe-chatml', 'bpe-small']:
+        expected[model_key] = calculator.encode(text, model_key).ids
+    stats = calculator.registry_stats()
+    assert stats['loaded_models'] == ['bpe-small'] and stats['evictions'] == 1
+    assert stats['estimated_bytes'] <= calculator.memory_budget
+
+    # 被卸载的模型再次使用时重新加载，结果不变
+    assert calculator.encode(text, 'bpe-chatml').ids == expected['bpe-chatml']
+    assert calculator.registry_stats()['loaded_models'] == ['bpe-chatml']
+    assert load_calls == ['bpe-chatml', 'bpe-small', 'bpe-chatml'] and calculator.evictions == 2
+    assert calculator.calculate_tokens(text) == {m: len(ids) for m, ids in expected.items()}
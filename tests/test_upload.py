@@ -0,0 +1,73 @@
+"""文件上传：原始请求体流式计数与表单文件，UTF-8/GBK编码检测"""
+
+import codecs
+import io
+
+import pytest
+
+from calculate_tokens import DECODE_READ_BYTES, SNIFF_BYTES
+
+
+TEXT = '上传的文件内容，包含中文与English words。\n第二行：数字123、标点「」。\n'
+# 超过一次读取的字节数，多字节字符会跨越读取边界
+LONG_TEXT = TEXT * (DECODE_READ_BYTES // len(TEXT.encode('gbk')) + 50)
+
+
+def _counts(data):
+    return {item['model']: item['token_count'] for item in data['results']}
+
+
+@pytest.mark.parametrize('text', [TEXT, LONG_TEXT], ids=['short', 'long'])
+@pytest.mark.parametrize('encoding, content_type', [
+    ('utf-8', 'application/octet-stream'),
+    ('gbk', 'application/octet-stream'),
+    ('gbk', 'text/plain'),
+])
+def test_raw_body_upload(client, calculator, text, encoding, content_type):
+    body = text.encode(encoding)
+    response = client.post('/api/calculate', data=body, content_type=content_type)
+    data = response.get_json()
+    assert response.status_code == 200 and data['success']
+    assert data['encoding'] == encoding and data['bytes'] == len(body)
+    assert data['text_length'] == len(text) and data['tokens_id'] is None
+    assert data['text_preview'] == text[:200] + ('...' if len(text) > 200 else '')
+    assert _counts(data) == calculator.calculate_tokens(text)
+
+
+def test_raw_body_models_and_bom(client, calculator):
+    body = codecs.BOM_UTF8 + TEXT.encode('utf-8')
+    response = client.post('/api/calculate?models=bpe-small', data=body, content_type='application/octet-stream')
+    data = response.get_json()
+    assert data['encoding'] == 'utf-8-sig' and data['text_length'] == len(TEXT)
+    assert _counts(data) == {'bpe-small': calculator.calculate_tokens(TEXT)['bpe-small']}
+
+    response = client.post('/api/calculate?models=no-such-model', data=body, content_type='application/octet-stream')
+    assert response.status_code == 400
+
+
+def test_raw_body_undecodable(client):
+    response = client.post('/api/calculate', data=b'\x80\xff' * 10, content_type='application/octet-stream')
+    assert response.status_code == 400 and not response.get_json()['success']
+
+    # 开头是合法的UTF-8，检测范围之后出现无法解码的内容
+    body = b'a' * (SNIFF_BYTES + 10) + b'\xff\xff'
+    response = client.post('/api/calculate', data=body, content_type='application/octet-stream')
+    assert response.status_code == 400 and 'utf-8' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'gbk'])
+def test_form_file_upload(client, calculator, encoding):
+    response = client.post('/api/calculate', data={
+        'file': (io.BytesIO(LONG_TEXT.encode(encoding)), 'upload.txt'),
+        'models': ['bpe-chatml'],
+    }, content_type='multipart/form-data')
+    data = response.get_json()
+    assert response.status_code == 200 and data['success']
+    assert data['text_length'] == len(LONG_TEXT)
+    assert _counts(data) == {'bpe-chatml': calculator.calculate_tokens(LONG_TEXT)['bpe-chatml']}
+
+
+def test_form_file_undecodable(client):
+    response = client.post('/api/calculate', data={'file': (io.BytesIO(b'\x80\xff' * 10), 'upload.bin')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
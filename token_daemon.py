@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+常驻守护进程 - 在本地Unix域套接字后保持已加载的TokenCalculator
+
+命令行每次运行都要导入tokenizer库并加载所有tokenizer，对一次毫秒级的计数来说开销过大。
+`python calculate_tokens.py --daemon` 启动守护进程后，命令行会自动把计数请求发给它，
+每次调用只需一次套接字往返；守护进程未运行时退回在进程内加载。
+
+协议：每个连接一个请求，按行分隔的JSON（NDJSON）
+- 请求第一行为 {"op": "ping" | "calculate" | "stream" | "shutdown", "models": [...], "backend": "auto", ...}；
+- calculate 的文本在第一行的 text 字段中；
+- stream 之后每行一个 {"text": 文本块}（应在安全切分点处切分），最后一行为 {"end": true}；
+- 响应为一行 {"ok": true, ...} 或 {"ok": false, "error": ..., "unsupported": 是否应改为在进程内计算}。
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# 套接字路径的环境变量（未设置时使用临时目录下按用户区分的路径）
+SOCKET_ENV = 'TOKEN_DAEMON_SOCKET'
+# 连接守护进程的超时时间（秒），连接后等待结果不设超时
+CONNECT_TIMEOUT = 1.0
+
+
+class DaemonUnavailable(Exception):
+    """守护进程未运行，或不支持本次请求（调用方应改为在进程内计算）"""
+
+
+class DaemonError(Exception):
+    """守护进程处理请求时出错"""
+
+
+def daemon_supported() -> bool:
+    """当前平台是否支持Unix域套接字"""
+    return hasattr(socket, 'AF_UNIX')
+
+
+def default_socket_path() -> str:
+    """守护进程的套接字路径"""
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+    return os.path.join(tempfile.gettempdir(), f'calculate-token-{user}.sock')
+
+
+class DaemonClient:
+    """守护进程客户端，接口与TokenCalculator的计数方法一致"""
+
+    def __init__(self, path: Optional[str] = None, models: Optional[List[str]] = None, backend: str = 'auto'):
+        """
+        Args:
+            path: 套接字路径，默认见default_socket_path
+            models: 要使用的模型列表，None表示守护进程加载的所有模型
+            backend: 要求的tokenizer后端（与守护进程不一致且不是auto时不使用守护进程）
+        """
+        self.path = path or default_socket_path()
+        self.models = models
+        self.backend = backend
+
+    def available(self) -> bool:
+        """套接字文件是否存在（不连接，守护进程不存在时不产生额外开销）"""
+        return daemon_supported() and os.path.exists(self.path)
+
+    def _connect(self) -> socket.socket:
+        if not daemon_supported():
+            raise DaemonUnavailable('当前平台不支持Unix域套接字')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise DaemonUnavailable(f'无法连接守护进程 {self.path}: {e}')
+        sock.settimeout(None)
+        return sock
+
+    def _request(self, header: Dict, lines: Iterable[Dict] = ()) -> Dict:
+        """
+        发送一个请求并读取响应
+
+        Args:
+            header: 请求的第一行
+            lines: 之后逐行发送的消息（流式请求）
+        """
+        header = dict(header, models=self.models, backend=self.backend)
+        with self._connect() as sock:
+            with sock.makefile('rwb') as stream:
+                try:
+                    stream.write(json.dumps(header, ensure_ascii=False).encode('utf-8') + b'\n')
+                    for line in lines:
+                        stream.write(json.dumps(line, ensure_ascii=False).encode('utf-8') + b'\n')
+                    stream.flush()
+                except BrokenPipeError:
+                    # 守护进程提前结束了请求（例如不支持），错误信息在响应中
+                    pass
+                response = stream.readline()
+        if not response:
+            raise DaemonError('守护进程没有返回结果')
+        result = json.loads(response)
+        if not result.get('ok'):
+            if result.get('unsupported'):
+                raise DaemonUnavailable(result.get('error'))
+            raise DaemonError(result.get('error'))
+        return result
+
+    def ping(self) -> Dict:
+        """守护进程的状态（进程号、后端、已加载的模型）"""
+        return self._request({'op': 'ping'})
+
+    def calculate_tokens(self, text: str) -> Dict[str, int]:
+        """计算文本的token数量（与TokenCalculator.calculate_tokens相同）"""
+        return self._request({'op': 'calculate', 'text': text})['results']
+
+    def calculate_tokens_stream(self, chunks: Iterable[str],
+                                models: Optional[List[str]] = None) -> Tuple[Dict[str, int], int]:
+        """流式计算token数量（与TokenCalculator.calculate_tokens_stream相同）"""
+        if models is not None:
+            self.models = models
+        # 先确认守护进程支持本次请求，不支持时文本块尚未读取，调用方可以改为在进程内计算
+        self.ping()
+        lines = ({'text': chunk} for chunk in chunks)
+        result = self._request({'op': 'stream'}, _with_end(lines))
+        return result['results'], result['chars']
+
+    def shutdown(self):
+        """让守护进程退出"""
+        self._request({'op': 'shutdown'})
+
+
+def _with_end(lines: Iterator[Dict]) -> Iterator[Dict]:
+    yield from lines
+    yield {'end': True}
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    """处理一个连接上的一个请求"""
+
+    def _reply(self, payload: Dict):
+        self.wfile.write(json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    def _iter_chunks(self) -> Iterator[str]:
+        for line in self.rfile:
+            message = json.loads(line)
+            if message.get('end'):
+                return
+            yield message['text']
+
+    def handle(self):
+        calculator = self.server.calculator
+        try:
+            line = self.rfile.readline()
+            if not line:
+                return
+            request = json.loads(line)
+            op = request.get('op')
+            models = request.get('models')
+            backend = request.get('backend') or 'auto'
+            if backend != 'auto' and backend != calculator.backend:
+                self._reply({'ok': False, 'unsupported': True,
+                             'error': f'守护进程使用的后端为 {calculator.backend}，请求的是 {backend}'})
+                return
+            if models is not None:
+                missing = [m for m in models if m not in calculator.usable_models()]
+                if missing:
+                    self._reply({'ok': False, 'unsupported': True, 'error': f'守护进程未加载模型: {missing}'})
+                    return
+
+            if op == 'ping':
+                self._reply({'ok': True, 'pid': os.getpid(), 'backend': calculator.backend,
+                             'models': calculator.usable_models()})
+            elif op == 'calculate':
+                results = {
+                    model_key: encoding.count if encoding is not None else -1
+                    for model_key, encoding in calculator.encode_all(request['text'], models).items()
+                }
+                self._reply({'ok': True, 'results': results})
+            elif op == 'stream':
+                results, char_count = calculator.calculate_tokens_stream(self._iter_chunks(), models)
+                self._reply({'ok': True, 'results': results, 'chars': char_count})
+            elif op == 'shutdown':
+                self._reply({'ok': True})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                self._reply({'ok': False, 'error': f'未知的操作: {op}'})
+        except Exception as e:
+            print(f"警告: 处理守护进程请求时出错: {e}", file=sys.stderr)
+            try:
+                self._reply({'ok': False, 'error': str(e)})
+            except OSError:
+                pass
+
+
+class TokenDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """多线程的Unix域套接字服务（每个连接一个线程，同一模型的并发编码由tokenizer实例池保证安全）"""
+
+    daemon_threads = True
+
+    def __init__(self, path: str, calculator):
+        self.calculator = calculator
+        super().__init__(path, _DaemonHandler)
+
+
+def _remove_stale_socket(path: str):
+    """删除残留的套接字文件；已有守护进程在监听时报错退出"""
+    if not os.path.exists(path):
+        return
+    try:
+        DaemonClient(path).ping()
+    except (DaemonUnavailable, DaemonError, ValueError):
+        os.unlink(path)
+        return
+    print(f"错误: 守护进程已在运行（{path}）", file=sys.stderr)
+    sys.exit(1)
+
+
+def serve(calculator, path: Optional[str] = None):
+    """
+    在前台运行守护进程，直到收到shutdown请求、SIGTERM或Ctrl+C
+
+    Args:
+        calculator: 已加载tokenizer的TokenCalculator
+        path: 套接字路径，默认见default_socket_path
+    """
+    if not daemon_supported():
+        print("错误: 当前平台不支持Unix域套接字，无法以守护进程模式运行", file=sys.stderr)
+        sys.exit(1)
+    path = path or default_socket_path()
+    _remove_stale_socket(path)
+
+    # 套接字只允许当前用户访问
+    old_umask = os.umask(0o077)
+    try:
+        server = TokenDaemon(path, calculator)
+    finally:
+        os.umask(old_umask)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f"守护进程已启动（PID {os.getpid()}），监听 {path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+        calculator.close()
+        print("守护进程已退出", file=sys.stderr)
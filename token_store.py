@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+编码结果暂存 - 保存一次计算请求的编码结果，供分页查询token详情
+
+/api/calculate默认只返回token数量，同时把各模型的编码结果放入暂存区并返回一个ID，
+前端再通过/api/tokens按页读取token字符串/ID。条目在一段时间未被访问后过期，
+总大小受字节预算限制，因此内存占用与响应大小取决于页大小，而不是文档大小。
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+# 每个暂存条目除编码结果外的固定开销估计（ID、字典等）
+ENTRY_OVERHEAD_BYTES = 512
+
+
+class TokenStore:
+    """线程安全的编码结果暂存区，按访问时间过期（TTL），超出字节预算时淘汰最久未使用的条目"""
+
+    def __init__(self, ttl_seconds: float, max_bytes: int):
+        """
+        Args:
+            ttl_seconds: 条目最后一次访问后保留的秒数
+            max_bytes: 所有条目的字节预算
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.expirations = 0
+        self.evictions = 0
+        # ID -> (各模型的编码结果, 字节数, 过期时间)，按最近访问排序
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size_of(encodings: Dict[str, Any]) -> int:
+        """编码结果的字节数（多个模型共享的同一个结果只计算一次）"""
+        unique = {id(encoding): encoding for encoding in encodings.values() if encoding is not None}
+        return sum(encoding.nbytes for encoding in unique.values()) + ENTRY_OVERHEAD_BYTES
+
+    def _expire(self, now: float):
+        """删除已过期的条目（调用方持有锁）"""
+        # 条目按访问时间排序，过期时间也单调递增，从头部开始删除即可
+        while self._entries:
+            handle, (_, size, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[handle]
+            self.current_bytes -= size
+            self.expirations += 1
+
+    def put(self, encodings: Dict[str, Any]) -> Optional[str]:
+        """
+        暂存一次请求的编码结果
+
+        Args:
+            encodings: 模型键名到EncodeResult（或None）的映射
+
+        Returns:
+            暂存ID；结果超过整个预算时不暂存，返回None
+        """
+        size = self._size_of(encodings)
+        if size > self.max_bytes:
+            return None
+        handle = secrets.token_urlsafe(12)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._entries[handle] = (encodings, size, now + self.ttl_seconds)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+        return handle
+
+    def get(self, handle: str) -> Optional[Dict[str, Any]]:
+        """
+        读取暂存的编码结果，并延长其过期时间
+
+        Args:
+            handle: put返回的暂存ID
+
+        Returns:
+            模型键名到EncodeResult的映射，不存在或已过期时返回None
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.pop(handle, None)
+            if entry is None:
+                return None
+            encodings, size, _ = entry
+            self._entries[handle] = (encodings, size, now + self.ttl_seconds)
+            return encodings
+
+    def resize(self, handle: str, value: Any):
+        """
+        条目内容原地修改后重新计算其字节数，超出预算时淘汰其他最久未使用的条目
+
+        Args:
+            handle: put返回的暂存ID
+            value: 修改后的条目内容
+        """
+        size = self._size_of(value)
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                return
+            _, old_size, expires_at = entry
+            self._entries[handle] = (value, size, expires_at)
+            self.current_bytes += size - old_size
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                if oldest == handle:
+                    self._entries.move_to_end(handle)
+                    continue
+                _, evicted_size, _ = self._entries.pop(oldest)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """暂存区统计信息"""
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'expirations': self.expirations,
+                'evictions': self.evictions
+            }
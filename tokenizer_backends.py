@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Tokenizer后端 - 统一TokenCalculator使用的编码/解码接口
+
+- tokenizers后端：直接用Rust tokenizers库加载tokenizer.json，不导入transformers/torch，
+  启动快、内存小；
+- transformers后端：AutoTokenizer，用于没有tokenizer.json的目录（作为备选）。
+
+两个库都在真正加载tokenizer时才导入。
+"""
+
+import copy
+import importlib.util
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from chat_template import select_template, token_content
+
+
+# 模板中可以使用的特殊token变量
+SPECIAL_TOKEN_NAMES = ['bos_token', 'eos_token', 'unk_token', 'pad_token']
+
+# transformers中通用tokenizer基类所在的模块（decode由这些模块定义时，单个ID的解码等于Rust端的解码）
+PLAIN_DECODE_MODULES = ('transformers.tokenization_utils',)
+# transformers初始化参数中与加载位置有关、不影响分词行为的项（计算指纹时忽略）
+LOCATION_SETTINGS = ('name_or_path', 'is_local', 'local_files_only', '_commit_hash')
+
+# 可选的后端名称
+BACKEND_AUTO = 'auto'
+BACKEND_TOKENIZERS = 'tokenizers'
+BACKEND_TRANSFORMERS = 'transformers'
+BACKENDS = [BACKEND_AUTO, BACKEND_TOKENIZERS, BACKEND_TRANSFORMERS]
+
+
+def is_available(backend: str) -> bool:
+    """判断后端依赖的库是否已安装（不导入该库）"""
+    return importlib.util.find_spec(backend) is not None
+
+
+def _hub_download(repo_id: str, filename: str, required: bool = False) -> Optional[str]:
+    """
+    从HuggingFace Hub下载模型仓库中的一个文件（已缓存时直接返回缓存路径）
+
+    Returns:
+        本地文件路径；文件不存在且required为False时返回None
+    """
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.utils import EntryNotFoundError
+
+    try:
+        return hf_hub_download(repo_id, filename)
+    except EntryNotFoundError:
+        if required:
+            raise
+        return None
+
+
+class TokenizersBackend:
+    """基于Rust tokenizers库的轻量后端"""
+
+    name = BACKEND_TOKENIZERS
+
+    def __init__(self, tokenizer, config: Optional[dict] = None):
+        """
+        Args:
+            tokenizer: tokenizers.Tokenizer实例
+            config: tokenizer_config.json的内容（可选）
+        """
+        # 计数时不应截断或补齐
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+        self.tokenizer = tokenizer
+        self.config = config or {}
+
+    @classmethod
+    def load(cls, source: str, local: bool) -> 'TokenizersBackend':
+        """
+        加载tokenizer
+
+        Args:
+            source: 本地目录（local=True）或HuggingFace Hub模型名
+            local: 是否从本地目录加载
+
+        Returns:
+            后端实例
+        """
+        from tokenizers import Tokenizer
+
+        if local:
+            path = Path(source)
+            tokenizer_file = path / 'tokenizer.json'
+            config_file = path / 'tokenizer_config.json'
+            template_file = path / 'chat_template.jinja'
+        else:
+            # 在线模式同样需要tokenizer_config.json（chat template、特殊token），从Hub下载到本地缓存
+            tokenizer_file = Path(_hub_download(source, 'tokenizer.json', required=True))
+            config_file = _hub_download(source, 'tokenizer_config.json')
+            template_file = _hub_download(source, 'chat_template.jinja')
+        tokenizer = Tokenizer.from_file(str(tokenizer_file))
+        config = {}
+        if config_file is not None and Path(config_file).exists():
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        # 较新的模型把chat template单独保存在chat_template.jinja中
+        if 'chat_template' not in config and template_file is not None and Path(template_file).exists():
+            config['chat_template'] = Path(template_file).read_text(encoding='utf-8')
+        return cls(tokenizer, config)
+
+    def __len__(self) -> int:
+        return self.tokenizer.get_vocab_size(with_added_tokens=True)
+
+    def encode(self, text: str, return_offsets: bool = False) -> Tuple[List[int], Optional[List[Tuple[int, int]]]]:
+        """
+        编码文本（不添加特殊token）
+
+        Returns:
+            (token ID列表, 字符偏移列表或None)
+        """
+        encoding = self.tokenizer.encode(text, add_special_tokens=False)
+        return encoding.ids, (encoding.offsets if return_offsets else None)
+
+    def encode_batch(self, texts: List[str], return_offsets: bool = False
+                     ) -> List[Tuple[List[int], Optional[List[Tuple[int, int]]]]]:
+        """
+        批量编码（Rust端并行处理）
+
+        Returns:
+            每个文本的(token ID列表, 字符偏移列表或None)
+        """
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [(encoding.ids, (encoding.offsets if return_offsets else None)) for encoding in encodings]
+
+    def decode_one(self, token_id: int) -> str:
+        """解码单个token为显示字符串"""
+        return self.tokenizer.decode([token_id], skip_special_tokens=False)
+
+    def display_pieces(self) -> List[str]:
+        """整个词表每个ID的显示字符串（Rust端批量解码）"""
+        return self.tokenizer.decode_batch([[i] for i in range(len(self))], skip_special_tokens=False)
+
+    def serialized(self) -> str:
+        """序列化后的tokenizer（用于计算指纹）"""
+        return self.tokenizer.to_str()
+
+    def settings(self) -> dict:
+        """tokenizer_config.json的内容（用于计算指纹）"""
+        return self.config
+
+    def chat_template(self) -> Optional[str]:
+        """tokenizer_config.json中的默认chat template，没有时返回None"""
+        return select_template(self.config.get('chat_template'))
+
+    def special_tokens(self) -> Dict[str, Optional[str]]:
+        """模板中使用的bos_token等特殊token文本"""
+        return {name: token_content(self.config.get(name)) for name in SPECIAL_TOKEN_NAMES}
+
+    def boundary_tokens(self) -> List[str]:
+        """编码时先被切开的特殊token（不吸收两侧空白），其后是安全切分点"""
+        return [
+            token.content for token in self.tokenizer.get_added_tokens_decoder().values()
+            if token.special and not token.lstrip and not token.rstrip
+        ]
+
+    def clone(self) -> 'TokenizersBackend':
+        """独立的副本（用于实例池，从序列化结果重新构建）"""
+        from tokenizers import Tokenizer
+
+        return TokenizersBackend(Tokenizer.from_str(self.tokenizer.to_str()), self.config)
+
+
+class TransformersBackend:
+    """基于transformers AutoTokenizer的后端"""
+
+    name = BACKEND_TRANSFORMERS
+
+    # 构建显示表后抽样与逐个decode对比的ID数量
+    VERIFY_SAMPLES = 256
+
+    def __init__(self, tokenizer):
+        """
+        Args:
+            tokenizer: transformers tokenizer实例
+        """
+        self.tokenizer = tokenizer
+
+    @classmethod
+    def load(cls, source: str, local: bool) -> 'TransformersBackend':
+        """
+        加载tokenizer
+
+        Args:
+            source: 本地目录（local=True）或HuggingFace Hub模型名
+            local: 是否从本地目录加载
+
+        Returns:
+            后端实例
+        """
+        from transformers import AutoTokenizer
+
+        if local:
+            return cls(AutoTokenizer.from_pretrained(source, trust_remote_code=True, local_files_only=True))
+        return cls(AutoTokenizer.from_pretrained(source, trust_remote_code=True))
+
+    def __len__(self) -> int:
+        return len(self.tokenizer)
+
+    def encode(self, text: str, return_offsets: bool = False) -> Tuple[List[int], Optional[List[Tuple[int, int]]]]:
+        """
+        编码文本（不添加特殊token）
+
+        Returns:
+            (token ID列表, 字符偏移列表或None)
+        """
+        if return_offsets:
+            try:
+                encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+                return encoding['input_ids'], [tuple(offset) for offset in encoding['offset_mapping']]
+            except NotImplementedError:
+                # 非fast tokenizer不支持offset mapping，退化为只返回token IDs
+                pass
+        return self.tokenizer.encode(text, add_special_tokens=False), None
+
+    def encode_batch(self, texts: List[str], return_offsets: bool = False
+                     ) -> List[Tuple[List[int], Optional[List[Tuple[int, int]]]]]:
+        """
+        批量编码（fast tokenizer在Rust端并行处理，其他tokenizer逐个编码）
+
+        Returns:
+            每个文本的(token ID列表, 字符偏移列表或None)
+        """
+        if getattr(self.tokenizer, 'is_fast', False):
+            encoding = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=return_offsets)
+            if return_offsets:
+                return [(ids, [tuple(offset) for offset in offsets])
+                        for ids, offsets in zip(encoding['input_ids'], encoding['offset_mapping'])]
+            return [(ids, None) for ids in encoding['input_ids']]
+        return [self.encode(text, return_offsets) for text in texts]
+
+    def decode_one(self, token_id: int) -> str:
+        """解码单个token为显示字符串"""
+        return self.tokenizer.decode([token_id], skip_special_tokens=False)
+
+    def _plain_decode(self) -> bool:
+        """
+        decode([id])是否就是Rust端tokenizer的解码结果
+
+        需要同时满足：是fast tokenizer、没有开启clean_up_tokenization_spaces（会改写" ,"、" n't"等），
+        decode/_decode没有被具体模型的子类或远程代码改写。
+        """
+        if getattr(self.tokenizer, 'backend_tokenizer', None) is None:
+            return False
+        if getattr(self.tokenizer, 'clean_up_tokenization_spaces', False):
+            return False
+        for name in ('decode', '_decode'):
+            owner = next((cls for cls in type(self.tokenizer).__mro__ if name in cls.__dict__), None)
+            if owner is None or not owner.__module__.startswith(PLAIN_DECODE_MODULES):
+                return False
+        return True
+
+    def display_pieces(self) -> List[str]:
+        """
+        整个词表每个ID的显示字符串
+
+        decode不做额外处理时（见_plain_decode），使用Rust端的decode_batch一次解码整个词表，
+        再抽样与逐个decode的结果对比作为额外检查；否则（或抽样不一致时）逐个decode，
+        保证与decode结果完全一致。
+        """
+        vocab_size = len(self)
+        if self._plain_decode():
+            pieces = self.tokenizer.backend_tokenizer.decode_batch([[i] for i in range(vocab_size)],
+                                                                   skip_special_tokens=False)
+            step = max(1, vocab_size // self.VERIFY_SAMPLES)
+            sample_ids = list(range(0, vocab_size, step)) + list(getattr(self.tokenizer, 'all_special_ids', []))
+            if all(pieces[i] == self.decode_one(i) for i in sample_ids if i < vocab_size):
+                return pieces
+        return [self.decode_one(i) for i in range(vocab_size)]
+
+    def serialized(self) -> Optional[str]:
+        """序列化后的tokenizer（用于计算指纹），非fast tokenizer返回None"""
+        backend = getattr(self.tokenizer, 'backend_tokenizer', None)
+        return backend.to_str() if backend is not None else None
+
+    def settings(self) -> dict:
+        """tokenizer类和初始化参数（即tokenizer_config.json的内容，不含加载位置），用于计算指纹"""
+        settings = {key: value for key, value in self.tokenizer.init_kwargs.items()
+                    if key not in LOCATION_SETTINGS and not key.endswith('_file')}
+        cls = type(self.tokenizer)
+        settings['tokenizer_class'] = f'{cls.__module__}.{cls.__qualname__}'
+        return settings
+
+    def chat_template(self) -> Optional[str]:
+        """tokenizer的默认chat template，没有时返回None"""
+        return select_template(getattr(self.tokenizer, 'chat_template', None))
+
+    def special_tokens(self) -> Dict[str, Optional[str]]:
+        """模板中使用的bos_token等特殊token文本"""
+        return {name: getattr(self.tokenizer, name, None) for name in SPECIAL_TOKEN_NAMES}
+
+    def boundary_tokens(self) -> List[str]:
+        """编码时先被切开的特殊token（不吸收两侧空白），其后是安全切分点"""
+        added = getattr(self.tokenizer, 'added_tokens_decoder', {})
+        return [
+            token.content for token in added.values()
+            if getattr(token, 'special', False) and not token.lstrip and not token.rstrip
+        ]
+
+    def clone(self) -> 'TransformersBackend':
+        """独立的副本（用于实例池，深拷贝包括Rust端的tokenizer）"""
+        return TransformersBackend(copy.deepcopy(self.tokenizer))
+
+
+def load_backend(source: str, local: bool, backend: str = BACKEND_AUTO):
+    """
+    按指定后端加载tokenizer
+
+    auto：本地目录有tokenizer.json（或在线模式）且安装了tokenizers库时使用tokenizers后端，
+    加载失败或没有tokenizer.json时退回transformers后端。
+
+    Args:
+        source: 本地目录（local=True）或HuggingFace Hub模型名
+        local: 是否从本地目录加载
+        backend: 后端名称（auto/tokenizers/transformers）
+
+    Returns:
+        后端实例
+    """
+    if backend == BACKEND_TOKENIZERS:
+        return TokenizersBackend.load(source, local)
+    if backend == BACKEND_TRANSFORMERS:
+        return TransformersBackend.load(source, local)
+
+    has_tokenizer_json = not local or (Path(source) / 'tokenizer.json').exists()
+    if has_tokenizer_json and is_available(BACKEND_TOKENIZERS):
+        try:
+            return TokenizersBackend.load(source, local)
+        except Exception as e:
+            if not is_available(BACKEND_TRANSFORMERS):
+                raise
+            print(f"  tokenizers后端加载失败（{e}），改用transformers")
+    return TransformersBackend.load(source, local)
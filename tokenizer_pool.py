@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tokenizer实例池 - 每个tokenizer（按指纹）维护有上限的克隆实例，编码时借出独占使用
+
+多个线程共用同一个tokenizer实例编码时，HF fast tokenizer在设置截断/补齐状态时会
+报"Already borrowed"，或在实例内部串行执行。实例池让每次编码独占一个实例：
+空闲实例直接借出；没有空闲实例且未达到上限时克隆一个新实例；达到上限后等待归还。
+克隆按需进行，单线程使用时只有原始实例，不增加内存。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+
+class TokenizerPool:
+    """同一tokenizer的有上限实例池（线程安全）"""
+
+    def __init__(self, prototype, max_size: int):
+        """
+        Args:
+            prototype: 已加载的tokenizer后端（池中的第一个实例，克隆的来源）
+            max_size: 实例数上限（含原始实例），1表示所有编码共用原始实例并依次执行
+        """
+        self.prototype = prototype
+        self.max_size = max(1, max_size)
+        self._idle: List[Any] = [prototype]
+        self._created = 1
+        self._cond = threading.Condition()
+        # 统计
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.clone_errors = 0
+
+    @property
+    def size(self) -> int:
+        """当前实例数（含原始实例）"""
+        return self._created
+
+    def _acquire(self):
+        """借出一个实例，需要时克隆或等待"""
+        with self._cond:
+            self.checkouts += 1
+            if self._idle:
+                return self._idle.pop()
+            if self._created >= self.max_size:
+                self.waits += 1
+                start = time.perf_counter()
+                while not self._idle:
+                    self._cond.wait()
+                self.wait_seconds += time.perf_counter() - start
+                return self._idle.pop()
+            # 先占用名额，在锁外克隆（克隆要重新解析整个tokenizer，较慢）
+            self._created += 1
+        try:
+            return self.prototype.clone()
+        except Exception as e:
+            print(f"警告: 克隆tokenizer失败，改为等待空闲实例: {e}")
+            with self._cond:
+                self._created -= 1
+                self.clone_errors += 1
+                # 不再尝试克隆，避免每次借出都失败一次
+                self.max_size = self._created
+                while not self._idle:
+                    self._cond.wait()
+                return self._idle.pop()
+
+    def _release(self, tokenizer):
+        """归还实例"""
+        with self._cond:
+            self._idle.append(tokenizer)
+            self._cond.notify()
+
+    @contextmanager
+    def checkout(self) -> Iterator[Any]:
+        """
+        借出一个实例，在with块内独占使用
+
+        Yields:
+            tokenizer后端
+        """
+        tokenizer = self._acquire()
+        try:
+            yield tokenizer
+        finally:
+            self._release(tokenizer)
+
+    def stats(self) -> Dict[str, Any]:
+        """实例池统计信息"""
+        with self._cond:
+            return {
+                'size': self._created,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_ms': round(self.wait_seconds * 1000, 3),
+                'clone_errors': self.clone_errors
+            }
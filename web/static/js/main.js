@@ -2,6 +2,9 @@
 let availableModels = [];
 let selectedModels = [];
 
+// 超过该大小（字节）的文件以原始请求体流式上传：服务端边接收边计数，只返回token数量
+const RAW_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+
 // DOM元素
 const textInput = document.getElementById('text-input');
 const fileInput = document.getElementById('file-input');
@@ -45,14 +48,7 @@ function setupEventListeners() {
     fileInput.addEventListener('change', (e) => {
         const file = e.target.files[0];
         if (file) {
-            fileName.textContent = `已选择: ${file.name}`;
-            // 读取文件内容
-            const reader = new FileReader();
-            reader.onload = (event) => {
-                textInput.value = event.target.result;
-                updateCharCount();
-            };
-            reader.readAsText(file, 'UTF-8');
+            showSelectedFile(file);
         }
     });
 
@@ -73,13 +69,7 @@ function setupEventListeners() {
         const file = e.dataTransfer.files[0];
         if (file) {
             fileInput.files = e.dataTransfer.files;
-            fileName.textContent = `已选择: ${file.name}`;
-            const reader = new FileReader();
-            reader.onload = (event) => {
-                textInput.value = event.target.result;
-                updateCharCount();
-            };
-            reader.readAsText(file, 'UTF-8');
+            showSelectedFile(file);
         }
     });
 
@@ -98,6 +88,41 @@ function setupEventListeners() {
     });
 }
 
+// 显示选中的文件，小文件读入文本框（大文件不读入浏览器，计算时直接流式上传）
+function showSelectedFile(file) {
+    if (file.size > RAW_UPLOAD_THRESHOLD) {
+        fileName.textContent = `已选择: ${file.name}（${(file.size / 1024 / 1024).toFixed(1)} MB，将流式上传，只统计token数量）`;
+        textInput.value = '';
+        charCount.textContent = '大文件不在此预览';
+        return;
+    }
+    fileName.textContent = `已选择: ${file.name}`;
+    // 读取文件内容
+    const reader = new FileReader();
+    reader.onload = (event) => {
+        textInput.value = event.target.result;
+        updateCharCount();
+    };
+    reader.readAsText(file, 'UTF-8');
+}
+
+// 大文件以原始请求体上传，模型通过查询参数指定
+async function uploadLargeFile(file) {
+    const params = new URLSearchParams();
+    selectedModels.forEach(model => params.append('models', model));
+    const response = await fetch(`/api/calculate?${params}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/octet-stream' },
+        body: file
+    });
+    const data = await response.json();
+    if (data.success) {
+        displayResults(data);
+    } else {
+        showError(data.error || '计算失败');
+    }
+}
+
 // 更新字符计数
 function updateCharCount() {
     const count = textInput.value.length;
@@ -109,6 +134,18 @@ async function loadModels() {
     try {
         const response = await fetch('/api/models');
         
+        // 服务正在后台加载tokenizer，按Retry-After稍后重试
+        if (response.status === 503) {
+            const data = await response.json().catch(() => ({}));
+            if (data.status !== 'error') {
+                const retryAfter = parseInt(response.headers.get('Retry-After') || '5', 10);
+                modelList.innerHTML = '<div class="loading">服务正在加载tokenizer，请稍候...</div>';
+                setTimeout(loadModels, retryAfter * 1000);
+                return;
+            }
+            throw new Error(data.error || `HTTP错误: ${response.status}`);
+        }
+        
         if (!response.ok) {
             throw new Error(`HTTP错误: ${response.status}`);
         }
@@ -205,6 +242,15 @@ async function handleCalculate() {
     calculateBtn.querySelector('.btn-loading').style.display = 'inline';
 
     try {
+        if (file && file.size > RAW_UPLOAD_THRESHOLD) {
+            await uploadLargeFile(file);
+            return;
+        }
+        // 已有编辑会话时只发送修改；首次提交（或会话失效、模型改变）仍走下面的流式计算
+        if (!file && await calculateWithSession(text)) {
+            return;
+        }
+
         const formData = new FormData();
         if (file) {
             formData.append('file', file);
@@ -215,17 +261,28 @@ async function handleCalculate() {
             formData.append('models', model);
         });
 
+        // 以NDJSON流式获取结果，每个模型编码完成后立即显示
+        formData.append('stream', 'ndjson');
+
         const response = await fetch('/api/calculate', {
             method: 'POST',
             body: formData
         });
 
-        const data = await response.json();
-
-        if (data.success) {
-            displayResults(data);
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.includes('application/x-ndjson') && response.body) {
+            await readResultStream(response);
         } else {
-            showError(data.error || '计算失败');
+            const data = await response.json();
+            if (data.success) {
+                displayResults(data);
+            } else {
+                showError(data.error || '计算失败');
+            }
+        }
+        if (!file) {
+            // 结果显示后在后台创建编辑会话，之后的修改只重新编码修改位置附近的片段
+            startEditSession(text);
         }
     } catch (error) {
         showError(`计算时出错: ${error.message}`);
@@ -237,6 +294,116 @@ async function handleCalculate() {
     }
 }
 
+// 文本输入的增量编码会话：再次计算时只发送与上次文本的差异，服务端只重新编码修改位置附近的片段
+let editSession = null;  // { id, version, text, models }
+let pendingSession = null;  // 正在后台创建的会话请求
+
+// 是否为UTF-16代理对的高位/低位
+function isHighSurrogate(code) {
+    return code >= 0xD800 && code <= 0xDBFF;
+}
+
+function isLowSurrogate(code) {
+    return code >= 0xDC00 && code <= 0xDFFF;
+}
+
+// 文本的Unicode码点数（服务端的位置和长度以码点计）
+function codePointLength(text) {
+    let length = text.length;
+    for (let i = 1; i < text.length; i++) {
+        if (isLowSurrogate(text.charCodeAt(i)) && isHighSurrogate(text.charCodeAt(i - 1))) {
+            length--;
+        }
+    }
+    return length;
+}
+
+// 比较公共前缀和后缀，得到把oldText改为newText的一次编辑（相同时返回null）
+function diffText(oldText, newText) {
+    const maxPrefix = Math.min(oldText.length, newText.length);
+    let prefix = 0;
+    while (prefix < maxPrefix && oldText.charCodeAt(prefix) === newText.charCodeAt(prefix)) {
+        prefix++;
+    }
+    if (prefix === oldText.length && prefix === newText.length) {
+        return null;
+    }
+    // 不在代理对中间切开
+    if (prefix > 0 && isHighSurrogate(oldText.charCodeAt(prefix - 1))) {
+        prefix--;
+    }
+    const maxSuffix = maxPrefix - prefix;
+    let suffix = 0;
+    while (suffix < maxSuffix &&
+           oldText.charCodeAt(oldText.length - 1 - suffix) === newText.charCodeAt(newText.length - 1 - suffix)) {
+        suffix++;
+    }
+    if (suffix > 0 && isLowSurrogate(oldText.charCodeAt(oldText.length - suffix))) {
+        suffix--;
+    }
+    return {
+        offset: codePointLength(oldText.slice(0, prefix)),
+        delete: codePointLength(oldText.slice(prefix, oldText.length - suffix)),
+        insert: newText.slice(prefix, newText.length - suffix)
+    };
+}
+
+// 在后台为已计算的文本创建编辑会话（不显示结果，失败时下次仍走完整计算）
+function startEditSession(text) {
+    const models = selectedModels.join(',');
+    editSession = null;
+    const pending = fetch('/api/session', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ text, models: selectedModels, include_tokens_id: false })
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (pendingSession === pending && data.success) {
+                editSession = { id: data.session_id, version: data.version, text, models };
+            }
+        })
+        .catch(() => {})
+        .finally(() => {
+            if (pendingSession === pending) {
+                pendingSession = null;
+            }
+        });
+    pendingSession = pending;
+}
+
+// 计算文本输入：模型不变且会话仍有效时只发送修改并返回true，否则返回false（由调用方完整计算）
+async function calculateWithSession(text) {
+    if (pendingSession) {
+        await pendingSession;
+    }
+    const models = selectedModels.join(',');
+    if (!editSession || editSession.models !== models) {
+        return false;
+    }
+    const edit = diffText(editSession.text, text);
+    const response = await fetch(`/api/session/${encodeURIComponent(editSession.id)}/edit`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ version: editSession.version, edits: edit ? [edit] : [] })
+    });
+    // 会话已过期（404）或版本不一致（409）时改为完整计算
+    if (response.status === 404 || response.status === 409) {
+        editSession = null;
+        return false;
+    }
+    const data = await response.json();
+    if (data.success) {
+        editSession.version = data.version;
+        editSession.text = text;
+        displayResults(data);
+    } else {
+        editSession = null;
+        showError(data.error || '计算失败');
+    }
+    return true;
+}
+
 // 所有成对符号配置
 // 分为两类：开闭不同的符号，开闭相同的符号
 const PAIR_SYMBOLS = {
@@ -382,84 +549,322 @@ function highlightBracketsAndMarkers(tokens) {
     return pairInfo;
 }
 
-// 显示结果
-function displayResults(data) {
+// 逐行读取NDJSON结果流，按事件逐步更新结果表格
+async function readResultStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    const handleLine = (line) => {
+        if (!line.trim()) return;
+        const event = JSON.parse(line);
+        if (event.type === 'start') {
+            startResults(event);
+        } else if (event.type === 'result') {
+            updateResultRow(event);
+        } else if (event.type === 'error') {
+            markResultError(event.model, event.error);
+        } else if (event.type === 'done') {
+            finishResults(event);
+        }
+    };
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
+    }
+    handleLine(buffer + decoder.decode());
+}
+
+// 当前显示的结果：模型 -> 结果，以及模型在表格中的行号
+let currentResults = new Map();
+let currentRowIndex = new Map();
+let currentTextLength = 0;
+
+// 开始显示一次计算结果：摘要和每个模型的占位行
+function startResults(data) {
     // 显示结果区域
     resultsSection.style.display = 'block';
     resultsSection.scrollIntoView({ behavior: 'smooth', block: 'start' });
 
-    // 更新摘要
-    const avgTokens = data.results.length > 0
-        ? Math.round(data.results.reduce((sum, r) => sum + r.token_count, 0) / data.results.length)
+    // 关闭上一次结果的token视图（释放缓存的页面）
+    tokenViewers.forEach(viewer => viewer.destroy());
+    tokenViewers = [];
+    currentResults = new Map();
+    currentRowIndex = new Map();
+    currentTextLength = data.text_length;
+
+    // 每个模型一行，结果到达前显示为计算中
+    resultsTbody.innerHTML = data.models.map((model, index) => {
+        currentRowIndex.set(model, index);
+        return `
+            <tr id="result-row-${index}">
+                <td class="model-name">${escapeHtml(model)}</td>
+                <td class="token-count">计算中...</td>
+                <td>-</td>
+                <td>
+                    <div class="token-preview" id="token-preview-${index}"></div>
+                    <div class="token-preview-status" id="token-preview-status-${index}"></div>
+                </td>
+            </tr>
+        `;
+    }).join('');
+    updateSummary();
+}
+
+// 更新摘要（平均Token数只统计已完成的模型）
+function updateSummary() {
+    const results = Array.from(currentResults.values());
+    const avgTokens = results.length > 0
+        ? Math.round(results.reduce((sum, r) => sum + r.token_count, 0) / results.length)
         : 0;
 
     resultsSummary.innerHTML = `
         <div class="summary-item">
             <div class="summary-label">文本长度</div>
-            <div class="summary-value">${data.text_length.toLocaleString()} 字符</div>
+            <div class="summary-value">${currentTextLength.toLocaleString()} 字符</div>
         </div>
         <div class="summary-item">
             <div class="summary-label">计算模型数</div>
-            <div class="summary-value">${data.results.length}</div>
+            <div class="summary-value">${results.length} / ${currentRowIndex.size}</div>
         </div>
         <div class="summary-item">
             <div class="summary-label">平均Token数</div>
             <div class="summary-value">${avgTokens.toLocaleString()}</div>
         </div>
     `;
+}
 
-    // 更新表格
-    resultsTbody.innerHTML = data.results.map(result => {
-        const tokenPreview = result.token_preview || [];
-        const totalTokens = result.token_count || 0;
-        const previewCount = result.preview_count || tokenPreview.length;
-        
-        // 高亮括号和起止符号
-        const pairInfo = highlightBracketsAndMarkers(tokenPreview);
-        
-        // 显示所有token（不再限制为100个）
-        const previewHtml = tokenPreview.length > 0
-            ? tokenPreview.map((token, index) => {
-                // 转义HTML特殊字符
-                const escapedToken = token
-                    .replace(/&/g, '&amp;')
-                    .replace(/</g, '&lt;')
-                    .replace(/>/g, '&gt;')
-                    .replace(/"/g, '&quot;')
-                    .replace(/'/g, '&#039;');
-                
-                // 获取配对信息
-                const pair = pairInfo[index];
-                let className = 'token-item';
-                if (pair) {
-                    className += ` bracket-pair-${pair.pairIndex % 8}`;
-                }
-                
-                return `<span class="${className}" title="${escapedToken}">${escapedToken}</span>`;
-            }).join('')
-            : '<span class="text-tertiary">无预览</span>';
-
-        // 如果后端只返回了部分token，显示提示信息
-        const moreTokens = totalTokens > previewCount
-            ? `<div style="margin-top: 0.5rem; padding-top: 0.5rem; border-top: 1px solid var(--border-color); color: var(--text-secondary); font-size: 0.875rem;">
-                 <strong>提示：</strong>后端仅返回了前 ${previewCount} 个token的预览，实际共有 ${totalTokens.toLocaleString()} 个token
-               </div>`
-            : '';
+// 某个模型的结果到达：填充该行的token数量和字符/Token比率
+function updateResultRow(result) {
+    const index = currentRowIndex.get(result.model);
+    const row = document.getElementById(`result-row-${index}`);
+    if (index === undefined || !row) return;
+    currentResults.set(result.model, result);
+
+    const totalTokens = result.token_count || 0;
+    row.children[1].textContent = totalTokens.toLocaleString();
+    row.children[2].textContent = result.char_per_token.toFixed(2);
+    document.getElementById(`token-preview-${index}`).innerHTML = '<span class="text-tertiary">加载中...</span>';
+    updateSummary();
+}
 
-        return `
-            <tr>
-                <td class="model-name">${result.model}</td>
-                <td class="token-count">${totalTokens.toLocaleString()}</td>
-                <td>${result.char_per_token.toFixed(2)}</td>
-                <td>
-                    <div class="token-preview">
-                        ${previewHtml}
-                        ${moreTokens}
-                    </div>
-                </td>
-            </tr>
+// 某个模型计算失败
+function markResultError(model, message) {
+    const index = currentRowIndex.get(model);
+    const row = document.getElementById(`result-row-${index}`);
+    if (index === undefined || !row) return;
+    row.children[1].textContent = '失败';
+    document.getElementById(`token-preview-${index}`).innerHTML =
+        `<span class="text-tertiary">${escapeHtml(message || '计算失败')}</span>`;
+}
+
+// 所有模型计算完成：创建分词预览（分页获取需要暂存ID）
+function finishResults(done) {
+    currentResults.forEach((result, model) => {
+        const index = currentRowIndex.get(model);
+        tokenViewers.push(new TokenViewer(
+            document.getElementById(`token-preview-${index}`),
+            document.getElementById(`token-preview-status-${index}`),
+            {
+                tokensId: done.tokens_id,
+                model: result.model,
+                totalTokens: result.token_count || 0,
+                // 请求了include_tokens时，结果中已包含全部token，不再向服务端分页获取
+                tokens: result.token_preview || null
+            }
+        ));
+    });
+}
+
+// 显示一次性返回（非流式）的结果
+function displayResults(data) {
+    startResults({ text_length: data.text_length, models: data.results.map(r => r.model) });
+    data.results.forEach(updateResultRow);
+    finishResults({ tokens_id: data.tokens_id });
+}
+
+// 当前结果的token视图
+let tokenViewers = [];
+
+// 每次从服务端获取的token数量
+const TOKEN_PAGE_SIZE = 1000;
+// 每个视图最多缓存的页数（超出时丢弃最久未使用的页）
+const TOKEN_PAGE_CACHE = 8;
+// 每行显示的token数和行高（像素），固定行高才能由滚动位置直接算出可见的token范围
+const TOKENS_PER_ROW = 6;
+const TOKEN_ROW_HEIGHT = 30;
+// 可见区域上下额外渲染的行数，减少快速滚动时的空白
+const TOKEN_OVERSCAN_ROWS = 5;
+
+// 转义HTML特殊字符
+function escapeHtml(text) {
+    return text
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#039;');
+}
+
+// 虚拟滚动的token视图：只渲染可见的行，滚动时按需获取token页
+// DOM节点数和每帧的渲染量只取决于可见区域大小，与文档长度无关
+class TokenViewer {
+    constructor(container, statusElement, options) {
+        this.container = container;
+        this.statusElement = statusElement;
+        this.tokensId = options.tokensId;
+        this.model = options.model;
+        this.totalTokens = options.totalTokens;
+        this.localTokens = options.tokens;
+        this.pages = new Map();     // 页号 -> { tokens, pairInfo }，Map的插入顺序即最近使用顺序
+        this.pending = new Map();   // 页号 -> 正在进行的请求
+        this.frameRequested = false;
+        this.destroyed = false;
+
+        if (this.totalTokens === 0) {
+            this.container.innerHTML = '<span class="text-tertiary">无预览</span>';
+            return;
+        }
+        if (!this.tokensId && !this.localTokens) {
+            this.container.innerHTML = '<span class="text-tertiary">服务端未保存该次计算的分词详情（流式上传的大文件或编码结果过大）</span>';
+            return;
+        }
+
+        // 撑开滚动高度的占位元素 + 绝对定位的可见行窗口
+        const rowCount = Math.ceil(this.totalTokens / TOKENS_PER_ROW);
+        this.container.classList.add('virtualized');
+        this.container.innerHTML = `
+            <div class="token-spacer" style="height: ${rowCount * TOKEN_ROW_HEIGHT}px"></div>
+            <div class="token-window"></div>
         `;
-    }).join('');
+        this.window = this.container.querySelector('.token-window');
+        this.onScroll = () => this.scheduleRender();
+        this.container.addEventListener('scroll', this.onScroll, { passive: true });
+        this.scheduleRender();
+    }
+
+    destroy() {
+        this.destroyed = true;
+        if (this.onScroll) {
+            this.container.removeEventListener('scroll', this.onScroll);
+        }
+        this.pages.clear();
+    }
+
+    // 每帧最多渲染一次
+    scheduleRender() {
+        if (this.frameRequested || this.destroyed) return;
+        this.frameRequested = true;
+        requestAnimationFrame(() => {
+            this.frameRequested = false;
+            this.render();
+        });
+    }
+
+    // 当前可见（含上下预留行）的token范围 [start, end)
+    visibleRange() {
+        const rowCount = Math.ceil(this.totalTokens / TOKENS_PER_ROW);
+        const firstRow = Math.max(0, Math.floor(this.container.scrollTop / TOKEN_ROW_HEIGHT) - TOKEN_OVERSCAN_ROWS);
+        const visibleRows = Math.ceil((this.container.clientHeight || 300) / TOKEN_ROW_HEIGHT);
+        const lastRow = Math.min(rowCount, firstRow + visibleRows + 2 * TOKEN_OVERSCAN_ROWS);
+        return {
+            firstRow: firstRow,
+            start: firstRow * TOKENS_PER_ROW,
+            end: Math.min(this.totalTokens, lastRow * TOKENS_PER_ROW)
+        };
+    }
+
+    render() {
+        if (this.destroyed) return;
+        const { firstRow, start, end } = this.visibleRange();
+        const firstPage = Math.floor(start / TOKEN_PAGE_SIZE);
+        const lastPage = Math.floor(Math.max(start, end - 1) / TOKEN_PAGE_SIZE);
+
+        const rows = [];
+        let row = [];
+        for (let i = start; i < end; i++) {
+            const page = this.getPage(Math.floor(i / TOKEN_PAGE_SIZE));
+            const offset = i % TOKEN_PAGE_SIZE;
+            if (page && offset < page.tokens.length) {
+                const escapedToken = escapeHtml(page.tokens[offset]);
+                const pair = page.pairInfo[offset];
+                const className = pair ? `token-item bracket-pair-${pair.pairIndex % 8}` : 'token-item';
+                row.push(`<span class="${className}" title="#${i} ${escapedToken}">${escapedToken}</span>`);
+            } else {
+                row.push('<span class="token-item token-placeholder">…</span>');
+            }
+            if (row.length === TOKENS_PER_ROW || i === end - 1) {
+                rows.push(`<div class="token-row">${row.join('')}</div>`);
+                row = [];
+            }
+        }
+        this.window.style.transform = `translateY(${firstRow * TOKEN_ROW_HEIGHT}px)`;
+        this.window.innerHTML = rows.join('');
+
+        this.statusElement.textContent = end > start
+            ? `第 ${(start + 1).toLocaleString()}–${end.toLocaleString()} 个，共 ${this.totalTokens.toLocaleString()} 个token`
+            : '';
+
+        // 获取可见范围内缺少的页
+        for (let pageIndex = firstPage; pageIndex <= lastPage; pageIndex++) {
+            if (!this.pages.has(pageIndex)) {
+                this.fetchPage(pageIndex);
+            }
+        }
+    }
+
+    // 读取已缓存的页并标记为最近使用
+    getPage(pageIndex) {
+        const page = this.pages.get(pageIndex);
+        if (page) {
+            this.pages.delete(pageIndex);
+            this.pages.set(pageIndex, page);
+        }
+        return page;
+    }
+
+    storePage(pageIndex, tokens) {
+        // 括号高亮按页计算，跨页的配对不做高亮
+        this.pages.set(pageIndex, { tokens: tokens, pairInfo: highlightBracketsAndMarkers(tokens) });
+        while (this.pages.size > TOKEN_PAGE_CACHE) {
+            this.pages.delete(this.pages.keys().next().value);
+        }
+    }
+
+    async fetchPage(pageIndex) {
+        if (this.pending.has(pageIndex)) return;
+        const offset = pageIndex * TOKEN_PAGE_SIZE;
+
+        if (this.localTokens) {
+            this.storePage(pageIndex, this.localTokens.slice(offset, offset + TOKEN_PAGE_SIZE));
+            this.scheduleRender();
+            return;
+        }
+
+        const params = new URLSearchParams({ id: this.tokensId, model: this.model, offset: offset, limit: TOKEN_PAGE_SIZE });
+        const request = fetch(`/api/tokens?${params}`).then(response => response.json());
+        this.pending.set(pageIndex, request);
+        try {
+            const data = await request;
+            if (!data.success) {
+                throw new Error(data.error || '未知错误');
+            }
+            if (this.destroyed) return;
+            this.storePage(pageIndex, data.tokens);
+            this.scheduleRender();
+        } catch (error) {
+            if (!this.destroyed) {
+                this.statusElement.textContent = `分词预览加载失败: ${error.message}`;
+            }
+        } finally {
+            this.pending.delete(pageIndex);
+        }
+    }
 }
 
 // 显示错误消息